@@ -0,0 +1,383 @@
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models import CrowdDensityLevel, CrowdSignalType, TrendDirection, DataSource
+
+
+# =============================================================================
+# ENUM <-> CODE MAPPINGS
+# =============================================================================
+
+DENSITY_LEVELS: List[CrowdDensityLevel] = list(CrowdDensityLevel)  # code = index
+DENSITY_CODE: Dict[CrowdDensityLevel, int] = {d: i for i, d in enumerate(DENSITY_LEVELS)}
+
+# signed so the periodic evolution is density += trend
+TREND_CODE: Dict[TrendDirection, int] = {
+    TrendDirection.DECREASING: -1,
+    TrendDirection.STABLE: 0,
+    TrendDirection.INCREASING: 1,
+    TrendDirection.UNKNOWN: 2,
+}
+TREND_BY_CODE: Dict[int, TrendDirection] = {c: t for t, c in TREND_CODE.items()}
+
+# density a user signal reports (trend signals report none)
+SIGNAL_DENSITY: Dict[CrowdSignalType, CrowdDensityLevel] = {
+    CrowdSignalType.VERY_CROWDED: CrowdDensityLevel.VERY_HIGH,
+    CrowdSignalType.RELATIVELY_EMPTY: CrowdDensityLevel.LOW,
+}
+
+SOURCES: List[DataSource] = list(DataSource)
+SOURCE_CODE: Dict[DataSource, int] = {s: i for i, s in enumerate(SOURCES)}
+
+DEFAULT_COACHES = [f"C{i}" for i in range(1, 13)]
+
+
+def _iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(ts).isoformat()
+
+
+class CrowdStore:
+    """
+    Columnar live crowd state.
+
+    Stations map to rows, coaches to columns of fixed-size NumPy arrays:
+        density     int8     (index into DENSITY_LEVELS)
+        trend       int8     (TREND_CODE)
+        confidence  float32
+        reports     int32    (user_reports_count)
+        updated     float64  (epoch seconds)
+        source      int8     (index into SOURCES)
+        fused_sum / fused_weight / fused_ts  float64
+                    (decayed running estimate, see CrowdFusionEngine)
+    plus per-station overall density / timestamp and density_sum, the
+    running sum of the row's coach density codes. density_sum is kept in
+    step by every density write (put_station, set_density, evolve), so a
+    station's mean density is one read instead of a scan of its coaches.
+    Rows grow by doubling and removed stations are compacted by moving the
+    last row into the gap.
+    """
+
+    def __init__(self, coach_ids: Sequence[str] = DEFAULT_COACHES, capacity: int = 64):
+        self.coach_ids: List[str] = list(coach_ids)
+        self.coach_index: Dict[str, int] = {c: i for i, c in enumerate(self.coach_ids)}
+        self.station_ids: List[str] = []
+        self.station_index: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        shape = (capacity, len(self.coach_ids))
+        self.density = np.zeros(shape, dtype=np.int8)
+        self.trend = np.zeros(shape, dtype=np.int8)
+        self.confidence = np.zeros(shape, dtype=np.float32)
+        self.reports = np.zeros(shape, dtype=np.int32)
+        self.updated = np.zeros(shape, dtype=np.float64)
+        self.source = np.zeros(shape, dtype=np.int8)
+        self.fused_sum = np.zeros(shape, dtype=np.float64)
+        self.fused_weight = np.zeros(shape, dtype=np.float64)
+        self.fused_ts = np.zeros(shape, dtype=np.float64)
+        self.station_density = np.zeros(capacity, dtype=np.int8)
+        self.station_updated = np.zeros(capacity, dtype=np.float64)
+        self.density_sum = np.zeros(capacity, dtype=np.int32)
+
+    def _columns(self) -> Tuple[str, ...]:
+        return (
+            "density", "trend", "confidence", "reports", "updated", "source",
+            "fused_sum", "fused_weight", "fused_ts",
+            "station_density", "station_updated", "density_sum"
+        )
+
+    def _grow(self):
+        old = {name: getattr(self, name) for name in self._columns()}
+        n = len(self.station_ids)
+        self._allocate(max(64, len(self.density) * 2))
+        for name, values in old.items():
+            getattr(self, name)[:n] = values[:n]
+
+    # ------------------------------------------------------------------
+    # Structure
+    # ------------------------------------------------------------------
+
+    def __contains__(self, station_id: str) -> bool:
+        return station_id in self.station_index
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def __iter__(self):
+        return iter(list(self.station_ids))
+
+    def keys(self):
+        return self.station_index.keys()
+
+    def locate(self, station_id: str, coach_id: str) -> Optional[Tuple[int, int]]:
+        row = self.station_index.get(station_id)
+        col = self.coach_index.get(coach_id)
+        if row is None or col is None:
+            return None
+        return row, col
+
+    def put_station(
+        self,
+        station_id: str,
+        density: Sequence[int],
+        trend: Sequence[int],
+        confidence: Sequence[float],
+        overall: int,
+        source: DataSource = DataSource.MOCK,
+        ts: Optional[float] = None,
+        prior_weight: float = 0.0
+    ) -> int:
+        """
+        Insert (or overwrite) a station row. Returns the row index.
+        prior_weight seeds the fused estimate with the given densities.
+        """
+        ts = ts if ts is not None else time.time()
+
+        with self._lock:
+            row = self.station_index.get(station_id)
+            if row is None:
+                if len(self.station_ids) == len(self.density):
+                    self._grow()
+                row = len(self.station_ids)
+                self.station_ids.append(station_id)
+                self.station_index[station_id] = row
+
+            self.density[row] = density
+            self.density_sum[row] = self.density[row].sum()
+            self.trend[row] = trend
+            self.confidence[row] = confidence
+            self.reports[row] = 0
+            self.updated[row] = ts
+            self.source[row] = SOURCE_CODE[source]
+            self.fused_sum[row] = self.density[row] * prior_weight
+            self.fused_weight[row] = prior_weight
+            self.fused_ts[row] = ts
+            self.station_density[row] = overall
+            self.station_updated[row] = ts
+
+        return row
+
+    def remove_station(self, station_id: str) -> bool:
+        with self._lock:
+            row = self.station_index.pop(station_id, None)
+            if row is None:
+                return False
+
+            last = len(self.station_ids) - 1
+            if row != last:
+                moved = self.station_ids[last]
+                for name in self._columns():
+                    column = getattr(self, name)
+                    column[row] = column[last]
+                self.station_ids[row] = moved
+                self.station_index[moved] = row
+            self.station_ids.pop()
+
+        return True
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def set_density(self, row: int, col: int, code: int):
+        """Write one coach density code, keeping the row's density_sum in step."""
+        self.density_sum[row] += code - int(self.density[row, col])
+        self.density[row, col] = code
+
+    def update_coach(
+        self,
+        station_id: str,
+        coach_id: str,
+        density: Optional[CrowdDensityLevel] = None,
+        trend: Optional[TrendDirection] = None,
+        confidence: Optional[float] = None,
+        source: Optional[DataSource] = None,
+        add_reports: int = 0,
+        ts: Optional[float] = None
+    ) -> bool:
+        """Set the given coach fields (None = unchanged) and stamp last_updated."""
+        pos = self.locate(station_id, coach_id)
+        if pos is None:
+            return False
+
+        row, col = pos
+        if density is not None:
+            self.set_density(row, col, DENSITY_CODE[density])
+        if trend is not None:
+            self.trend[row, col] = TREND_CODE[trend]
+        if confidence is not None:
+            self.confidence[row, col] = confidence
+        if source is not None:
+            self.source[row, col] = SOURCE_CODE[source]
+        if add_reports:
+            self.reports[row, col] += add_reports
+        self.updated[row, col] = ts if ts is not None else time.time()
+        return True
+
+    def evolve(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        Vectorized periodic step: density moves one level along its trend.
+        Only mock-sourced coaches drift; fused observations are left alone
+        (CrowdFusionEngine.relax resets them to the station baseline once
+        their evidence decays).
+        Returns the (station_id, coach_id) pairs whose density changed.
+        """
+        now = now if now is not None else time.time()
+        n = len(self.station_ids)
+        if not n:
+            return []
+
+        density = self.density[:n]
+        trend = self.trend[:n]
+        step = (trend == 1).astype(np.int8) - (trend == -1).astype(np.int8)
+        evolved = np.clip(density + step, 0, len(DENSITY_LEVELS) - 1).astype(np.int8)
+
+        changed = (evolved != density) & (self.source[:n] == SOURCE_CODE[DataSource.MOCK])
+        self.density_sum[:n] += np.where(changed, evolved - density, 0).sum(axis=1, dtype=np.int32)
+        density[changed] = evolved[changed]
+        self.updated[:n][changed] = now
+        self.station_updated[:n] = now
+
+        rows, cols = np.nonzero(changed)
+        return [
+            (self.station_ids[r], self.coach_ids[c])
+            for r, c in zip(rows.tolist(), cols.tolist())
+        ]
+
+    def mean_density(self, rows: Sequence[int]) -> np.ndarray:
+        """Mean coach density code of each row, from the running sums."""
+        return self.density_sum[list(rows)] / len(self.coach_ids)
+
+    # ------------------------------------------------------------------
+    # Projections (legacy dict shape used by the API)
+    # ------------------------------------------------------------------
+
+    def coach(self, station_id: str, coach_id: str) -> Optional[Dict]:
+        pos = self.locate(station_id, coach_id)
+        if pos is None:
+            return None
+        return self._coach_at(*pos)
+
+    def _coach_at(self, row: int, col: int) -> Dict:
+        return {
+            "density": DENSITY_LEVELS[self.density[row, col]],
+            "trend": TREND_BY_CODE[int(self.trend[row, col])],
+            "confidence": round(float(self.confidence[row, col]), 3),
+            "last_updated": _iso(self.updated[row, col]),
+            "user_reports_count": int(self.reports[row, col]),
+            "source": SOURCES[self.source[row, col]]
+        }
+
+    def station(self, station_id: str, with_coaches: bool = True) -> Optional[Dict]:
+        row = self.station_index.get(station_id)
+        if row is None:
+            return None
+
+        data = {
+            "station_id": station_id,
+            "timestamp": _iso(self.station_updated[row]),
+            "overall_density": DENSITY_LEVELS[self.station_density[row]],
+            "source": DataSource.MOCK
+        }
+        if with_coaches:
+            data["coaches"] = {
+                coach_id: self._coach_at(row, col)
+                for col, coach_id in enumerate(self.coach_ids)
+            }
+        return data
+
+    # ------------------------------------------------------------------
+    # Snapshot support
+    # ------------------------------------------------------------------
+
+    def export_columns(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """Station ids + copies of their rows in every column, taken under the lock."""
+        with self._lock:
+            n = len(self.station_ids)
+            return list(self.station_ids), {
+                name: getattr(self, name)[:n].copy() for name in self._columns()
+            }
+
+    def load_columns(self, station_ids: Sequence[str], columns: Dict[str, np.ndarray]):
+        """Replace the whole store with previously exported columns."""
+        n = len(station_ids)
+        with self._lock:
+            self._allocate(max(64, 1 << (n - 1).bit_length()) if n else 64)
+            for name in self._columns():
+                if name in columns:  # columns added since the export stay zeroed
+                    getattr(self, name)[:n] = columns[name]
+            self.density_sum[:n] = self.density[:n].sum(axis=1)
+            self.station_ids = list(station_ids)
+            self.station_index = {s: i for i, s in enumerate(self.station_ids)}
+
+    @property
+    def capacity(self) -> int:
+        return len(self.density)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self._columns())
+
+
+class SignalWindows:
+    """
+    Rolling user-signal windows keyed "station:coach", each a
+    deque(maxlen=window). Indexing a missing key creates its window (like
+    the defaultdict it replaces); past max_keys the least recently
+    written key is evicted, so arbitrary keys can't grow it without bound.
+    """
+
+    def __init__(self, window: int = 10, max_keys: int = 50_000):
+        self.window = window
+        self.max_keys = max_keys
+        self._windows: "OrderedDict[str, deque]" = OrderedDict()
+        self.evictions = 0
+
+    def __getitem__(self, key: str) -> deque:
+        signals = self._windows.get(key)
+        if signals is not None:
+            self._windows.move_to_end(key)
+            return signals
+
+        signals = self._windows[key] = deque(maxlen=self.window)
+        while len(self._windows) > self.max_keys:
+            self._windows.popitem(last=False)
+            self.evictions += 1
+        return signals
+
+    def get(self, key: str, default=None):
+        return self._windows.get(key, default)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._windows
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def items(self):
+        return self._windows.items()
+
+    def clear(self):
+        self._windows.clear()
+
+    def discard_station(self, station_id: str) -> int:
+        """Drop every window of one station. Returns how many were removed."""
+        prefix = f"{station_id}:"
+        keys = [k for k in self._windows if k.startswith(prefix)]
+        for key in keys:
+            del self._windows[key]
+        return len(keys)
+
+    @property
+    def approx_bytes(self) -> int:
+        """Keys + deques (signal enums are shared singletons, not counted)."""
+        return sys.getsizeof(self._windows) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v) for k, v in self._windows.items()
+        )
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Text, BigInteger
+from sqlalchemy import (
+    Column, String, Text, BigInteger, Integer, SmallInteger, Float, DateTime, Index
+)
 from app.database import Base
 
 class Station(Base):
@@ -21,3 +23,37 @@ class TrainSchedule(Base):
     train_no = Column(Text)
     station = Column(Text)
     time_raw = Column(Text)
+
+    # Pre-parsed minutes since midnight (backfilled from time_raw)
+    arrival_min = Column(Integer)
+    departure_min = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_train_schedule_station_arrival", "station", "arrival_min"),
+    )
+
+class CrowdObservation(Base):
+    """Append-only crowd history (coach snapshots + raw user signals)"""
+    __tablename__ = "crowd_observations"
+    id = Column(
+        BigInteger().with_variant(Integer, "sqlite"),  # sqlite only autoincrements INTEGER
+        primary_key=True,
+        autoincrement=True
+    )
+    observed_at = Column(DateTime, nullable=False)
+    station = Column(Text, nullable=False)
+    coach_id = Column(String(8))
+    kind = Column(String(16), nullable=False)   # snapshot | signal | image
+
+    # density / trend as crowd_store codes (DENSITY_LEVELS index, TREND_CODE)
+    density = Column(SmallInteger)
+    trend = Column(SmallInteger)
+    confidence = Column(Float)
+    source = Column(String(32))
+
+    signal = Column(String(32))
+    user_id = Column(Text)
+
+    __table_args__ = (
+        Index("ix_crowd_observations_station_time", "station", "observed_at"),
+    )
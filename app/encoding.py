@@ -0,0 +1,34 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+class JsonEncoder:
+    """Stdlib JSON encoder"""
+
+    name = "json"
+
+    def dumps(self, obj) -> str:
+        return json.dumps(obj)
+
+
+class OrjsonEncoder:
+    """orjson-backed encoder (used automatically when orjson is installed)"""
+
+    name = "orjson"
+
+    def dumps(self, obj) -> str:
+        return orjson.dumps(obj).decode()
+
+
+def get_encoder():
+    if orjson is not None:
+        return OrjsonEncoder()
+    return JsonEncoder()
+
+
+# Shared encoder for WebSocket frames
+encoder = get_encoder()
@@ -1,28 +1,52 @@
-from fastapi import FastAPI, WebSocket, HTTPException, Query, Depends
+from fastapi import FastAPI, WebSocket, HTTPException, Query, Depends, Request, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import asyncio
-from datetime import datetime
+import hmac
+import os
+from datetime import datetime, timedelta
 from typing import Optional
 
 from app.websocket import manager, crowd_broadcast_loop
-from app.models import UserCrowdSignal, CrowdImageUpload
-from app.state import user_signals, crowd_state
+from app.models import (
+    UserCrowdSignal,
+    UserCrowdSignalBatch,
+    CrowdImageUpload,
+    PredictionRequest,
+    PredictionResponse
+)
+from app.state import crowd_state, user_signals
 from app import state
 
-from app.db_session import get_db
-from app.db_models import Station, Train
+from app.db_session import get_async_db
 from services.crowd_service import CrowdService
 from services.train_service import TrainService
+from services.timetable_index import TimetableIndex
+from services.train_cache import TrainCache
+from services.signal_ingest import SignalIngestPipeline
+from services.rate_limiter import SignalAdmission
+from services.history_writer import HistoryWriter
+from services.state_snapshot import StateSnapshotter
+from services.prediction_cache import PredictionCache, prediction_key
+from services.crowd_profile import CrowdProfile
+from services.reference_cache import ReferenceCache, etag_matches
+from services.station_registry import StationRegistry
+from services.schedule_migration import (
+    upgrade_train_schedule,
+    backfill_schedule_minutes
+)
 from app.db_session import SessionLocal
 # from app.db_models import Station
-from app.database import engine, Base
+from app.database import engine, async_engine, Base
 from app import db_models  # IMPORTANT: ensures models are registered
 
 
 # Background task storage
 background_tasks = set()
 
+# Required in X-Admin-Token for /api/v1/admin/*; unset disables those endpoints
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # =============================================================================
 # LIFESPAN
 # =============================================================================
@@ -33,27 +57,94 @@ async def lifespan(app: FastAPI):
 
     print("📦 Creating database tables (if not exist)...")
     Base.metadata.create_all(bind=engine)
+    upgrade_train_schedule(engine)
 
     # Initialize services
     state.crowd_service = CrowdService()
-    # state.train_service = TrainService(db)
+    state.train_service = TrainService()
+    state.prediction_cache = PredictionCache(
+        ttl=state.PREDICTION_CACHE_TTL,
+        max_entries=state.PREDICTION_CACHE_SIZE
+    )
 
-    # Load stations from DB
+    # Load stations + compiled timetable from DB
     db = SessionLocal()
-    stations = db.query(Station).all()
+    backfilled = backfill_schedule_minutes(db)
+    if backfilled:
+        print(f"🕒 Backfilled arrival/departure minutes for {backfilled} schedule rows")
+    state.reference_cache = ReferenceCache()
+    state.reference_cache.refresh(db)
+    state.timetable_index = TimetableIndex.build(db)
+    state.train_cache = TrainCache(state.TRAIN_CACHE_REFRESH_INTERVAL)
+    state.train_cache.refresh(db)
     db.close()
 
-    for s in stations:
-        state.crowd_state[s.station] = (
-            state.crowd_service.generate_mock_crowd_for_station(s.station)
+    print(
+        f"📚 Reference data cached ({len(state.reference_cache.stations)} stations, "
+        f"{len(state.reference_cache.trains)} trains)"
+    )
+    print(f"🗓️ Timetable index built ({state.timetable_index.total_entries} arrivals)")
+    print(f"🚆 Train cache loaded ({len(state.train_cache)} trains)")
+
+    # Historical profile (built offline by `python -m services.crowd_profile`)
+    state.crowd_profile = CrowdProfile.load()
+    if state.crowd_profile is not None:
+        print(
+            f"📈 Crowd profile loaded ({len(state.crowd_profile)} stations, "
+            f"{state.crowd_profile.observations} observations)"
         )
+    else:
+        print("📈 No crowd profile yet, predicting from time-of-day patterns")
+
+    # Warm start from the last local snapshot; mock only what's missing
+    state.state_snapshotter = StateSnapshotter(
+        crowd_state,
+        user_signals,
+        interval=state.STATE_SNAPSHOT_INTERVAL,
+        max_age=state.STATE_SNAPSHOT_MAX_AGE
+    )
+    state.state_snapshotter.restore()
+
+    # Only registered stations get rows on demand; others are bounded ad-hoc
+    state.station_registry = StationRegistry(
+        crowd_state,
+        user_signals,
+        is_registered=state.reference_cache.has_station,
+        max_ad_hoc=state.MAX_AD_HOC_STATIONS
+    )
+    state.station_registry.adopt(crowd_state)
+
+    for station in state.reference_cache.stations:
+        if station not in crowd_state:
+            state.crowd_service.generate_mock_crowd_for_station(station)
 
     print(f"✅ Crowd state initialized for {len(state.crowd_state)} stations")
 
-    # Start background WebSocket broadcaster
-    task = asyncio.create_task(crowd_broadcast_loop())
-    background_tasks.add(task)
-    task.add_done_callback(background_tasks.discard)
+    # Start background WebSocket broadcaster, signal ingestion, history writer
+    state.signal_pipeline = SignalIngestPipeline(state.crowd_service)
+    state.signal_admission = SignalAdmission(
+        limit=state.SIGNAL_RATE_LIMIT,
+        window=state.SIGNAL_RATE_WINDOW,
+        dedup_window=state.SIGNAL_DEDUP_WINDOW
+    )
+    state.history_writer = HistoryWriter(
+        SessionLocal,
+        store=crowd_state,
+        snapshot_interval=state.HISTORY_SNAPSHOT_INTERVAL,
+        batch_size=state.HISTORY_BATCH_SIZE,
+        flush_interval=state.HISTORY_FLUSH_INTERVAL,
+        max_buffer=state.HISTORY_MAX_BUFFER
+    )
+
+    for coro in (
+        crowd_broadcast_loop(),
+        state.signal_pipeline.run(),
+        state.history_writer.run(),
+        state.state_snapshotter.run()
+    ):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
     print("🎯 MahaKavach Backend Ready!")
     yield
@@ -62,6 +153,12 @@ async def lifespan(app: FastAPI):
     for task in background_tasks:
         task.cancel()
     await asyncio.gather(*background_tasks, return_exceptions=True)
+    await state.history_writer.flush()  # rows queued by the final signal flush
+    await state.state_snapshotter.save()
+    print(
+        f"💾 Crowd snapshot saved in {state.state_snapshotter.last_save_ms:.1f} ms"
+    )
+    await async_engine.dispose()
 
 # =============================================================================
 # APP INIT
@@ -94,46 +191,117 @@ def health_check():
         "timestamp": datetime.utcnow().isoformat()
     }
 
+# =============================================================================
+# REFERENCE DATA (cached, ETag / 304)
+# =============================================================================
+
+def reference_response(request: Request, key, build) -> Response:
+    """Serve a cached reference response, or 304 if the client has it."""
+    body, etag = state.reference_cache.response(key, build)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # =============================================================================
 # STATIONS
 # =============================================================================
 
 @app.get("/api/v1/stations")
-def get_all_stations(db=Depends(get_db)):
-    stations = db.query(Station).all()
-    return {
-        "line": "harbour",
-        "total": len(stations),
-        "stations": [{"name": s.station} for s in stations]
-    }
+def get_all_stations(request: Request):
+    cache = state.reference_cache
+    return reference_response(request, "stations", lambda: {
+        "line": state.DEFAULT_LINE,
+        "total": len(cache.stations),
+        "stations": [{"name": s} for s in cache.stations]
+    })
 
 @app.get("/api/v1/stations/{station_name}")
-def get_station_details(station_name: str, db=Depends(get_db)):
-    station = db.query(Station).filter(Station.station == station_name).first()
-    if not station:
+def get_station_details(station_name: str, request: Request):
+    station_name = state.resolve_station(station_name)
+    if not state.reference_cache.has_station(station_name):
         raise HTTPException(status_code=404, detail="Station not found")
 
-    return {
-        "name": station.station,
-        "line": "harbour"
-    }
+    return reference_response(request, ("station", station_name), lambda: {
+        "name": station_name,
+        "line": state.DEFAULT_LINE
+    })
 
 # =============================================================================
 # TRAINS
 # =============================================================================
 
 @app.get("/api/v1/trains")
-def get_all_trains(
-    limit: int = Query(100, ge=1, le=1000),
-    db=Depends(get_db)
-):
-    trains = db.query(Train).limit(limit).all()
-    return {
+def get_all_trains(request: Request, limit: int = Query(100, ge=1, le=1000)):
+    trains = state.reference_cache.trains[:limit]
+    return reference_response(request, ("trains", limit), lambda: {
         "total": len(trains),
         "trains": [
-            {"train_no": t.train_no, "train_name": t.train_name}
-            for t in trains
+            {"train_no": train_no, "train_name": train_name}
+            for train_no, train_name in trains
         ]
+    })
+
+# =============================================================================
+# ADMIN
+# =============================================================================
+
+def build_timetable_index() -> TimetableIndex:
+    db = SessionLocal()
+    try:
+        return TimetableIndex.build(db)
+    finally:
+        db.close()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # fail closed: no configured token means no admin access at all
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled")
+    if not x_admin_token or not hmac.compare_digest(
+        x_admin_token.encode(), ADMIN_TOKEN.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/api/v1/admin/reference/reload", dependencies=[Depends(require_admin)])
+async def reload_reference_data(db=Depends(get_async_db)):
+    """
+    Re-read stations, aliases and trains (e.g. after a timetable import)
+    and rebuild the timetable index; cached responses and ETags change
+    with the data.
+    """
+    await state.reference_cache.refresh_async(db)
+    await state.train_cache.refresh_async(db)
+    state.timetable_index = await asyncio.to_thread(build_timetable_index)
+
+    return {
+        "status": "reloaded",
+        "reference": state.reference_cache.stats(),
+        "timetable_entries": state.timetable_index.total_entries
+    }
+
+@app.get("/api/v1/admin/reference/stats", dependencies=[Depends(require_admin)])
+def get_reference_stats():
+    return state.reference_cache.stats()
+
+@app.get("/api/v1/admin/memory", dependencies=[Depends(require_admin)])
+def get_memory_stats():
+    """Size of the unbounded-by-input structures and their limits."""
+    return {
+        "crowd_state": {
+            "stations": len(crowd_state),
+            "capacity": crowd_state.capacity,
+            "bytes": crowd_state.nbytes,
+            "snapshot": state.state_snapshotter.stats()
+        },
+        "station_registry": state.station_registry.stats(),
+        "user_signals": {
+            "keys": len(user_signals),
+            "max_keys": user_signals.max_keys,
+            "evictions": user_signals.evictions,
+            "approx_bytes": user_signals.approx_bytes
+        },
+        "websocket_view": manager.memory_stats()
     }
 
 # =============================================================================
@@ -141,11 +309,11 @@ def get_all_trains(
 # =============================================================================
 
 @app.get("/api/v1/stations/{station_name}/trains")
-def get_trains_at_station(
+async def get_trains_at_station(
     station_name: str,
     time: Optional[str] = Query(None, description="HH:MM"),
     window_minutes: int = Query(30, ge=5, le=180),
-    db=Depends(get_db)
+    db=Depends(get_async_db)
 ):
 # //fixing train problem 
 
@@ -153,25 +321,20 @@ def get_trains_at_station(
         datetime.strptime(time, "%H:%M").time()
         if time else datetime.now().time()
     )
+    station_name = state.resolve_station(station_name)
 
-    service = TrainService(db)
-    
-    trains = service.get_trains_at_station(
+    return await state.train_service.get_trains_at_station_async(
+        db,
         station=station_name,
         time=query_time,
-        window_minutes=window_minutes
+        window_minutes=window_minutes,
+        detailed_crowd=True
     )
-    for t in trains["trains"]:
-        t["crowd"] = state.crowd_service.get_train_crowd(
-            train_no=t["train_no"],
-            station=station_name
-        )
-
-    return trains
 
 
 @app.get("/api/v1/stations/{station_code}/crowd")
 def get_station_crowd(station_code: str):
+    station_code = state.resolve_station(station_code)
     crowd = state.crowd_service.get_station_crowd(station_code)
 
     if not crowd:
@@ -191,14 +354,53 @@ def get_station_crowd(station_code: str):
         "timestamp": crowd.get("timestamp")
     }
 
+# =============================================================================
+# PEAK HOURS (precomputed timetable histograms)
+# =============================================================================
+
+@app.get("/api/v1/stations/{station_name}/peak-hours")
+def get_station_peak_hours(station_name: str):
+    station_name = state.resolve_station(station_name)
+    peaks = state.train_service.peak_hours(f"station:{station_name}", [station_name])
+    if peaks is None:
+        raise HTTPException(status_code=404, detail="Station not in timetable")
+    return {"station": station_name, **peaks}
+
+@app.get("/api/v1/lines/{line}/peak-hours")
+def get_line_peak_hours(line: str):
+    stations = [
+        s for s in state.timetable_index.stations()
+        if state.station_lines.get(s, state.DEFAULT_LINE) == line
+    ]
+    peaks = state.train_service.peak_hours(f"line:{line}", stations) if stations else None
+    if peaks is None:
+        raise HTTPException(status_code=404, detail="Line not in timetable")
+    return {"line": line, "stations": len(stations), **peaks}
+
+# =============================================================================
+# LINE OVERVIEW (running per-station density sums)
+# =============================================================================
+
+@app.get("/api/v1/lines/{line}/overview")
+def get_line_overview(line: str):
+    stations = [
+        s for s in state.reference_cache.stations
+        if state.station_lines.get(s, state.DEFAULT_LINE) == line
+    ]
+    overview = state.crowd_service.get_line_crowd(line, stations)
+    if overview is None:
+        raise HTTPException(status_code=404, detail="Line not found")
+    return overview
+
 # =============================================================================
 # LIVE STATION VIEW
 # =============================================================================
 
 @app.get("/api/v1/stations/{station_name}/live")
-def get_live_station_data(station_name: str, db=Depends(get_db)):
-    service = TrainService(db)
-    trains = service.get_trains_at_station(
+async def get_live_station_data(station_name: str, db=Depends(get_async_db)):
+    station_name = state.resolve_station(station_name)
+    trains = await state.train_service.get_trains_at_station_async(
+        db,
         station=station_name,
         time=datetime.now().time(),
         window_minutes=30
@@ -208,29 +410,133 @@ def get_live_station_data(station_name: str, db=Depends(get_db)):
         "station": station_name,
         "timestamp": datetime.utcnow().isoformat(),
         "upcoming_trains": trains["trains"],
-        "crowd_data": crowd_state.get(station_name, {})
+        "crowd_data": crowd_state.station(station_name) or {}
+    }
+
+# =============================================================================
+# PREDICTION
+# =============================================================================
+
+@app.post("/api/v1/predict", response_model=PredictionResponse)
+async def predict_crowd(request: PredictionRequest):
+    now = datetime.now()
+    try:
+        day = (
+            datetime.strptime(request.date, "%Y-%m-%d").date()
+            if request.date else now.date()
+        )
+        at = (
+            datetime.strptime(request.time, "%H:%M").time()
+            if request.time else now.time()
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected date YYYY-MM-DD and time HH:MM")
+
+    when = datetime.combine(day, at)
+    station_id = state.resolve_station(request.station_id)
+
+    def compute():
+        prediction = state.crowd_service.predict_crowd(
+            station_id, request.train_no, when
+        )
+        computed_at = datetime.utcnow()
+        return {
+            **prediction,
+            "timestamp": computed_at,
+            "valid_until": computed_at + timedelta(seconds=state.PREDICTION_CACHE_TTL)
+        }
+
+    return await state.prediction_cache.get_or_compute(
+        prediction_key(station_id, request.train_no, when),
+        compute
+    )
+
+@app.get("/api/v1/predict/stats")
+def get_prediction_cache_stats():
+    profile = state.crowd_profile
+    return {
+        **state.prediction_cache.stats(),
+        "profile": {
+            "stations": len(profile),
+            "observations": profile.observations,
+            "built_at": datetime.utcfromtimestamp(profile.built_at).isoformat(),
+            "bytes": profile.nbytes
+        } if profile is not None else None
     }
 
 # =============================================================================
 # CROWD SIGNALS
 # =============================================================================
 
+# Signals are keyed by canonical station (state.resolve_station), pass
+# state.signal_admission (dedup + rate limit), then are queued and
+# applied in micro-batches by state.signal_pipeline
+
 @app.post("/api/v1/signal/crowd")
-def submit_crowd_signal(signal: UserCrowdSignal):
-    key = f"{signal.station_id}:{signal.coach_id}"
-    user_signals[key].append(signal.signal)
+async def submit_crowd_signal(signal: UserCrowdSignal, request: Request):
+    signal.station_id = state.resolve_station(signal.station_id)
+    client_ip = request.client.host if request.client else None
+    verdict = state.signal_admission.check(signal, client_ip)
+
+    if verdict == "rate_limited":
+        raise HTTPException(status_code=429, detail="Too many signals")
+    if verdict == "ok" and not state.signal_pipeline.submit([signal]):
+        # not queued: a retry must not count as a duplicate or a hit
+        state.signal_admission.release(signal, client_ip)
+        raise HTTPException(status_code=503, detail="Signal queue full")
+
+    return {
+        "status": "accepted" if verdict == "ok" else verdict,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+@app.post("/api/v1/signal/crowd/batch")
+async def submit_crowd_signal_batch(batch: UserCrowdSignalBatch, request: Request):
+    client_ip = request.client.host if request.client else None
+
+    admitted, duplicates, rate_limited = [], 0, 0
+    for signal in batch.signals:
+        signal.station_id = state.resolve_station(signal.station_id)
+        verdict = state.signal_admission.check(signal, client_ip)
+        if verdict == "ok":
+            admitted.append(signal)
+        elif verdict == "duplicate":
+            duplicates += 1
+        else:
+            rate_limited += 1
+
+    if rate_limited and not admitted and not duplicates:
+        raise HTTPException(status_code=429, detail="Too many signals")
 
-    state.crowd_service.process_user_signal(signal)
+    # the queue takes a prefix; give the rest back so they can be retried
+    accepted = state.signal_pipeline.submit(admitted)
+    for signal in admitted[accepted:]:
+        state.signal_admission.release(signal, client_ip)
+
+    if admitted and not accepted:
+        raise HTTPException(status_code=503, detail="Signal queue full")
 
     return {
         "status": "accepted",
+        "accepted": accepted,
+        "duplicates": duplicates,
+        "rate_limited": rate_limited,
+        "rejected": len(admitted) - accepted,
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@app.get("/api/v1/signal/stats")
+def get_signal_stats():
+    return {
+        **state.signal_pipeline.stats(),
+        "admission": state.signal_admission.stats(),
+        "history": state.history_writer.stats()
+    }
+
 @app.post("/api/v1/signal/image")
 async def submit_crowd_image(image_data: CrowdImageUpload):
     analysis = state.crowd_service.analyze_crowd_image(
-        station_id=image_data.station_id,
+        station_id=state.resolve_station(image_data.station_id),
         train_no=image_data.train_no,
         coach_id=image_data.coach_id
     )
@@ -249,9 +555,10 @@ async def crowd_websocket(websocket: WebSocket):
     await manager.connect(websocket)
 
     try:
-        # Keep connection alive forever
+        # Client → server control messages (e.g. {"type": "resync"})
         while True:
-            await asyncio.sleep(3600)
+            raw = await websocket.receive_text()
+            await manager.handle_client_message(websocket, raw)
     except Exception:
         pass
     finally:
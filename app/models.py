@@ -59,6 +59,11 @@ class UserCrowdSignal(BaseModel):
     user_id: Optional[str] = None  # Anonymous ID for rate limiting
 
 
+class UserCrowdSignalBatch(BaseModel):
+    """Several user signals submitted in one request"""
+    signals: List[UserCrowdSignal] = Field(min_length=1, max_length=500)
+
+
 class CrowdImageUpload(BaseModel):
     """Image upload request for crowd analysis"""
     station_id: str
@@ -1,35 +1,83 @@
-from typing import Dict, List
-from collections import defaultdict, deque
+import itertools
+from typing import Dict, Optional, Set
+
+from app.crowd_store import CrowdStore, SignalWindows
 
 # =============================================================================
 # LIVE CROWD STATE (REAL-TIME, IN-MEMORY)
 # =============================================================================
 
-# Format:
+# Columnar store: station rows × coach columns of NumPy arrays
+# (see app/crowd_store.py). crowd_state.station(station_id) projects a row
+# back to the API shape:
 # {
-#   station_id: {
-#       station_id,
-#       timestamp,
-#       overall_density,
-#       coaches: {
-#           C1: { density, trend, confidence, source, ... },
-#           ...
-#       }
+#   station_id,
+#   timestamp,
+#   overall_density,
+#   coaches: {
+#       C1: { density, trend, confidence, source, ... },
+#       ...
 #   }
 # }
-crowd_state: Dict[str, Dict] = {}
+crowd_state = CrowdStore()
+
+# Stations/coaches changed since the WebSocket view last re-projected them.
+# { station_id: {coach_id, ...} }, or { station_id: None } for the whole station
+crowd_dirty: Dict[str, Optional[Set[str]]] = {}
+
+# station_id → change stamp, refreshed on every mark_crowd_dirty. Stamps
+# come from one global counter, so a removed and re-created station
+# never repeats an old stamp (used to invalidate derived caches).
+crowd_versions: Dict[str, int] = {}
+_crowd_version_counter = itertools.count(1)
+
+
+def mark_crowd_dirty(station_id: str, coach_id: Optional[str] = None):
+    if station_id in crowd_state:
+        crowd_versions[station_id] = next(_crowd_version_counter)
+    else:
+        crowd_versions.pop(station_id, None)
+
+    if coach_id is None:
+        crowd_dirty[station_id] = None
+        return
+
+    coaches = crowd_dirty.setdefault(station_id, set())
+    if coaches is not None:
+        coaches.add(coach_id)
+
+
+def take_crowd_dirty() -> Dict[str, Optional[Set[str]]]:
+    """Swap out and return the dirty set (consumer side)."""
+    global crowd_dirty
+    dirty, crowd_dirty = crowd_dirty, {}
+    return dirty
+
+def resolve_station(station_id: str) -> str:
+    """
+    Canonical station key for a name, alias, legacy code or typo
+    (via reference_cache.resolver). Unknown names are returned unchanged.
+    """
+    if reference_cache is None:
+        return station_id
+    return reference_cache.resolver.resolve(station_id) or station_id
+
+# station_id → line (stations not listed belong to DEFAULT_LINE)
+DEFAULT_LINE = "harbour"
+station_lines: Dict[str, str] = {}
 
 # =============================================================================
 # USER SIGNAL BUFFER (ROLLING WINDOW)
 # =============================================================================
 
 USER_SIGNAL_WINDOW = 10
+USER_SIGNAL_MAX_KEYS = 50_000    # station:coach windows kept (LRU beyond this)
 
-# Format:
+# Format (bounded, see SignalWindows):
 # {
 #   "CSMT:C1": deque(["VERY_CROWDED", "CROWD_INCREASING"], maxlen=10)
 # }
-user_signals = defaultdict(lambda: deque(maxlen=USER_SIGNAL_WINDOW))
+user_signals = SignalWindows(USER_SIGNAL_WINDOW, USER_SIGNAL_MAX_KEYS)
 
 # =============================================================================
 # SERVICES (INITIALIZED AT APP STARTUP)
@@ -37,29 +85,51 @@ user_signals = defaultdict(lambda: deque(maxlen=USER_SIGNAL_WINDOW))
 
 # These are service singletons, NOT data containers
 crowd_service = None     # CrowdService()
-train_service = None     # TrainService(db_session_factory)
+train_service = None     # TrainService() — session passed per call
+timetable_index = None   # TimetableIndex (pre-parsed train_schedule)
+train_cache = None       # TrainCache (train_no → train_name)
+signal_pipeline = None   # SignalIngestPipeline (batched user signals)
+signal_admission = None  # SignalAdmission (dedup + per-sender rate limit)
+history_writer = None    # HistoryWriter (crowd_observations, batched)
+state_snapshotter = None # StateSnapshotter (crowd_state warm restarts)
+crowd_profile = None     # CrowdProfile (station × weekday × 15-min history)
+reference_cache = None   # ReferenceCache (stations / aliases / trains + ETags)
+station_registry = None  # StationRegistry (gates crowd_state rows, ad-hoc LRU)
+
+TRAIN_CACHE_REFRESH_INTERVAL = 3600  # seconds
+
+SIGNAL_RATE_LIMIT = 10               # signals per sender per window
+SIGNAL_RATE_WINDOW = 60              # seconds
+SIGNAL_DEDUP_WINDOW = 30             # seconds (same sender/coach/signal)
+
+HISTORY_BATCH_SIZE = 1000            # rows per INSERT
+HISTORY_FLUSH_INTERVAL = 5           # seconds
+HISTORY_MAX_BUFFER = 100_000         # rows held in memory before dropping
+HISTORY_SNAPSHOT_INTERVAL = 60       # seconds between full coach snapshots
+
+MAX_AD_HOC_STATIONS = 256            # unregistered stations kept in crowd_state
+
+STATE_SNAPSHOT_INTERVAL = 30         # seconds between local crowd_state snapshots
+STATE_SNAPSHOT_MAX_AGE = 6 * 3600    # older snapshots are ignored at startup
 
 # =============================================================================
 # PREDICTION CACHE (SHORT-LIVED)
 # =============================================================================
 
-# Used to avoid recalculating predictions frequently
-# Format:
-# {
-#   "CSMT:08:30": {
-#       "prediction": {...},
-#       "timestamp": "2026-01-20T08:25:00Z"
-#   }
-# }
-prediction_cache: Dict[str, Dict] = {}
-PREDICTION_CACHE_TTL = 300  # seconds (5 minutes)
+# Used to avoid recalculating predictions frequently.
+# PredictionCache (services/prediction_cache.py), TTL + LRU, keyed by
+# (station, train_no, 5-minute bucket) → PredictionResponse dict
+prediction_cache = None
+PREDICTION_CACHE_TTL = 300       # seconds (5 minutes)
+PREDICTION_CACHE_SIZE = 10_000   # entries
 
 # =============================================================================
-# ANALYTICS (FUTURE / HYBRID)
+# ANALYTICS
 # =============================================================================
 
-# In future, this moves to PostgreSQL / TimescaleDB
-historical_crowd_data: Dict[str, Dict] = {}
+# Crowd history lives in PostgreSQL (crowd_observations, via history_writer)
 
-# Cached peak hour analysis to reduce DB load
-peak_hours_cache: Dict[str, List] = {}
+# Peak hour responses built from the timetable index histograms, keyed
+# by scope ("station:CSMT", "line:harbour", "network"). Cleared by
+# TrainService.peak_hours whenever the timetable index is reloaded.
+peak_hours_cache: Dict[str, Dict] = {}
@@ -1,20 +1,156 @@
 import asyncio
 import json
+from collections import deque
 from datetime import datetime
-from typing import List
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from fastapi import WebSocket
 
+from app import state
+from app.encoding import encoder
 from app.state import crowd_state, user_signals
 from app.signal_logic import infer_trend
 from app.models import CrowdDensityLevel, TrendDirection
 
 
+# Slow-consumer limits
+WS_MAX_QUEUE = 32          # queued non-state messages per client
+WS_SEND_TIMEOUT = 2.0      # seconds allowed for a single send
+WS_MAX_MISSED_TICKS = 3    # state ticks a client may fall behind
+WS_MAX_TOPICS = 50         # subscriptions per client
+
+# Subscription topic prefixes, e.g. "station:CSMT", "line:harbour", "train:95001".
+# A train topic receives train updates plus the crowd of the station the
+# train is at (its current or next stop in the timetable index).
+TOPIC_KINDS = {"stations": "station", "lines": "line", "trains": "train"}
+
+
+class ClientConnection:
+    """
+    One WebSocket client: a bounded outbound queue drained by its own
+    sender task, so the broadcast loop never awaits a socket directly.
+
+    Crowd state is coalesced: if a tick arrives before the previous one
+    was sent, the client is switched to a fresh snapshot on its next send
+    instead of receiving every missed delta.
+
+    `version` is the last crowd version this client was given (snapshot
+    or delta). Its next delta uses it as base_version, so ticks with no
+    changes for its topics never show up as a gap.
+    """
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.queue: deque = deque()
+        self.pending_state: Optional[str] = None
+        self.needs_snapshot: Optional[str] = None  # snapshot message type
+        self.missed_ticks = 0
+        self.version = 0
+        self.topics: Set[str] = set()  # empty → receives everything
+        self.task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    # ------------------------------------------------------------------
+    # Producer side (never blocks)
+    # ------------------------------------------------------------------
+
+    def enqueue(self, frame: str) -> bool:
+        if len(self.queue) >= WS_MAX_QUEUE:
+            return False
+        self.queue.append(frame)
+        self._wakeup.set()
+        return True
+
+    def offer_state(self, frame: str, version: int) -> bool:
+        if self.pending_state is not None or self.needs_snapshot:
+            # previous tick still unsent → coalesce into a snapshot
+            self.missed_ticks += 1
+            if self.missed_ticks > WS_MAX_MISSED_TICKS:
+                return False
+            self.pending_state = None
+            self.needs_snapshot = self.needs_snapshot or "crowd_snapshot"
+        else:
+            self.pending_state = frame
+            self.version = version
+        self._wakeup.set()
+        return True
+
+    def request_snapshot(self, message_type: str = "crowd_snapshot"):
+        self.pending_state = None
+        self.needs_snapshot = message_type
+        self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Sender task
+    # ------------------------------------------------------------------
+
+    async def _run(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+
+                while self.queue:
+                    await self._send(self.queue.popleft())
+
+                if self.needs_snapshot:
+                    message_type, self.needs_snapshot = self.needs_snapshot, None
+                    frame = self.manager.snapshot_frame(message_type, self)
+                    self.version = self.manager.version
+                    await self._send(frame)
+                    self.missed_ticks = 0
+                elif self.pending_state is not None:
+                    frame, self.pending_state = self.pending_state, None
+                    await self._send(frame)
+                    self.missed_ticks = 0
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"WebSocket send error: {e}")
+            self.manager.drop(self.websocket, "send failed")
+
+    async def _send(self, frame: str):
+        try:
+            async with asyncio.timeout(WS_SEND_TIMEOUT):
+                await self.websocket.send_text(frame)
+        except TimeoutError:
+            raise RuntimeError(f"send exceeded {WS_SEND_TIMEOUT}s")
+
+
 class ConnectionManager:
     """Manages WebSocket connections for real-time updates"""
 
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.dropped_slow_clients = 0
+        self._closing = set()
+
+        # Incrementally maintained enriched view. Only stations/coaches
+        # marked dirty in state.crowd_dirty are re-projected; every change
+        # bumps `version` and is stamped on the coach and station.
+        self.version = 0
+        self._primed = False                     # first sync done (baseline taken)
+        self._view: Dict[str, dict] = {}
+        self._fragments: Dict[str, str] = {}     # encoded station views
+        self._pending: Dict[str, Optional[Set[str]]] = {}  # changed since last broadcast
+
+        # topic → subscribed sockets
+        self.topics: Dict[str, Set[WebSocket]] = {}
+
+        # subscribed train topic → station it was at on the last tick
+        self._train_stations: Dict[str, str] = {}
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.connections)
 
     # ------------------------------------------------------------------
     # Connection lifecycle
@@ -22,110 +158,441 @@ class ConnectionManager:
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        print(f"✓ WebSocket connected ({len(self.active_connections)})")
-        await self.send_initial_state(websocket)
+        client = ClientConnection(websocket, self)
+        self.connections[websocket] = client
+        print(f"✓ WebSocket connected ({len(self.connections)})")
+        client.request_snapshot("initial_state")
+        client.start()
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-            print(f"✗ WebSocket disconnected ({len(self.active_connections)})")
+        client = self.connections.pop(websocket, None)
+        if client:
+            self._unindex(websocket, client.topics)
+            client.stop()
+            print(f"✗ WebSocket disconnected ({len(self.connections)})")
+
+    def drop(self, websocket: WebSocket, reason: str):
+        """Disconnect a slow/broken client without waiting on it."""
+        if websocket not in self.connections:
+            return
+
+        self.dropped_slow_clients += 1
+        print(f"⚠️ Dropping WebSocket client: {reason}")
+        self.disconnect(websocket)
+
+        task = asyncio.create_task(self._close(websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            async with asyncio.timeout(WS_SEND_TIMEOUT):
+                await websocket.close(code=1013)
+        except Exception:
+            pass
 
     # ------------------------------------------------------------------
     # Messaging
     # ------------------------------------------------------------------
 
-    async def send_initial_state(self, websocket: WebSocket):
+    def snapshot_frame(
+        self,
+        message_type: str = "crowd_snapshot",
+        client: Optional[ClientConnection] = None
+    ) -> str:
+        """
+        Encoded state at the current version: everything for unsubscribed
+        clients, otherwise only subscribed stations. Assembled from cached
+        per-station fragments.
+        """
+        self._sync_view()
+
+        stations = self._stations_for(client)
+        if stations is None:
+            stations = list(self._view)
+
+        return (
+            f'{{"type":{encoder.dumps(message_type)}'
+            f',"version":{self.version}'
+            f',"timestamp":{encoder.dumps(datetime.utcnow().isoformat())}'
+            ',"data":{'
+            + ",".join(
+                f"{encoder.dumps(s)}:{self._fragment(s)}"
+                for s in stations if s in self._view
+            )
+            + "}}"
+        )
+
+    async def handle_client_message(self, websocket: WebSocket, raw: str):
         try:
-            payload = self._build_enriched_state()
-            await websocket.send_text(json.dumps({
-                "type": "initial_state",
-                "data": payload,
-                "timestamp": datetime.utcnow().isoformat()
-            }))
-        except Exception as e:
-            print(f"Initial state send error: {e}")
+            message = json.loads(raw)
+        except ValueError:
+            return
+
+        client = self.connections.get(websocket)
+        if not client or not isinstance(message, dict):
+            return
+
+        message_type = message.get("type")
+
+        if message_type == "resync":
+            client.request_snapshot()
+        elif message_type == "subscribe":
+            self.subscribe(websocket, self._parse_topics(message))
+            client.request_snapshot()
+        elif message_type == "unsubscribe":
+            self.unsubscribe(websocket, self._parse_topics(message))
+            if not client.topics:
+                # back to receiving everything: it has never seen most stations
+                client.request_snapshot()
 
-    async def broadcast(self, message: dict):
-        disconnected = []
+    # ------------------------------------------------------------------
+    # Subscriptions
+    # ------------------------------------------------------------------
 
-        for ws in self.active_connections:
-            try:
-                await ws.send_text(json.dumps(message))
-            except Exception as e:
-                print(f"Broadcast error: {e}")
-                disconnected.append(ws)
+    def subscribe(self, websocket: WebSocket, topics: Set[str]):
+        client = self.connections.get(websocket)
+        if not client:
+            return
+
+        room = WS_MAX_TOPICS - len(client.topics)
+        new_topics = sorted(topics - client.topics)[:max(0, room)]
+
+        client.topics.update(new_topics)
+        for topic in new_topics:
+            self.topics.setdefault(topic, set()).add(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Set[str]):
+        client = self.connections.get(websocket)
+        if not client:
+            return
+
+        removed = client.topics & topics
+        client.topics -= removed
+        self._unindex(websocket, removed)
+
+    def _unindex(self, websocket: WebSocket, topics: Iterable[str]):
+        for topic in topics:
+            sockets = self.topics.get(topic)
+            if sockets is None:
+                continue
+            sockets.discard(websocket)
+            if not sockets:
+                del self.topics[topic]
+
+    def _parse_topics(self, message: dict) -> Set[str]:
+        """{"stations": [...], "lines": [...], "trains": [...]} → topic names"""
+        topics = set()
+        for field, kind in TOPIC_KINDS.items():
+            values = message.get(field) or []
+            if not isinstance(values, list):
+                continue
+            topics.update(
+                f"{kind}:{state.resolve_station(v) if kind == 'station' else v}"
+                for v in values
+                if isinstance(v, str) and v
+            )
+        return topics
+
+    def _station_topics(self, station_id: str) -> Tuple[str, str]:
+        line = state.station_lines.get(station_id, state.DEFAULT_LINE)
+        return f"station:{station_id}", f"line:{line}"
+
+    def _train_station(self, topic: str) -> Optional[str]:
+        """Station a "train:<no>" topic's train is at now (None for other topics)."""
+        if not topic.startswith("train:") or state.timetable_index is None:
+            return None
+
+        now = datetime.now()
+        located = state.timetable_index.train_position(topic[6:], now.hour * 60 + now.minute)
+        return located[0] if located else None
+
+    def _route_trains(self) -> Dict[str, Set[str]]:
+        """
+        station → subscribed train topics whose train is there now.
+        Subscribers of a train that moved on since the last tick get a
+        snapshot, which carries the full state of the new station.
+        """
+        positions = {}
+        for topic in self.topics:
+            station_id = self._train_station(topic)
+            if station_id is not None:
+                positions[topic] = station_id
+
+        at_station: Dict[str, Set[str]] = {}
+        for topic, station_id in positions.items():
+            at_station.setdefault(station_id, set()).add(topic)
+
+            previous = self._train_stations.get(topic)
+            if previous is not None and previous != station_id:
+                for ws in self.topics.get(topic, ()):
+                    client = self.connections.get(ws)
+                    if client is not None:
+                        client.request_snapshot()
+
+        self._train_stations = positions
+        return at_station
+
+    def _audience(self, topics: Iterable[str]) -> Set[WebSocket]:
+        sockets = set()
+        for topic in topics:
+            sockets |= self.topics.get(topic, set())
+        return sockets
+
+    def _stations_for(self, client: Optional[ClientConnection]) -> Optional[List[str]]:
+        """Stations a client should see, or None for everything."""
+        if client is None or not client.topics:
+            return None
+
+        trains_at = {self._train_station(topic) for topic in client.topics}
+        return [
+            station_id for station_id in crowd_state
+            if station_id in trains_at
+            or not client.topics.isdisjoint(self._station_topics(station_id))
+        ]
+
+    async def publish(self, message: dict, topics: Iterable[str]):
+        """Send to subscribers of any topic + clients with no subscriptions."""
+        frame = encoder.dumps(message)
+        audience = self._audience(topics)
+
+        for ws, client in list(self.connections.items()):
+            if client.topics and ws not in audience:
+                continue
+            if not client.enqueue(frame):
+                self.drop(ws, "outbound queue full")
+
+    async def broadcast(self, message: dict):
+        # encode once per tick, fan the same frame out to every socket
+        await self.broadcast_frame(encoder.dumps(message))
 
-        for ws in disconnected:
-            self.disconnect(ws)
+    async def broadcast_frame(self, frame: str):
+        for ws, client in list(self.connections.items()):
+            if not client.enqueue(frame):
+                self.drop(ws, "outbound queue full")
 
     async def broadcast_current_state(self):
-        await self.broadcast({
-            "type": "crowd_update",
-            "data": self._build_enriched_state(),
-            "timestamp": datetime.utcnow().isoformat()
-        })
+        self._sync_view()
+        trains_at = self._route_trains() if self.topics else {}
+        if not self._pending:
+            return
+
+        delta = self._take_delta()
+
+        # each station fragment is encoded once and spliced into every
+        # frame that includes it; frames are shared by clients with the
+        # same base_version and stations
+        timestamp = encoder.dumps(datetime.utcnow().isoformat())
+        fragments = {
+            station_id: f"{encoder.dumps(station_id)}:{encoder.dumps(data)}"
+            for station_id, data in delta.items()
+        }
+
+        per_client: Dict[WebSocket, List[str]] = {}
+        if self.topics:
+            for station_id in delta:
+                topics = (*self._station_topics(station_id), *trains_at.get(station_id, ()))
+                for ws in self._audience(topics):
+                    per_client.setdefault(ws, []).append(station_id)
+
+        frames: Dict[Tuple[int, Optional[Tuple[str, ...]]], str] = {}
+
+        for ws, client in list(self.connections.items()):
+            stations = None
+            if client.topics:
+                stations = tuple(per_client.get(ws, ()))
+                if not stations:
+                    continue  # nothing for this client; its base stays put
+
+            key = (client.version, stations)
+            frame = frames.get(key)
+            if frame is None:
+                frame = (
+                    '{"type":"crowd_delta"'
+                    f',"base_version":{client.version},"version":{self.version}'
+                    f',"timestamp":{timestamp}'
+                    ',"data":{'
+                    + ",".join(fragments[s] for s in (stations or fragments))
+                    + "}}"
+                )
+                frames[key] = frame
+
+            if not client.offer_state(frame, self.version):
+                self.drop(ws, "fell behind on crowd updates")
 
     # ------------------------------------------------------------------
     # State enrichment
     # ------------------------------------------------------------------
 
-    def _build_enriched_state(self) -> dict:
-        enriched = {}
-
-        for station_id, station_data in crowd_state.items():
-            enriched[station_id] = {
-                "station_id": station_id,
-                "timestamp": station_data.get("timestamp"),
-                "overall_density": self._enum_to_str(
-                    station_data.get("overall_density", CrowdDensityLevel.MEDIUM)
-                ),
-                "coaches": {}
-            }
-
-            for coach_id, coach_data in station_data.get("coaches", {}).items():
-                key = f"{station_id}:{coach_id}"
-                signals = list(user_signals.get(key, []))
-
-                # Prefer service-maintained trend, fallback to inference
-                trend = coach_data.get("trend")
-                if not trend:
-                    trend = infer_trend(signals)
-
-                enriched[station_id]["coaches"][coach_id] = {
-                    "density": self._enum_to_str(
-                        coach_data.get("density", CrowdDensityLevel.MEDIUM)
-                    ),
-                    "trend": self._enum_to_str(trend, TrendDirection),
-                    "confidence": coach_data.get("confidence", 0.5),
-                    "user_reports_count": coach_data.get("user_reports_count", 0),
-                    "last_updated": coach_data.get("last_updated"),
-                    "source": str(coach_data.get("source", "mock"))
+    def _build_enriched_state(self, stations: Optional[Iterable[str]] = None) -> dict:
+        self._sync_view()
+        if stations is None:
+            return dict(self._view)
+        return {s: self._view[s] for s in stations if s in self._view}
+
+    def _project_station(self, station_id: str, station_data: dict) -> dict:
+        return {
+            "station_id": station_id,
+            "timestamp": station_data.get("timestamp"),
+            "overall_density": self._enum_to_str(
+                station_data.get("overall_density", CrowdDensityLevel.MEDIUM)
+            ),
+            "coaches": {}
+        }
+
+    def _project_coach(self, station_id: str, coach_id: str, coach_data: dict) -> dict:
+        # Prefer service-maintained trend, fallback to inference
+        trend = coach_data.get("trend")
+        if not trend:
+            trend = infer_trend(list(user_signals.get(f"{station_id}:{coach_id}", [])))
+
+        return {
+            "density": self._enum_to_str(
+                coach_data.get("density", CrowdDensityLevel.MEDIUM)
+            ),
+            "trend": self._enum_to_str(trend, TrendDirection),
+            "confidence": coach_data.get("confidence", 0.5),
+            "user_reports_count": coach_data.get("user_reports_count", 0),
+            "last_updated": coach_data.get("last_updated"),
+            "source": str(coach_data.get("source", "mock"))
+        }
+
+    # ------------------------------------------------------------------
+    # Dirty tracking / deltas
+    # ------------------------------------------------------------------
+
+    def _sync_view(self):
+        """Re-project only what was marked dirty since the last sync."""
+        if len(self._view) != len(crowd_state):
+            # stations added/removed without going through the services
+            for station_id in set(crowd_state.keys()) ^ self._view.keys():
+                state.mark_crowd_dirty(station_id)
+
+        dirty = state.take_crowd_dirty()
+        if not dirty:
+            return
+
+        priming = not self._primed
+        self._primed = True
+        version = self.version + 1
+        changed_any = False
+
+        for station_id, coach_ids in dirty.items():
+            if self._apply_dirty(station_id, coach_ids, version):
+                changed_any = True
+                self._fragments.pop(station_id, None)
+
+        if changed_any:
+            self.version = version
+
+        if priming:
+            # initial load is the baseline, not a delta
+            self._pending = {}
+
+    def _apply_dirty(self, station_id: str, coach_ids: Optional[Set[str]], version: int) -> bool:
+        station_data = crowd_state.station(station_id, with_coaches=False)
+
+        if station_data is None:
+            if self._view.pop(station_id, None) is None:
+                return False
+            self._pending[station_id] = None  # removed
+            return True
+
+        view = self._view.get(station_id)
+        if view is None:
+            view = self._project_station(station_id, station_data)
+            view["version"] = version
+            self._view[station_id] = view
+            coach_ids = None
+
+        changed = set()
+        for coach_id in (crowd_state.coach_ids if coach_ids is None else coach_ids):
+            coach_data = crowd_state.coach(station_id, coach_id)
+            if coach_data is None:
+                continue
+
+            coach = self._project_coach(station_id, coach_id, coach_data)
+            old = view["coaches"].get(coach_id)
+            coach["version"] = old["version"] if old else version
+            if coach != old:
+                coach["version"] = version
+                view["coaches"][coach_id] = coach
+                changed.add(coach_id)
+
+        header = self._project_station(station_id, station_data)
+        header_changed = header["overall_density"] != view["overall_density"]
+        if not (changed or header_changed or view["version"] == version):
+            return False
+
+        view["timestamp"] = header["timestamp"]
+        view["overall_density"] = header["overall_density"]
+        view["version"] = version
+
+        if station_id in self._pending and self._pending[station_id] is None:
+            # removed and re-created since the last broadcast
+            self._pending[station_id] = set(view["coaches"])
+        else:
+            self._pending.setdefault(station_id, set()).update(changed)
+        return True
+
+    def _take_delta(self) -> dict:
+        """Changed coaches (with station header) since the last broadcast."""
+        delta = {}
+
+        for station_id, coach_ids in self._pending.items():
+            view = self._view.get(station_id)
+            if view is None or coach_ids is None:
+                delta[station_id] = None
+                continue
+
+            delta[station_id] = dict(
+                view,
+                coaches={
+                    c: coach for c, coach in view["coaches"].items()
+                    if c in coach_ids
                 }
+            )
 
-        return enriched
+        self._pending = {}
+        return delta
+
+    def _fragment(self, station_id: str) -> str:
+        fragment = self._fragments.get(station_id)
+        if fragment is None:
+            fragment = encoder.dumps(self._view[station_id])
+            self._fragments[station_id] = fragment
+        return fragment
+
+    def memory_stats(self) -> Dict:
+        return {
+            "stations": len(self._view),
+            "encoded_fragments": len(self._fragments),
+            "fragment_bytes": sum(len(f) for f in self._fragments.values()),
+            "connections": len(self.connections),
+            "topics": len(self.topics)
+        }
 
     # ------------------------------------------------------------------
     # Alerts & train updates
     # ------------------------------------------------------------------
 
     async def send_alert(self, station_id: str, message: str, severity: str = "info"):
-        await self.broadcast({
+        await self.publish({
             "type": "alert",
             "station_id": station_id,
             "message": message,
             "severity": severity,
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }, self._station_topics(station_id))
 
     async def send_train_update(self, train_no: str, station_id: str, status: str):
-        await self.broadcast({
+        await self.publish({
             "type": "train_update",
             "train_no": train_no,
             "station_id": station_id,
             "status": status,
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }, (f"train:{train_no}", *self._station_topics(station_id)))
 
     # ------------------------------------------------------------------
     # Helpers
@@ -160,7 +627,7 @@ async def crowd_broadcast_loop():
             if hasattr(state, "crowd_service"):
                 state.crowd_service.update_crowd_state_periodic()
 
-            if manager.active_connections:
+            if manager.connections:
                 await manager.broadcast_current_state()
 
         except asyncio.CancelledError:
@@ -0,0 +1,94 @@
+"""
+Broadcast fan-out benchmark.
+
+Simulates N WebSocket clients and times one crowd broadcast, comparing
+per-socket json.dumps (old path) with encode-once fan-out through the
+per-client queues (enqueue time, then time until every sender drained).
+
+    python -m benchmarks.broadcast_fanout [stations]
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from app.encoding import encoder
+from app.websocket import ConnectionManager
+from services.crowd_service import CrowdService
+
+CONNECTION_COUNTS = [1_000, 10_000, 50_000]
+
+
+class FakeWebSocket:
+    frames_sent = 0
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, data: str):
+        self.bytes_sent += len(data)
+        FakeWebSocket.frames_sent += 1
+
+
+async def drained(expected_frames: int):
+    while FakeWebSocket.frames_sent < expected_frames:
+        await asyncio.sleep(0.001)
+
+
+async def per_socket_encode(connections, message):
+    for ws in connections:
+        await ws.send_text(json.dumps(message))
+
+
+async def run(stations: int):
+    service = CrowdService()
+    for i in range(stations):
+        service.generate_mock_crowd_for_station(f"S{i}")
+
+    manager = ConnectionManager()
+    message = {
+        "type": "initial_state",
+        "data": manager._build_enriched_state()
+    }
+    frame_size = len(encoder.dumps(message))
+
+    print(f"encoder={encoder.name} stations={stations} frame={frame_size} bytes")
+
+    for count in CONNECTION_COUNTS:
+        sockets = [FakeWebSocket() for _ in range(count)]
+        for ws in sockets:
+            await manager.connect(ws)
+        await drained(FakeWebSocket.frames_sent + count)
+
+        start = time.perf_counter()
+        await per_socket_encode(sockets, message)
+        legacy = time.perf_counter() - start
+
+        expected = FakeWebSocket.frames_sent + count
+        start = time.perf_counter()
+        await manager.broadcast(message)
+        enqueued = time.perf_counter() - start
+        await drained(expected)
+        once = time.perf_counter() - start
+
+        print(
+            f"{count:>6} conns | per-socket {legacy * 1000:9.1f} ms"
+            f" | encode-once {once * 1000:8.1f} ms"
+            f" (loop blocked {enqueued * 1000:.1f} ms) | x{legacy / once:.1f}"
+        )
+
+        tasks = [c.task for c in manager.connections.values()]
+        for ws in sockets:
+            manager.disconnect(ws)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 9))
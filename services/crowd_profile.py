@@ -0,0 +1,287 @@
+"""
+Historical crowd profiles: expected density per station × weekday ×
+15-minute slot, built from crowd_observations.
+
+The build streams observations in chunks and folds each chunk into
+sum/count arrays with np.bincount, so it is one vectorized pass however
+large the history is. The result is saved as a compressed .npz and
+loaded at startup; a lookup is a dict hit plus one array read.
+
+Build manually with:
+    python -m services.crowd_profile
+"""
+
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from app.crowd_store import DENSITY_CODE, SIGNAL_DENSITY
+from app.db_models import CrowdObservation
+from app.models import DataSource
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_PROFILE_PATH = BASE_DIR / "data" / "crowd_profile.npz"
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAYS_PER_WEEK = 7
+
+PROFILE_LOOKBACK_DAYS = 56   # eight weeks of history
+PROFILE_MIN_SAMPLES = 5      # fewer than this → fall back to the network profile
+PROFILE_CHUNK_ROWS = 100_000
+
+
+def slot_of(when: datetime) -> Tuple[int, int]:
+    """(weekday, 15-minute slot of the day) for a local datetime."""
+    return when.weekday(), (when.hour * 60 + when.minute) // SLOT_MINUTES
+
+
+def _utc_offset() -> timedelta:
+    """Server-local minus UTC, rounded to the minute (lookups use datetime.now())."""
+    offset = datetime.now() - datetime.utcnow()
+    return timedelta(minutes=round(offset.total_seconds() / 60))
+
+
+class CrowdProfile:
+    """
+    Per-station density profile over a week.
+
+        mean     float32 (stations, 7, 96)  mean density code, NaN when unseen
+        samples  uint32  (stations, 7, 96)
+    plus network-wide (7, 96) arrays used when a station slot has fewer
+    than PROFILE_MIN_SAMPLES observations.
+    """
+
+    def __init__(
+        self,
+        station_ids: Sequence[str],
+        mean: np.ndarray,
+        samples: np.ndarray,
+        network_mean: np.ndarray,
+        network_samples: np.ndarray,
+        built_at: Optional[float] = None
+    ):
+        self.station_ids: List[str] = list(station_ids)
+        self.station_index: Dict[str, int] = {s: i for i, s in enumerate(self.station_ids)}
+        self.mean = mean
+        self.samples = samples
+        self.network_mean = network_mean
+        self.network_samples = network_samples
+        self.built_at = built_at if built_at is not None else time.time()
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build(
+        cls,
+        db: Session,
+        lookback_days: int = PROFILE_LOOKBACK_DAYS,
+        chunk_rows: int = PROFILE_CHUNK_ROWS
+    ) -> "CrowdProfile":
+        """
+        Fold real observations from the last `lookback_days` into a
+        profile: image analyses, and user signals that report a density
+        (VERY_CROWDED / RELATIVELY_EMPTY, mapped like the live fusion).
+        Periodic coach snapshots are skipped, since they re-record the
+        same state every minute, and so is mock data, so the profile
+        never learns from the generator it replaces.
+        """
+        since = datetime.utcnow() - timedelta(days=lookback_days)
+        density = func.coalesce(
+            CrowdObservation.density,
+            case(
+                {s.value: DENSITY_CODE[d] for s, d in SIGNAL_DENSITY.items()},
+                value=CrowdObservation.signal
+            )
+        )
+        result = db.execute(
+            select(
+                CrowdObservation.station,
+                CrowdObservation.observed_at,
+                density
+            )
+            .where(
+                CrowdObservation.observed_at >= since,
+                CrowdObservation.kind != "snapshot",
+                CrowdObservation.source != DataSource.MOCK.value,
+                density.isnot(None)
+            ),
+            execution_options={"yield_per": chunk_rows}
+        )
+
+        builder = ProfileBuilder()
+        for chunk in result.partitions():
+            stations, observed_at, density = zip(*chunk)
+            builder.add_rows(stations, observed_at, density)
+        return builder.finish()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: Path = DEFAULT_PROFILE_PATH) -> int:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f,
+                station_ids=np.array(self.station_ids, dtype=str),
+                mean=self.mean,
+                samples=self.samples,
+                network_mean=self.network_mean,
+                network_samples=self.network_samples,
+                built_at=np.float64(self.built_at)
+            )
+        tmp.replace(path)
+        return path.stat().st_size
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_PROFILE_PATH) -> Optional["CrowdProfile"]:
+        """Read a saved profile; None if missing or unreadable."""
+        path = Path(path)
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path) as data:
+                return cls(
+                    data["station_ids"].tolist(),
+                    data["mean"],
+                    data["samples"],
+                    data["network_mean"],
+                    data["network_samples"],
+                    float(data["built_at"])
+                )
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable crowd profile {path}: {e}")
+            return None
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def expected(self, station_id: str, when: datetime) -> Optional[Tuple[float, int, str]]:
+        """
+        (mean density code, samples, scope) for the slot containing `when`,
+        where scope is "station" or "network". None when neither has
+        enough history.
+        """
+        day, slot = slot_of(when)
+
+        row = self.station_index.get(station_id)
+        if row is not None:
+            samples = int(self.samples[row, day, slot])
+            if samples >= PROFILE_MIN_SAMPLES:
+                return float(self.mean[row, day, slot]), samples, "station"
+
+        samples = int(self.network_samples[day, slot])
+        if samples >= PROFILE_MIN_SAMPLES:
+            return float(self.network_mean[day, slot]), samples, "network"
+        return None
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    @property
+    def observations(self) -> int:
+        return int(self.network_samples.sum())
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.mean.nbytes + self.samples.nbytes
+            + self.network_mean.nbytes + self.network_samples.nbytes
+        )
+
+
+class ProfileBuilder:
+    """Accumulates sum/count arrays chunk by chunk; finish() yields the profile."""
+
+    def __init__(self):
+        self.station_ids: List[str] = []
+        self._station_index: Dict[str, int] = {}
+        self._sums = np.zeros(0, dtype=np.float64)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._offset = _utc_offset()
+
+    def add_rows(
+        self,
+        stations: Sequence[str],
+        observed_at: Sequence[datetime],
+        density: Sequence[int]
+    ):
+        """Add one chunk of (station, UTC observed_at, density code) columns."""
+        names, inverse = np.unique(np.array(stations, dtype=str), return_inverse=True)
+        for name in names.tolist():
+            if name not in self._station_index:
+                self._station_index[name] = len(self.station_ids)
+                self.station_ids.append(name)
+        rows = np.array([self._station_index[n] for n in names.tolist()], dtype=np.int64)[inverse]
+
+        local = np.array(observed_at, dtype="datetime64[m]") + np.timedelta64(self._offset)
+        self.add(rows, local, np.asarray(density, dtype=np.float64))
+
+    def add(self, station_rows: np.ndarray, observed_at: np.ndarray, density: np.ndarray):
+        """Add parallel arrays: station row, local datetime64 timestamps, density code."""
+        minutes = observed_at.astype("datetime64[m]")
+        days = minutes.astype("datetime64[D]")
+        weekday = (days.astype(np.int64) + 3) % DAYS_PER_WEEK  # 1970-01-01 was a Thursday
+        slot = (minutes - days).astype(np.int64) // SLOT_MINUTES
+
+        size = len(self.station_ids) * DAYS_PER_WEEK * SLOTS_PER_DAY
+        flat = (np.asarray(station_rows) * DAYS_PER_WEEK + weekday) * SLOTS_PER_DAY + slot
+
+        if len(self._sums) < size:
+            self._sums = np.pad(self._sums, (0, size - len(self._sums)))
+            self._counts = np.pad(self._counts, (0, size - len(self._counts)))
+
+        self._sums += np.bincount(flat, weights=density, minlength=size)
+        self._counts += np.bincount(flat, minlength=size)
+
+    def finish(self) -> CrowdProfile:
+        shape = (len(self.station_ids), DAYS_PER_WEEK, SLOTS_PER_DAY)
+        size = shape[0] * shape[1] * shape[2]
+        sums = self._sums[:size].reshape(shape)
+        counts = self._counts[:size].reshape(shape)
+
+        network_sums = sums.sum(axis=0)
+        network_counts = counts.sum(axis=0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (sums / counts).astype(np.float32)
+            network_mean = (network_sums / network_counts).astype(np.float32)
+
+        return CrowdProfile(
+            self.station_ids,
+            mean,
+            counts.astype(np.uint32),
+            network_mean,
+            network_counts.astype(np.uint32)
+        )
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        profile = CrowdProfile.build(db)
+    finally:
+        db.close()
+
+    size = profile.save()
+    print(
+        f"✅ Crowd profile built for {len(profile)} stations "
+        f"from {profile.observations} observations "
+        f"in {time.perf_counter() - start:.1f}s ({size / 1024:.0f} KiB)"
+    )
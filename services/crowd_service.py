@@ -1,6 +1,11 @@
+import math
 import random
+import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from app.models import (
     CrowdDensityLevel,
@@ -9,71 +14,246 @@ from app.models import (
     DataSource,
     UserCrowdSignal
 )
-from app.state import crowd_state
+from app import state
+from app.state import crowd_state, mark_crowd_dirty
+from app.crowd_store import (
+    DENSITY_CODE, DENSITY_LEVELS, TREND_CODE, SOURCE_CODE, SOURCES, SIGNAL_DENSITY
+)
 
 
+# =============================================================================
+# SOURCE FUSION
+# =============================================================================
 
+# How much one observation from each source counts (before decay)
+SOURCE_WEIGHTS: Dict[DataSource, float] = {
+    DataSource.IMAGE_ANALYSIS: 3.0,
+    DataSource.USER_REPORT: 1.0,
+    DataSource.PREDICTION: 0.5,
+    DataSource.MOCK: 0.5,
+    DataSource.HISTORICAL: 0.25,
+}
 
+FUSION_HALF_LIFE = 120.0       # seconds for an observation to lose half its weight
+FUSION_CONFIDENCE_SCALE = 2.0  # decayed weight at which confidence reaches ~63%
+FUSION_MAX_CONFIDENCE = 0.99
+FUSION_MAX_WEIGHT = 20.0       # cap so floods can't freeze the estimate
+FUSION_RELEASE_WEIGHT = 0.1    # below this decayed weight a coach goes back to mock drift
+FUSION_CONFIDENCE_STEP = 0.01  # confidence moves smaller than this aren't rewritten per tick
 
-class CrowdService:
-    """Service for crowd prediction and management (mock + user signals)"""
+PROFILE_CONFIDENT_SAMPLES = 50  # history samples at which a profile slot is fully trusted
 
-    def __init__(self):
-        self.coaches = [f"C{i}" for i in range(1, 13)]
-        self.density_levels = list(CrowdDensityLevel)
+TRAIN_CROWD_CACHE_SIZE = 4096   # per-train aggregates kept (LRU beyond this)
 
-    def update_crowd_state_periodic(self):
-        """Periodically evolve crowd state (called by WS loop)."""
-        for station_id, station_data in crowd_state.items():
-            coaches = station_data.get("coaches", {})
 
-            for coach_id, coach_data in coaches.items():
-                trend = coach_data.get("trend", TrendDirection.STABLE)
-                current_density = coach_data.get("density", CrowdDensityLevel.MEDIUM)
+class CrowdFusionEngine:
+    """
+    Per-coach exponentially decayed weighted average of density reports.
 
-                densities = list(CrowdDensityLevel)
-                idx = densities.index(current_density)
+    Each coach keeps (sum, weight, ts) in the crowd_state fused_* arrays.
+    An observation decays the running pair to `now`, then adds
+    weight * density, so an update is O(1) whatever the report volume.
+    Density is round(sum / weight); confidence grows with the decayed
+    weight, i.e. with how much recent, trusted evidence there is.
+
+    Between observations the periodic tick (relax) keeps the stored
+    confidence decaying, and once a coach's evidence has decayed below
+    FUSION_RELEASE_WEIGHT it is reset to the station baseline.
+    """
+
+    def __init__(
+        self,
+        store,
+        weights: Dict[DataSource, float] = SOURCE_WEIGHTS,
+        half_life: float = FUSION_HALF_LIFE,
+        confidence_scale: float = FUSION_CONFIDENCE_SCALE
+    ):
+        self.store = store
+        self.weights = dict(weights)
+        self.decay_rate = math.log(2) / half_life
+        self.confidence_scale = confidence_scale
+
+    def confidence(self, weight: float) -> float:
+        return min(FUSION_MAX_CONFIDENCE, 1.0 - math.exp(-weight / self.confidence_scale))
+
+    def observe(
+        self,
+        row: int,
+        col: int,
+        density: CrowdDensityLevel,
+        source: DataSource,
+        certainty: float = 1.0,
+        now: Optional[float] = None
+    ) -> Tuple[CrowdDensityLevel, float]:
+        """Fold one observation into a coach. Returns (density, confidence)."""
+        now = now if now is not None else time.time()
+        store = self.store
+
+        decay = math.exp(-self.decay_rate * max(0.0, now - store.fused_ts[row, col]))
+        weight = self.weights.get(source, 1.0) * certainty
+
+        prior = store.fused_weight[row, col] * decay
+        scale = decay if prior <= FUSION_MAX_WEIGHT else decay * FUSION_MAX_WEIGHT / prior
+
+        total = store.fused_weight[row, col] * scale + weight
+        value = store.fused_sum[row, col] * scale + weight * DENSITY_CODE[density]
+
+        store.fused_sum[row, col] = value
+        store.fused_weight[row, col] = total
+        store.fused_ts[row, col] = now
+
+        code = min(len(DENSITY_LEVELS) - 1, max(0, int(value / total + 0.5)))
+        confidence = round(self.confidence(total), 3)
+
+        store.set_density(row, col, code)
+        store.confidence[row, col] = confidence
+        store.source[row, col] = SOURCE_CODE[source]
+        store.updated[row, col] = now
+
+        return DENSITY_LEVELS[code], confidence
+
+    def relax(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        Vectorized periodic step over fused (non-mock) coaches: decay
+        their weight to `now` and recompute density / confidence from the
+        decayed (sum, weight). Coaches left with less than
+        FUSION_RELEASE_WEIGHT are released: density goes back to the
+        station's baseline (station_density) with a stable trend and MOCK
+        source, and the fused pair is re-seeded from that baseline at the
+        mock prior weight. With a stable trend evolve leaves the coach
+        there, so the prior the next observation blends with stays true.
+        Returns the (station_id, coach_id) pairs that changed.
+        """
+        now = now if now is not None else time.time()
+        store = self.store
+        n = len(store)
+        if not n:
+            return []
+
+        mock = SOURCE_CODE[DataSource.MOCK]
+        rows, cols = np.nonzero(store.source[:n] != mock)
+        if not len(rows):
+            return []
+
+        decay = np.exp(-self.decay_rate * np.maximum(0.0, now - store.fused_ts[rows, cols]))
+        weight = store.fused_weight[rows, cols] * decay
+        fused_sum = store.fused_sum[rows, cols] * decay
+
+        codes = np.clip(
+            np.floor(fused_sum / np.maximum(weight, 1e-12) + 0.5),
+            0, len(DENSITY_LEVELS) - 1
+        ).astype(np.int8)
+        confidence = np.minimum(
+            FUSION_MAX_CONFIDENCE, 1.0 - np.exp(-weight / self.confidence_scale)
+        ).round(3)
+
+        released = weight < FUSION_RELEASE_WEIGHT
+        changed = (
+            released
+            | (codes != store.density[rows, cols])
+            | (np.abs(confidence - store.confidence[rows, cols]) >= FUSION_CONFIDENCE_STEP)
+        )
+
+        moved = []
+        prior = self.weights.get(DataSource.MOCK, 0.0)
+        for i in np.nonzero(changed)[0].tolist():
+            row, col = int(rows[i]), int(cols[i])
+            store.confidence[row, col] = confidence[i]
+            if released[i]:
+                # evidence has decayed away: back to the station baseline
+                code = int(store.station_density[row])
+                store.set_density(row, col, code)
+                store.source[row, col] = mock
+                store.trend[row, col] = TREND_CODE[TrendDirection.STABLE]
+                store.fused_sum[row, col] = code * prior
+                store.fused_weight[row, col] = prior
+                store.fused_ts[row, col] = now
+            elif weight[i] > 0:
+                store.set_density(row, col, int(codes[i]))
+            moved.append((store.station_ids[row], store.coach_ids[col]))
+
+        return moved
+
+    def estimate(self, row: int, col: int, now: Optional[float] = None) -> Tuple[float, float]:
+        """Current (continuous density code, confidence) without updating."""
+        now = now if now is not None else time.time()
+        store = self.store
+
+        decay = math.exp(-self.decay_rate * max(0.0, now - store.fused_ts[row, col]))
+        weight = store.fused_weight[row, col] * decay
+        if weight <= 0:
+            return float(store.density[row, col]), 0.0
+        return store.fused_sum[row, col] * decay / weight, self.confidence(weight)
 
-                if trend == TrendDirection.INCREASING:
-                    idx = min(len(densities) - 1, idx + 1)
-                elif trend == TrendDirection.DECREASING:
-                    idx = max(0, idx - 1)
 
-                coach_data["density"] = densities[idx]
-                coach_data["last_updated"] = datetime.utcnow().isoformat()
-            
-            station_data["timestamp"] = datetime.utcnow().isoformat()
+class CrowdService:
+    """Service for crowd prediction and management (mock + user signals)"""
 
+    def __init__(self):
+        self.coaches = [f"C{i}" for i in range(1, 13)]
+        self.density_levels = list(CrowdDensityLevel)
+        self.fusion = CrowdFusionEngine(crowd_state)
 
+        # train_no → (station, crowd_versions stamp, train crowd), LRU
+        self._train_crowd_cache: "OrderedDict[str, Tuple[str, int, Dict]]" = OrderedDict()
 
+    def update_crowd_state_periodic(self):
+        """Periodically evolve crowd state (called by WS loop)."""
+        # vectorized over every station × coach; only moved coaches are dirty
+        now = time.time()
+        for station_id, coach_id in self.fusion.relax(now) + crowd_state.evolve(now):
+            mark_crowd_dirty(station_id, coach_id)
 
     # ------------------------------------------------------------------
     # Mock generation
     # ------------------------------------------------------------------
 
     def generate_mock_crowd_for_station(self, station_id: str) -> Dict:
-        hour = datetime.now().hour
-        base_density = self._base_density_by_time(hour)
-
-        coaches = {}
-        for coach in self.coaches:
-            density = self._vary_density(base_density)
-            coaches[coach] = {
-                "density": density,
-                "trend": self._random_trend(),
-                "confidence": round(random.uniform(0.7, 0.95), 2),
-                "last_updated": datetime.utcnow().isoformat(),
-                "user_reports_count": 0,
-                "source": DataSource.MOCK
-            }
+        """Seed a station row in crowd_state with mock data and return it."""
+        base_density = self._expected_density(station_id, datetime.now())
+
+        crowd_state.put_station(
+            station_id,
+            density=[
+                DENSITY_CODE[self._vary_density(base_density)]
+                for _ in crowd_state.coach_ids
+            ],
+            trend=[
+                TREND_CODE[self._random_trend()]
+                for _ in crowd_state.coach_ids
+            ],
+            confidence=np.round(
+                np.random.uniform(0.7, 0.95, len(crowd_state.coach_ids)), 2
+            ),
+            overall=DENSITY_CODE[base_density],
+            source=DataSource.MOCK,
+            prior_weight=SOURCE_WEIGHTS[DataSource.MOCK]
+        )
+        mark_crowd_dirty(station_id)
+
+        return crowd_state.station(station_id)
+
+    def _ensure_station(self, station_id: str, ad_hoc: bool = False) -> bool:
+        """
+        Make sure station_id has a crowd_state row, if the station
+        registry allows one (unregistered stations only on write paths,
+        with ad_hoc set). Returns whether the row exists.
+        """
+        registry = state.station_registry
+        if registry is not None and not registry.admit(station_id, ad_hoc):
+            return False
 
-        return {
-            "station_id": station_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "overall_density": base_density,
-            "coaches": coaches,
-            "source": DataSource.MOCK
-        }
+        if station_id not in crowd_state:
+            self.generate_mock_crowd_for_station(station_id)
+        return True
+
+    def _expected_density(self, station_id: str, when: datetime) -> CrowdDensityLevel:
+        """Historical profile for the station's slot, else the time-of-day pattern."""
+        profile = state.crowd_profile
+        history = profile.expected(station_id, when) if profile is not None else None
+        if history is None:
+            return self._base_density_by_time(when.hour)
+        return DENSITY_LEVELS[self._density_code(history[0])]
 
     def _base_density_by_time(self, hour: int) -> CrowdDensityLevel:
         if 7 <= hour < 10 or 17 <= hour < 21:
@@ -109,188 +289,268 @@ class CrowdService:
     # ------------------------------------------------------------------
 
     def get_line_overview(self, stations: List[str]) -> List[Dict]:
-        overview = []
+        """
+        Per-station mean density for `stations`, read from the store's
+        running density sums (no per-coach scan).
+        """
+        admitted = [
+            station for station in map(state.resolve_station, stations)
+            if self._ensure_station(station)
+        ]
+        if not admitted:
+            return []
+
+        rows = [crowd_state.station_index[station] for station in admitted]
+        means = crowd_state.mean_density(rows).tolist()
+        updated = crowd_state.station_updated[rows].tolist()
+        total_coaches = len(crowd_state.coach_ids)
+
+        return [
+            {
+                "station_code": station,
+                "overall_density": DENSITY_LEVELS[self._density_code(mean)],
+                "score": round(mean + 1, 2),
+                "timestamp": datetime.utcfromtimestamp(ts).isoformat(),
+                "total_coaches": total_coaches
+            }
+            for station, mean, ts in zip(admitted, means, updated)
+        ]
 
-        for station in stations:
-            if station not in crowd_state:
-                crowd_state[station] = self.generate_mock_crowd_for_station(station)
+    def get_line_crowd(self, line: str, stations: List[str]) -> Optional[Dict]:
+        """Line-level density plus the per-station overview; None if no station is live."""
+        overview = self.get_line_overview(stations)
+        if not overview:
+            return None
 
-            data = crowd_state[station]
-            avg = self._average_density(data["coaches"])
+        # every row has the same coaches, so the line mean is the mean of row means
+        rows = [crowd_state.station_index[s["station_code"]] for s in overview]
+        mean = float(crowd_state.mean_density(rows).mean())
 
-            overview.append({
-                "station_code": station,
-                "overall_density": avg,
-                "timestamp": data["timestamp"],
-                "total_coaches": len(data["coaches"])
-            })
+        return {
+            "line": line,
+            "timestamp": datetime.utcnow().isoformat(),
+            "total_stations": len(overview),
+            "overall_density": DENSITY_LEVELS[self._density_code(mean)],
+            "score": round(mean + 1, 2),
+            "stations": overview
+        }
 
-        return overview
+    def get_station_crowd(self, station_id: str) -> Optional[Dict]:
+        station_id = state.resolve_station(station_id)
+        if not self._ensure_station(station_id):
+            return None
+        return crowd_state.station(station_id)
 
-    def get_station_crowd(self, station_id: str) -> Dict:
-        if station_id not in crowd_state:
-            crowd_state[station_id] = self.generate_mock_crowd_for_station(station_id)
-        return crowd_state[station_id]
-
-# fixing the train problem
-    # def get_train_crowd(self, train_no: str, station_code: Optional[str] = None) -> Dict:
-    #     coaches = {}
-    #     for coach in self.coaches:
-    #         coaches[coach] = {
-    #             "density": random.choice(self.density_levels),
-    #             "trend": self._random_trend(),
-    #             "confidence": round(random.uniform(0.6, 0.9), 2),
-    #             "last_updated": datetime.utcnow().isoformat(),
-    #             "user_reports_count": random.randint(0, 10),
-    #             "source": DataSource.MOCK
-    #         }
-
-    #     return {
-    #         "train_no": train_no,
-    #         "station_code": station_code,
-    #         "timestamp": datetime.utcnow().isoformat(),
-    #         "overall_density": self._average_density(coaches),
-    #         "coaches": coaches,
-    #         "source": DataSource.MOCK
-    #     }
-    # def get_train_crowd(self, train_no: str, station: str) -> dict:
-    # coaches = {}
-    # for c in self.coaches:
-    #     coaches[c] = {
-    #         "density": random.choice(self.density_levels),
-    #         "trend": self._random_trend(),
-    #         "confidence": round(random.uniform(0.6, 0.9), 2),
-    #         "source": DataSource.MOCK
-    #     }
-
-    # return {
-    #     "train_no": train_no,
-    #     "station": station,
-    #     "overall_density": self._average_density(coaches),
-    #     "coaches": coaches
-    # }
-        # def get_train_crowd(self, train_no: str, station: str) -> Dict:
-        #     """Mock crowd data for a specific train at a station"""
-
-        # coaches = {}
-
-        # for coach in self.coaches:
-        #     coaches[coach] = {
-        #         "density": random.choice(self.density_levels),
-        #         "trend": self._random_trend(),
-        #         "confidence": round(random.uniform(0.6, 0.9), 2),
-        #         "last_updated": datetime.utcnow().isoformat(),
-        #         "user_reports_count": 0,
-        #         "source": DataSource.MOCK
-        #     }
-
-        # return {
-        #     "train_no": train_no,
-        #     "station": station,
-        #     "timestamp": datetime.utcnow().isoformat(),
-        #     "overall_density": self._average_density(coaches),
-        #     "coaches": coaches,
-        #     "source": DataSource.MOCK
-        # }
-    def get_train_crowd(self, train_no: str, station: Optional[str] = None) -> Dict:
+    # ------------------------------------------------------------------
+    # Prediction
+    # ------------------------------------------------------------------
+
+    def predict_crowd(
+        self,
+        station_id: str,
+        train_no: Optional[str],
+        when: datetime
+    ) -> Dict:
         """
-        Aggregate coach-level crowd data into a train-level crowd signal.
+        Expected density at a station for a given time: the historical
+        profile for that weekday and 15-minute slot (time-of-day pattern
+        when there is no history), blended with the live fused estimate
+        for near-term queries (the closer the query, the more live data
+        counts).
         """
+        factors = []
+        station_id = state.resolve_station(station_id)
 
-    # ---- MOCK coach crowd (for now) ----
-        coaches = {}
-
-        for coach in self.coaches:
-             coaches[coach] = {
-                "density": random.choice(self.density_levels),
-                "trend": self._random_trend(),
-                "confidence": round(random.uniform(0.6, 0.9), 2),
-                "last_updated": datetime.utcnow().isoformat(),
-                "user_reports_count": 0,
-                "source": DataSource.MOCK
-        }
+        profile = state.crowd_profile
+        history = profile.expected(station_id, when) if profile is not None else None
 
-    # ---- Aggregate LEVEL ----
-        weights = {
-                CrowdDensityLevel.VERY_LOW: 1,
-                CrowdDensityLevel.LOW: 2,
-                CrowdDensityLevel.MEDIUM: 3,
-                CrowdDensityLevel.HIGH: 4,
-                CrowdDensityLevel.VERY_HIGH: 5
-            }
-
-        total_score = sum(weights[c["density"]] for c in coaches.values())
-        avg_score = total_score / len(coaches)
-
-        if avg_score < 1.5:
-            level = CrowdDensityLevel.VERY_LOW
-        elif avg_score < 2.5:
-            level = CrowdDensityLevel.LOW
-        elif avg_score < 3.5:
-            level = CrowdDensityLevel.MEDIUM
-        elif avg_score < 4.5:
-            level = CrowdDensityLevel.HIGH
+        if history is not None:
+            # station × weekday × 15-minute slot mean (already weekday-aware)
+            expected, samples, scope = history
+            factors.append(f"{scope}_history")
+            confidence = 0.5 + 0.3 * min(1.0, samples / PROFILE_CONFIDENT_SAMPLES)
         else:
-            level = CrowdDensityLevel.VERY_HIGH
+            expected, labels = self._baseline_code(when)
+            factors.extend(labels)
+            confidence = 0.5
+        row = crowd_state.station_index.get(station_id)
+        lead_minutes = abs((when - datetime.now()).total_seconds()) / 60
+
+        if row is not None and lead_minutes <= 60:
+            now = time.time()
+            estimates = [
+                self.fusion.estimate(row, col, now)
+                for col in range(len(crowd_state.coach_ids))
+            ]
+            live_value = sum(v for v, _ in estimates) / len(estimates)
+            live_confidence = sum(c for _, c in estimates) / len(estimates)
+
+            live_weight = live_confidence * (1 - lead_minutes / 60)
+            if live_weight > 0:
+                expected = (1 - live_weight) * expected + live_weight * live_value
+                confidence = min(FUSION_MAX_CONFIDENCE, confidence + 0.45 * live_weight)
+                factors.append("live_crowd")
+
+        if train_no:
+            factors.append(f"train_{train_no}")
 
-        # ---- Aggregate TREND ----
-        trend_score = 0
-        for c in coaches.values():
-            if c["trend"] == TrendDirection.INCREASING:
-                trend_score += 1
-            elif c["trend"] == TrendDirection.DECREASING:
-                trend_score -= 1
+        return {
+            "station_id": station_id,
+            "train_no": train_no,
+            "predicted_density": DENSITY_LEVELS[self._density_code(expected)],
+            "confidence": round(confidence, 2),
+            "factors": factors
+        }
+
+    def get_train_crowd(
+        self,
+        train_no: str,
+        station: Optional[str] = None,
+        minute: Optional[int] = None
+    ) -> Dict:
+        """
+        Aggregate coach-level crowd data into a train-level crowd signal.
 
+        Coaches are read from crowd_state at the train's current or next
+        stop from the timetable index at `minute` (minute of day, default
+        now); `station` is only the fallback for trains the index does not
+        know. The result is cached per train in an LRU and reused while the
+        train stays at that station and its crowd_versions stamp is
+        unchanged, i.e. until the train moves on or one of its coaches
+        changes.
+        """
+        located = None
+        if state.timetable_index is not None:
+            if minute is None:
+                now = datetime.now()
+                minute = now.hour * 60 + now.minute
+            located = state.timetable_index.train_position(train_no, minute)
+
+        at = located[0] if located else (state.resolve_station(station) if station else None)
+
+        if not at or not self._ensure_station(at):
+            return self._predicted_train_crowd(train_no, at)
+
+        version = state.crowd_versions.get(at, 0)
+        cached = self._train_crowd_cache.get(train_no)
+        if cached is not None and cached[:2] == (at, version):
+            self._train_crowd_cache.move_to_end(train_no)
+            return cached[2]
+
+        crowd = self._aggregate_train_crowd(train_no, at, located is not None)
+
+        self._train_crowd_cache[train_no] = (at, version, crowd)
+        self._train_crowd_cache.move_to_end(train_no)
+        if len(self._train_crowd_cache) > TRAIN_CROWD_CACHE_SIZE:
+            self._train_crowd_cache.popitem(last=False)
+        return crowd
+
+    def _aggregate_train_crowd(self, train_no: str, station: str, from_timetable: bool) -> Dict:
+        row = crowd_state.station_index[station]
+
+        density = crowd_state.density[row].astype(np.float64)
+        weights = crowd_state.confidence[row].astype(np.float64)
+        trend = crowd_state.trend[row]
+        sources = crowd_state.source[row]
+
+        # ---- Aggregate LEVEL: confidence-weighted mean density code ----
+        total = weights.sum()
+        mean_code = float(density @ weights / total) if total > 0 else float(density.mean())
+        level = DENSITY_LEVELS[self._density_code(mean_code)]
+
+        # ---- Aggregate TREND: rising minus falling coaches ----
+        trend_score = int(np.count_nonzero(trend == 1) - np.count_nonzero(trend == -1))
         if trend_score > 0:
-            trend = TrendDirection.INCREASING
+            trend_direction = TrendDirection.INCREASING
         elif trend_score < 0:
-            trend = TrendDirection.DECREASING
+            trend_direction = TrendDirection.DECREASING
         else:
-            trend = TrendDirection.STABLE
+            trend_direction = TrendDirection.STABLE
 
         # ---- Final train-level crowd ----
         return {
             "train_no": train_no,
             "station": station,
+            "position": "timetable" if from_timetable else "requested_station",
             "timestamp": datetime.utcnow().isoformat(),
-            "level": level,          # 👈 train crowd level
-            "trend": trend,          # 👈 train crowd trend
-            "coaches": coaches,      # 👈 keep coach data for drill-down
-            "source": DataSource.MOCK
-         }
-
+            "level": level,                        # train crowd level
+            "trend": trend_direction,              # train crowd trend
+            "score": round(mean_code + 1, 2),      # 1 (VERY_LOW) .. 5 (VERY_HIGH)
+            "trend_score": trend_score,
+            "coaches": crowd_state.station(station)["coaches"],  # drill-down
+            "source": SOURCES[int(np.bincount(sources).argmax())]
+        }
 
+    def _predicted_train_crowd(self, train_no: str, station: Optional[str]) -> Dict:
+        """No live coach state for the station: historical / time-of-day level only."""
+        when = datetime.now()
+        profile = state.crowd_profile
+        history = profile.expected(station or "", when) if profile is not None else None
+        expected = history[0] if history is not None else self._baseline_code(when)[0]
+        level = DENSITY_LEVELS[self._density_code(expected)]
+        return {
+            "train_no": train_no,
+            "station": station,
+            "position": "unknown",
+            "timestamp": datetime.utcnow().isoformat(),
+            "level": level,
+            "trend": TrendDirection.STABLE,
+            "score": DENSITY_CODE[level] + 1,
+            "trend_score": 0,
+            "coaches": {},
+            "source": DataSource.PREDICTION
+        }
 
     # ------------------------------------------------------------------
     # User signals
     # ------------------------------------------------------------------
 
-    def process_user_signal(self, signal: UserCrowdSignal):
-        station = signal.station_id
-        coach = signal.coach_id
-
-        if station not in crowd_state:
-            crowd_state[station] = self.generate_mock_crowd_for_station(station)
-
-        coaches = crowd_state[station]["coaches"]
-        if coach not in coaches:
-            return
-
-        data = coaches[coach]
+    def process_user_signal(self, signal: UserCrowdSignal) -> bool:
+        return self.process_user_signals(
+            signal.station_id, signal.coach_id, [signal.signal]
+        )
 
-        if signal.signal == CrowdSignalType.VERY_CROWDED:
-            data["density"] = CrowdDensityLevel.VERY_HIGH
-        elif signal.signal == CrowdSignalType.RELATIVELY_EMPTY:
-            data["density"] = CrowdDensityLevel.LOW
-        elif signal.signal == CrowdSignalType.CROWD_INCREASING:
-            data["trend"] = TrendDirection.INCREASING
-        elif signal.signal == CrowdSignalType.CROWD_DECREASING:
-            data["trend"] = TrendDirection.DECREASING
-
-        data["user_reports_count"] += 1
-        data["confidence"] = min(0.95, data["confidence"] + 0.05)
-        data["last_updated"] = datetime.utcnow().isoformat()
-        data["source"] = DataSource.USER_REPORT
+    def process_user_signals(
+        self,
+        station: str,
+        coach: str,
+        signals: List[CrowdSignalType]
+    ) -> bool:
+        """
+        Apply several signals for one coach as a single update. Returns
+        False when nothing was applied (station not admitted, unknown
+        coach or no signals).
+        Density reports are fused (one O(1) fusion step each, which also
+        sets the coach's source); the last trend signal wins. Trend-only
+        batches leave the source alone.
+        """
+        station = state.resolve_station(station)
+        if not self._ensure_station(station, ad_hoc=True):
+            return False
+
+        pos = crowd_state.locate(station, coach)
+        if pos is None or not signals:
+            return False
+
+        now = time.time()
+        trend = None
+        for signal in signals:
+            if signal in SIGNAL_DENSITY:
+                self.fusion.observe(*pos, SIGNAL_DENSITY[signal], DataSource.USER_REPORT, now=now)
+            elif signal == CrowdSignalType.CROWD_INCREASING:
+                trend = TrendDirection.INCREASING
+            elif signal == CrowdSignalType.CROWD_DECREASING:
+                trend = TrendDirection.DECREASING
+
+        crowd_state.update_coach(
+            station,
+            coach,
+            trend=trend,
+            add_reports=len(signals),
+            ts=now
+        )
+        mark_crowd_dirty(station, coach)
+        return True
 
     # ------------------------------------------------------------------
     # Image analysis (mock)
@@ -305,15 +565,29 @@ class CrowdService:
         density = random.choice(self.density_levels)
         confidence = round(random.uniform(0.75, 0.95), 2)
 
-        if station_id not in crowd_state:
-            crowd_state[station_id] = self.generate_mock_crowd_for_station(station_id)
-
-        if coach_id in crowd_state[station_id]["coaches"]:
-            crowd_state[station_id]["coaches"][coach_id].update({
-                "density": density,
+        station_id = state.resolve_station(station_id)
+        self._ensure_station(station_id, ad_hoc=True)
+
+        pos = crowd_state.locate(station_id, coach_id)
+        if pos is not None:
+            # model confidence scales how much this frame counts
+            self.fusion.observe(
+                *pos, density, DataSource.IMAGE_ANALYSIS, certainty=confidence
+            )
+            mark_crowd_dirty(station_id, coach_id)
+
+        if state.history_writer is not None:
+            state.history_writer.record({
+                "observed_at": datetime.utcnow(),
+                "station": station_id,
+                "coach_id": coach_id,
+                "kind": "image",
+                "density": DENSITY_CODE[density],
+                "trend": None,
                 "confidence": confidence,
-                "last_updated": datetime.utcnow().isoformat(),
-                "source": DataSource.IMAGE_ANALYSIS
+                "source": DataSource.IMAGE_ANALYSIS.value,
+                "signal": None,
+                "user_id": None
             })
 
         return {
@@ -328,23 +602,23 @@ class CrowdService:
     # Helpers
     # ------------------------------------------------------------------
 
-    def _average_density(self, coaches: Dict) -> CrowdDensityLevel:
-        if not coaches:
-            return CrowdDensityLevel.MEDIUM
-
-        weights = {
-            CrowdDensityLevel.VERY_LOW: 1,
-            CrowdDensityLevel.LOW: 2,
-            CrowdDensityLevel.MEDIUM: 3,
-            CrowdDensityLevel.HIGH: 4,
-            CrowdDensityLevel.VERY_HIGH: 5
-        }
-
-        total = sum(weights[c["density"]] for c in coaches.values())
-        avg = round(total / len(coaches))
+    def _baseline_code(self, when: datetime) -> Tuple[float, List[str]]:
+        """Deterministic time-of-day / weekend density code and its factor labels."""
+        hour = when.hour
+        if 7 <= hour < 10 or 17 <= hour < 21:
+            expected, labels = 3.5, ["peak_hours"]
+        elif 10 <= hour < 17:
+            expected, labels = 2.5, ["midday"]
+        elif hour >= 22 or hour < 6:
+            expected, labels = 0.5, ["late_night"]
+        else:
+            expected, labels = 2.0, ["shoulder_hours"]
 
-        for level, value in weights.items():
-            if value == avg:
-                return level
+        if when.weekday() >= 5:
+            expected -= 1.0
+            labels.append("weekend")
+        return expected, labels
 
-        return CrowdDensityLevel.MEDIUM
\ No newline at end of file
+    def _density_code(self, value: float) -> int:
+        """Round a continuous density code to a valid DENSITY_LEVELS index."""
+        return min(len(DENSITY_LEVELS) - 1, max(0, int(value + 0.5)))
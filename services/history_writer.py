@@ -0,0 +1,262 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+from app.crowd_store import SOURCES
+from app.db_models import CrowdObservation
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_SPILL_PATH = BASE_DIR / "data" / "crowd_history_spill.jsonl"
+
+
+class HistoryWriter:
+    """
+    Buffered writer for the crowd_observations table.
+
+    record() only appends to an in-memory deque (never blocks, drops when
+    the buffer is full). A background task flushes batches with one
+    executemany INSERT in a worker thread, and queues a snapshot of every
+    coach in `store` each snapshot_interval seconds. When a flush fails,
+    the batch is appended to a local JSONL spill file and replayed once
+    PostgreSQL accepts writes again.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        store=None,
+        snapshot_interval: float = 60.0,
+        batch_size: int = 1000,
+        flush_interval: float = 5.0,
+        max_buffer: int = 100_000,
+        spill_path: Path = DEFAULT_SPILL_PATH,
+        max_spill_bytes: int = 256 * 1024 * 1024
+    ):
+        self.session_factory = session_factory
+        self.store = store
+        self.snapshot_interval = snapshot_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = Path(spill_path)
+        self.max_spill_bytes = max_spill_bytes
+
+        self._buffer: deque = deque()
+        self._wakeup = asyncio.Event()
+        self._db_healthy = True
+        self._last_snapshot = 0.0
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    # ------------------------------------------------------------------
+    # Producer side (request path / background loops)
+    # ------------------------------------------------------------------
+
+    def record(self, row: Dict) -> bool:
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return False
+
+        self._buffer.append(row)
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def record_snapshot(self, store, now: Optional[float] = None):
+        """Queue one row per coach of every station in the store."""
+        observed_at = datetime.utcfromtimestamp(now if now is not None else time.time())
+        n = len(store.station_ids)
+
+        density = store.density[:n].tolist()
+        trend = store.trend[:n].tolist()
+        confidence = store.confidence[:n].round(3).tolist()
+        source = store.source[:n].tolist()
+
+        for row, station in enumerate(store.station_ids[:n]):
+            for col, coach_id in enumerate(store.coach_ids):
+                self.record({
+                    "observed_at": observed_at,
+                    "station": station,
+                    "coach_id": coach_id,
+                    "kind": "snapshot",
+                    "density": density[row][col],
+                    "trend": trend[row][col],
+                    "confidence": confidence[row][col],
+                    "source": SOURCES[source[row][col]].value,
+                    "signal": None,
+                    "user_id": None
+                })
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def _take_batch(self) -> List[Dict]:
+        count = min(self.batch_size, len(self._buffer))
+        return [self._buffer.popleft() for _ in range(count)]
+
+    def _insert(self, rows: List[Dict]):
+        db = self.session_factory()
+        try:
+            db.execute(insert(CrowdObservation), rows)
+            db.commit()
+        finally:
+            db.close()
+
+    def _spill(self, rows: List[Dict]):
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        if (
+            self.spill_path.exists()
+            and self.spill_path.stat().st_size > self.max_spill_bytes
+        ):
+            self.dropped += len(rows)
+            return
+
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=datetime.isoformat) + "\n")
+        self.spilled += len(rows)
+
+    def _replay_spill(self) -> int:
+        """
+        Insert spilled rows back into PostgreSQL, then remove the file.
+
+        The byte offset past the last committed batch is saved next to the
+        .replay file, so a replay that fails partway resumes there instead
+        of inserting the committed batches a second time.
+        """
+        replaying = self.spill_path.with_suffix(".replay")
+        offset_path = self.spill_path.with_suffix(".offset")
+        if not replaying.exists():
+            # (a leftover .replay means a previous replay was interrupted)
+            if not self.spill_path.exists():
+                return 0
+            os.replace(self.spill_path, replaying)
+            offset_path.unlink(missing_ok=True)
+
+        offset = int(offset_path.read_text()) if offset_path.exists() else 0
+
+        replayed = 0
+        batch = []
+        with open(replaying, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                row = json.loads(line)
+                row["observed_at"] = datetime.fromisoformat(row["observed_at"])
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self._insert(batch)
+                    self._save_offset(offset_path, offset)
+                    replayed += len(batch)
+                    batch = []
+        if batch:
+            self._insert(batch)
+            replayed += len(batch)
+
+        os.remove(replaying)
+        offset_path.unlink(missing_ok=True)
+        return replayed
+
+    def _save_offset(self, path: Path, offset: int):
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(str(offset))
+        os.replace(tmp, path)
+
+    async def flush(self):
+        """Write everything buffered so far (spilling on failure)."""
+        while self._buffer:
+            rows = self._take_batch()
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                if self._db_healthy:
+                    print(f"⚠️ Crowd history write failed, spilling to disk: {e}")
+                self._db_healthy = False
+                await asyncio.to_thread(self._spill, rows)
+                # the rest goes to disk too rather than waiting on the DB
+                while self._buffer:
+                    await asyncio.to_thread(self._spill, self._take_batch())
+                return
+
+            self.written += len(rows)
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+
+            if not self._db_healthy:
+                self._db_healthy = True
+                print("✅ Crowd history writes recovered")
+
+            # PostgreSQL keeping up slower than producers: park the excess
+            # on disk before the buffer fills and starts dropping rows
+            while len(self._buffer) > self.max_buffer // 2:
+                await asyncio.to_thread(self._spill, self._take_batch())
+
+        if self._db_healthy and (
+            self.spill_path.exists() or self.spill_path.with_suffix(".replay").exists()
+        ):
+            try:
+                self.replayed += await asyncio.to_thread(self._replay_spill)
+            except Exception as e:
+                print(f"⚠️ Crowd history spill replay failed: {e}")
+
+    async def run(self):
+        print("🗄️ Crowd history writer started")
+
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+                now = time.monotonic()
+                if self.store is not None and now - self._last_snapshot >= self.snapshot_interval:
+                    self._last_snapshot = now
+                    self.record_snapshot(self.store)
+
+                await self.flush()
+            except asyncio.CancelledError:
+                await self.flush()
+                print("🛑 Crowd history writer stopped")
+                break
+            except Exception as e:
+                print(f"History writer loop error: {e}")
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "max_buffer": self.max_buffer,
+            "batch_size": self.batch_size,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "failed_flushes": self.failed_flushes,
+            "db_healthy": self._db_healthy,
+            "spill_bytes": (
+                self.spill_path.stat().st_size if self.spill_path.exists() else 0
+            ),
+            "last_flush_ms": round(self.last_flush_ms, 3)
+        }
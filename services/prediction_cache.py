@@ -0,0 +1,121 @@
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+BUCKET_MINUTES = 5
+
+
+def prediction_key(station_id: str, train_no: Optional[str], when: datetime) -> Tuple:
+    """(station, train, 5-minute bucket) — requests in one bucket share a result."""
+    bucket = when.replace(
+        minute=when.minute - when.minute % BUCKET_MINUTES,
+        second=0,
+        microsecond=0
+    )
+    return station_id, train_no or "", bucket.isoformat(timespec="minutes")
+
+
+class PredictionCache:
+    """
+    TTL + LRU cache for predictions with single-flight misses.
+
+    Entries expire `ttl` seconds after they were computed and the least
+    recently used entry is evicted past `max_entries`. While a key is
+    being computed, other callers for the same key await the same
+    future instead of computing it again. That only matters for coroutine
+    computes: a plain (sync) compute runs inline on the event loop, so
+    nothing else runs between its get() and put() and a burst of misses
+    computes once anyway (and it never reads crowd state off the loop).
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+
+        try:
+            value = compute()
+            if inspect.isawaitable(value):
+                value = await value
+        except asyncio.CancelledError:
+            # only this caller was cancelled; coalesced waiters get an
+            # error they can retry on instead of being cancelled too
+            future.set_exception(RuntimeError("prediction was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "in_flight": len(self._inflight),
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 3) if lookups else None
+        }
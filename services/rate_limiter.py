@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+from app.models import UserCrowdSignal
+
+
+class SlidingWindowLimiter:
+    """
+    Approximate sliding-window rate limiter (two fixed windows).
+
+    Per key only the previous and current window counts are kept; the
+    sliding count is prev * (remaining fraction of the window) + current.
+    Keys live in an OrderedDict in last-seen order, so idle keys are
+    evicted from the front in O(1) and memory stays bounded by max_keys.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        window: float,
+        max_keys: int = 100_000,
+        idle_ttl: Optional[float] = None
+    ):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl if idle_ttl is not None else 2 * window
+
+        # key → [window_start, prev_count, curr_count, last_seen]
+        self._keys: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def allow(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = now if now is not None else time.monotonic()
+
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                entry = [now, 0, 0, now]
+                self._keys[key] = entry
+            else:
+                self._keys.move_to_end(key)
+
+            elapsed = now - entry[0]
+            if elapsed >= self.window:
+                # roll forward; more than one full window → nothing carried
+                windows = int(elapsed // self.window)
+                entry[1] = entry[2] if windows == 1 else 0
+                entry[2] = 0
+                entry[0] += windows * self.window
+                elapsed = now - entry[0]
+
+            entry[3] = now
+            weight = 1.0 - elapsed / self.window
+            allowed = entry[1] * weight + entry[2] < self.limit
+            if allowed:
+                entry[2] += 1
+
+            self._evict(now)
+
+        return allowed
+
+    def refund(self, key: Hashable):
+        """Give back one hit counted by allow() for a request that wasn't served."""
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is not None and entry[2] > 0:
+                entry[2] -= 1
+
+    def _evict(self, now: float):
+        keys = self._keys
+        while keys:
+            oldest = next(iter(keys.values()))
+            if len(keys) <= self.max_keys and now - oldest[3] <= self.idle_ttl:
+                break
+            keys.popitem(last=False)
+            self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class RecentSet:
+    """Keys seen within the last `ttl` seconds (insertion-ordered expiry)."""
+
+    def __init__(self, ttl: float, max_keys: int = 200_000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Record key; False if it was already seen within ttl."""
+        now = now if now is not None else time.monotonic()
+
+        with self._lock:
+            seen = self._seen
+            while seen:
+                first_ts = next(iter(seen.values()))
+                if len(seen) < self.max_keys and now - first_ts <= self.ttl:
+                    break
+                seen.popitem(last=False)
+
+            if key in seen:
+                return False
+            seen[key] = now
+
+        return True
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._seen.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class SignalAdmission:
+    """
+    Gate in front of the signal pipeline: drops repeats of the same
+    signal for the same coach from one sender, then applies the
+    per-sender rate limit. Senders are user_id, or client IP without one.
+    """
+
+    def __init__(
+        self,
+        limit: int = 10,
+        window: float = 60.0,
+        dedup_window: float = 30.0,
+        max_keys: int = 100_000
+    ):
+        self.limiter = SlidingWindowLimiter(limit, window, max_keys=max_keys)
+        self.recent = RecentSet(dedup_window, max_keys=2 * max_keys)
+
+        self.admitted = 0
+        self.duplicates = 0
+        self.rate_limited = 0
+        self.released = 0
+
+    def sender(self, signal: UserCrowdSignal, client_ip: Optional[str]) -> str:
+        if signal.user_id:
+            return f"user:{signal.user_id}"
+        return f"ip:{client_ip or 'unknown'}"
+
+    def _dedup_key(self, sender: str, signal: UserCrowdSignal) -> Hashable:
+        return sender, signal.station_id, signal.coach_id, signal.signal
+
+    def check(self, signal: UserCrowdSignal, client_ip: Optional[str]) -> str:
+        """
+        Returns "ok", "duplicate" or "rate_limited". An "ok" counts against
+        the sender right away; call release() if the signal then can't be
+        queued.
+        """
+        sender = self.sender(signal, client_ip)
+        now = time.monotonic()
+
+        key = self._dedup_key(sender, signal)
+        if not self.recent.add(key, now):
+            self.duplicates += 1
+            return "duplicate"
+
+        if not self.limiter.allow(sender, now):
+            # not admitted, so a later retry isn't a duplicate
+            self.recent.discard(key)
+            self.rate_limited += 1
+            return "rate_limited"
+
+        self.admitted += 1
+        return "ok"
+
+    def release(self, signal: UserCrowdSignal, client_ip: Optional[str]):
+        """
+        Undo an "ok" from check() for a signal that was not queued (queue
+        full), so the client's retry is neither a duplicate nor charged
+        against its rate limit.
+        """
+        sender = self.sender(signal, client_ip)
+        self.recent.discard(self._dedup_key(sender, signal))
+        self.limiter.refund(sender)
+        self.admitted -= 1
+        self.released += 1
+
+    def stats(self) -> Dict:
+        checked = self.admitted + self.duplicates + self.rate_limited
+        return {
+            "limit": self.limiter.limit,
+            "window_seconds": self.limiter.window,
+            "dedup_window_seconds": self.recent.ttl,
+            "checked": checked,
+            "admitted": self.admitted,
+            "duplicates": self.duplicates,
+            "rate_limited": self.rate_limited,
+            "released": self.released,
+            "admit_ratio": round(self.admitted / checked, 3) if checked else None,
+            "tracked_senders": len(self.limiter),
+            "tracked_signals": len(self.recent),
+            "evicted_senders": self.limiter.evicted
+        }
@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db_models import Station, StationAlias, Train
+from app.encoding import encoder
+from services.station_resolver import StationResolver
+
+
+def content_etag(body: bytes) -> str:
+    """Strong ETag from the response bytes."""
+    return f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value covers `etag` (weak compare)."""
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ReferenceCache:
+    """
+    In-process copy of the reference tables (stations, station_aliases,
+    trains), which change about once a month.
+
+    Loaded in bulk at startup and on admin reload only. API responses
+    built from it are encoded once and kept with their content hash, so
+    a request is a dict lookup and a 304 costs no serialization at all.
+    Every reload drops the encoded responses and rebuilds the station
+    alias resolver.
+    """
+
+    def __init__(self):
+        self.stations: List[str] = []
+        self.aliases: Dict[str, str] = {}
+        self.trains: List[Tuple[str, Optional[str]]] = []
+        self._station_set: set = set()
+        self.resolver = StationResolver([], {})
+        self._responses: Dict[Hashable, Tuple[bytes, str]] = {}
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[str] = None
+        self.reloads = 0
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def refresh(self, db: Session):
+        self._load(
+            db.execute(select(Station.station)).scalars().all(),
+            db.execute(select(StationAlias.alias, StationAlias.station_code)).all(),
+            db.execute(select(Train.train_no, Train.train_name)).all()
+        )
+
+    async def refresh_async(self, db: AsyncSession):
+        stations = (await db.execute(select(Station.station))).scalars().all()
+        aliases = (await db.execute(
+            select(StationAlias.alias, StationAlias.station_code)
+        )).all()
+        trains = (await db.execute(select(Train.train_no, Train.train_name))).all()
+        self._load(stations, aliases, trains)
+
+    def _load(
+        self,
+        stations: Iterable[str],
+        aliases: Iterable[Tuple[str, str]],
+        trains: Iterable[Tuple[str, Optional[str]]]
+    ):
+        stations = list(stations)
+        with self._lock:
+            self.stations = stations
+            self._station_set = set(stations)
+            self.aliases = {alias: code for alias, code in aliases}
+            self.resolver = StationResolver(stations, self.aliases)
+            self.trains = sorted(
+                ((train_no, train_name) for train_no, train_name in trains),
+                key=lambda t: t[0]
+            )
+            self._responses = {}
+            self.loaded_at = datetime.utcnow().isoformat()
+            self.reloads += 1
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def has_station(self, station: str) -> bool:
+        return station in self._station_set
+
+    def response(self, key: Hashable, build: Callable[[], object]) -> Tuple[bytes, str]:
+        """(encoded body, ETag) for `key`, building and encoding it once."""
+        cached = self._responses.get(key)
+        if cached is None:
+            body = encoder.dumps(build()).encode()
+            cached = (body, content_etag(body))
+            self._responses[key] = cached
+        return cached
+
+    def stats(self) -> Dict:
+        return {
+            "stations": len(self.stations),
+            "aliases": len(self.aliases),
+            "trains": len(self.trains),
+            "encoded_responses": len(self._responses),
+            "resolver": self.resolver.stats(),
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads
+        }
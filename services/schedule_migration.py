@@ -0,0 +1,86 @@
+"""
+Schema upgrade + backfill for train_schedule.
+
+Adds the pre-parsed arrival_min / departure_min columns and the
+(station, arrival_min) index to existing databases (create_all only
+creates missing tables), then fills the columns from time_raw.
+
+Run manually with:
+    python -m services.schedule_migration
+"""
+
+from sqlalchemy import inspect, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.db_models import TrainSchedule
+from services.timetable_index import parse_time_raw_minutes
+
+
+def upgrade_train_schedule(engine: Engine):
+    """Add missing columns and index to train_schedule (idempotent)."""
+    columns = {c["name"] for c in inspect(engine).get_columns("train_schedule")}
+
+    with engine.begin() as conn:
+        for name in ("arrival_min", "departure_min"):
+            if name not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE train_schedule ADD COLUMN {name} INTEGER"
+                ))
+
+    for index in TrainSchedule.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+
+def backfill_schedule_minutes(db: Session, batch_size: int = 5000) -> int:
+    """
+    Parse time_raw into arrival_min / departure_min for rows that don't
+    have them yet. Walks the table by primary key in batches so rows with
+    unparseable times are visited once and left NULL.
+    """
+    updated = 0
+    last_id = None
+
+    while True:
+        query = (
+            db.query(TrainSchedule.id, TrainSchedule.time_raw)
+            .filter(TrainSchedule.arrival_min.is_(None))
+            .order_by(TrainSchedule.id)
+        )
+        if last_id is not None:
+            query = query.filter(TrainSchedule.id > last_id)
+
+        rows = query.limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        params = []
+        for row_id, time_raw in rows:
+            arrival, departure = parse_time_raw_minutes(time_raw)
+            if arrival is None:
+                continue
+            params.append({
+                "id": row_id,
+                "arrival_min": arrival,
+                "departure_min": departure
+            })
+
+        if params:
+            db.execute(update(TrainSchedule), params)
+            db.commit()
+            updated += len(params)
+
+    return updated
+
+
+if __name__ == "__main__":
+    from app.database import engine, SessionLocal
+
+    upgrade_train_schedule(engine)
+
+    db = SessionLocal()
+    try:
+        print(f"✅ Backfilled {backfill_schedule_minutes(db)} schedule rows")
+    finally:
+        db.close()
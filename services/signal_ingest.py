@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from app import state
+from app.models import DataSource, UserCrowdSignal
+from app.state import user_signals
+
+
+class SignalIngestPipeline:
+    """
+    Buffered user-signal ingestion.
+
+    POST handlers only append to a bounded buffer; a background task
+    drains it every `interval` seconds, groups the batch per station:coach
+    and applies each group with a single crowd_service update. When the
+    buffer is full new signals are rejected (counted, never blocking).
+
+    Signals are stamped with the server receive time (naive UTC) on
+    submit; the client's own timestamp is not trusted for history. Only
+    groups that were actually applied are recorded in crowd_observations.
+    """
+
+    def __init__(
+        self,
+        crowd_service,
+        interval: float = 0.1,
+        max_pending: int = 50_000,
+        rate_window: float = 10.0
+    ):
+        self.crowd_service = crowd_service
+        self.interval = interval
+        self.max_pending = max_pending
+        self.rate_window = rate_window
+
+        self._pending: deque = deque()  # (received_at, signal)
+        self._recent: deque = deque()  # (monotonic ts, signals applied)
+
+        self.received = 0
+        self.rejected = 0
+        self.applied = 0
+        self.coach_updates = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.last_batch_ms = 0.0
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+
+    def submit(self, signals: Iterable[UserCrowdSignal]) -> int:
+        """Queue signals; returns how many were accepted."""
+        received_at = datetime.utcnow()
+        accepted = 0
+        for signal in signals:
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                continue
+            self._pending.append((received_at, signal))
+            accepted += 1
+
+        self.received += accepted
+        return accepted
+
+    # ------------------------------------------------------------------
+    # Consumer side
+    # ------------------------------------------------------------------
+
+    def flush(self) -> int:
+        """Apply everything queued so far. Returns the number of signals."""
+        count = len(self._pending)
+        if not count:
+            return 0
+
+        start = time.perf_counter()
+
+        groups: Dict[Tuple[str, str], List[Tuple[datetime, UserCrowdSignal]]] = {}
+        for _ in range(count):
+            received_at, signal = self._pending.popleft()
+            key = (signal.station_id, signal.coach_id)
+            groups.setdefault(key, []).append((received_at, signal))
+
+        for (station, coach), entries in groups.items():
+            signals = [signal.signal for _, signal in entries]
+            try:
+                applied = self.crowd_service.process_user_signals(station, coach, signals)
+            except Exception as e:
+                self.errors += 1
+                print(f"Signal ingest error ({station}:{coach}): {e}")
+                continue
+
+            # rejected groups (registry, unknown coach) reach neither the
+            # signal windows nor history; a window keeps the last
+            # USER_SIGNAL_WINDOW signals anyway
+            if applied:
+                user_signals[f"{station}:{coach}"].extend(signals)
+                self._record_history(entries)
+
+        now = time.monotonic()
+        self._recent.append((now, count))
+        self._trim_recent(now)
+
+        self.applied += count
+        self.coach_updates += len(groups)
+        self.batches += 1
+        self.last_batch_size = count
+        self.last_batch_ms = (time.perf_counter() - start) * 1000
+        return count
+
+    def _record_history(self, entries: List[Tuple[datetime, UserCrowdSignal]]):
+        history = state.history_writer
+        if history is None:
+            return
+
+        for received_at, signal in entries:
+            history.record({
+                "observed_at": received_at,
+                "station": signal.station_id,
+                "coach_id": signal.coach_id,
+                "kind": "signal",
+                "density": None,
+                "trend": None,
+                "confidence": None,
+                "source": DataSource.USER_REPORT.value,
+                "signal": signal.signal.value,
+                "user_id": signal.user_id
+            })
+
+    async def run(self):
+        print("📥 Signal ingest pipeline started")
+
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                self.flush()
+            except asyncio.CancelledError:
+                self.flush()
+                print("🛑 Signal ingest pipeline stopped")
+                break
+            except Exception as e:
+                print(f"Signal ingest loop error: {e}")
+
+    # ------------------------------------------------------------------
+    # Stats
+    # ------------------------------------------------------------------
+
+    def _trim_recent(self, now: float):
+        while self._recent and now - self._recent[0][0] > self.rate_window:
+            self._recent.popleft()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict:
+        self._trim_recent(time.monotonic())
+        recent = sum(n for _, n in self._recent)
+
+        return {
+            "queue_depth": self.queue_depth,
+            "max_pending": self.max_pending,
+            "interval_ms": int(self.interval * 1000),
+            "received": self.received,
+            "rejected": self.rejected,
+            "applied": self.applied,
+            "coach_updates": self.coach_updates,
+            "batches": self.batches,
+            "errors": self.errors,
+            "coalescing_ratio": (
+                round(self.applied / self.coach_updates, 2)
+                if self.coach_updates else None
+            ),
+            "throughput_per_sec": round(recent / self.rate_window, 1),
+            "last_batch_size": self.last_batch_size,
+            "last_batch_ms": round(self.last_batch_ms, 3)
+        }
@@ -0,0 +1,208 @@
+"""
+Binary snapshot of the live crowd state for warm restarts.
+
+Layout (little-endian):
+    8 bytes   magic  b"MKSNAP1\\n"
+    4 bytes   header length (uint32)
+    N bytes   JSON header: saved_at, station_ids, coach_ids, user_signals,
+              and per column {name, dtype, shape, offset}
+    ...       raw column bytes, each starting on a 64-byte boundary
+
+Written to a temp file and os.replace()d into place, so readers only
+ever see a complete snapshot. Columns are read with np.frombuffer
+straight out of the file bytes (no per-value decoding).
+"""
+
+import asyncio
+import json
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.models import CrowdSignalType
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_SNAPSHOT_PATH = BASE_DIR / "data" / "crowd_state.snap"
+
+MAGIC = b"MKSNAP1\n"
+ALIGN = 64
+
+
+def _pad(offset: int) -> int:
+    return -offset % ALIGN
+
+
+def capture(store, user_signals) -> Dict:
+    """Point-in-time copy of the state (cheap; call from the event loop)."""
+    station_ids, columns = store.export_columns()
+    return {
+        "saved_at": time.time(),
+        "station_ids": station_ids,
+        "coach_ids": list(store.coach_ids),
+        "columns": columns,
+        "user_signals": {
+            key: [s.value if hasattr(s, "value") else s for s in signals]
+            for key, signals in list(user_signals.items())
+            if signals
+        }
+    }
+
+
+def write_snapshot(path: Path, snapshot: Dict) -> int:
+    """Write a captured snapshot to `path` atomically. Returns bytes written."""
+    columns = snapshot["columns"]
+
+    layout = []
+    offset = 0
+    for name, values in columns.items():
+        offset += _pad(offset)
+        layout.append({
+            "name": name,
+            "dtype": values.dtype.str,
+            "shape": list(values.shape),
+            "offset": offset
+        })
+        offset += values.nbytes
+
+    header = json.dumps({**snapshot, "columns": layout}).encode()
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(b"\0" * _pad(f.tell()))
+        body_start = f.tell()
+
+        for column in layout:
+            f.write(b"\0" * (body_start + column["offset"] - f.tell()))
+            f.write(columns[column["name"]].tobytes())
+
+        size = f.tell()
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+    return size
+
+
+def read_snapshot(path: Path) -> Optional[Dict]:
+    """Parse a snapshot file; None if missing or not a snapshot."""
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    data = path.read_bytes()
+    if data[:len(MAGIC)] != MAGIC:
+        return None
+
+    (header_len,) = struct.unpack_from("<I", data, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(data[header_start:header_start + header_len])
+
+    body_start = header_start + header_len
+    body_start += _pad(body_start)
+
+    columns = {}
+    for column in header["columns"]:
+        dtype = np.dtype(column["dtype"])
+        count = int(np.prod(column["shape"]))
+        columns[column["name"]] = np.frombuffer(
+            data, dtype=dtype, count=count, offset=body_start + column["offset"]
+        ).reshape(column["shape"])
+
+    header["columns"] = columns
+    return header
+
+
+class StateSnapshotter:
+    """Periodically snapshots crowd_state + user_signals; restores at startup."""
+
+    def __init__(
+        self,
+        store,
+        user_signals,
+        path: Path = DEFAULT_SNAPSHOT_PATH,
+        interval: float = 30.0,
+        max_age: float = 6 * 3600
+    ):
+        self.store = store
+        self.user_signals = user_signals
+        self.path = Path(path)
+        self.interval = interval
+        self.max_age = max_age
+
+        self.saves = 0
+        self.last_save_ms = 0.0
+        self.last_size = 0
+
+    def restore(self) -> int:
+        """Load the snapshot into the store. Returns the number of stations."""
+        start = time.perf_counter()
+
+        try:
+            snapshot = read_snapshot(self.path)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable crowd snapshot {self.path}: {e}")
+            return 0
+
+        if snapshot is None:
+            return 0
+
+        age = time.time() - snapshot["saved_at"]
+        if age > self.max_age:
+            print(f"⏭️ Crowd snapshot is {age / 3600:.1f}h old, not restoring")
+            return 0
+        if snapshot["coach_ids"] != list(self.store.coach_ids):
+            print("⏭️ Crowd snapshot coach layout differs, not restoring")
+            return 0
+
+        self.store.load_columns(snapshot["station_ids"], snapshot["columns"])
+
+        self.user_signals.clear()
+        for key, signals in snapshot["user_signals"].items():
+            self.user_signals[key].extend(CrowdSignalType(s) for s in signals)
+
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"♻️ Restored crowd state for {len(snapshot['station_ids'])} stations "
+            f"({age:.0f}s old) in {elapsed:.1f} ms"
+        )
+        return len(snapshot["station_ids"])
+
+    async def save(self) -> int:
+        start = time.perf_counter()
+        snapshot = capture(self.store, self.user_signals)
+        self.last_size = await asyncio.to_thread(write_snapshot, self.path, snapshot)
+        self.last_save_ms = (time.perf_counter() - start) * 1000
+        self.saves += 1
+        return self.last_size
+
+    def stats(self) -> Dict:
+        return {
+            "interval_seconds": self.interval,
+            "saves": self.saves,
+            "last_size_bytes": self.last_size,
+            "last_save_ms": round(self.last_save_ms, 3)
+        }
+
+    async def run(self):
+        print("💾 Crowd snapshot task started")
+
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                # routine saves stay quiet; see stats()
+                await self.save()
+            except asyncio.CancelledError:
+                print("🛑 Crowd snapshot task stopped")
+                break
+            except Exception as e:
+                print(f"Crowd snapshot error: {e}")
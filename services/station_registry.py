@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable
+
+from app.state import mark_crowd_dirty
+
+
+class StationRegistry:
+    """
+    Decides which station keys may own a crowd_state row.
+
+    Registered stations (the reference `stations` table) always may.
+    Anything else is ad-hoc: reads never create it, writes (signals,
+    images) admit it into a bounded LRU, and past max_ad_hoc the least
+    recently written ad-hoc station is removed from crowd_state together
+    with its signal windows.
+    """
+
+    def __init__(
+        self,
+        store,
+        signals,
+        is_registered: Callable[[str], bool],
+        max_ad_hoc: int = 256
+    ):
+        self.store = store
+        self.signals = signals
+        self.is_registered = is_registered
+        self.max_ad_hoc = max_ad_hoc
+
+        self._ad_hoc: "OrderedDict[str, None]" = OrderedDict()
+
+        self.admitted_ad_hoc = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def admit(self, station_id: str, ad_hoc: bool = False) -> bool:
+        """
+        May `station_id` have a crowd_state row? Rows that already exist
+        are allowed; ad-hoc keys only when `ad_hoc` is set (write paths).
+        """
+        if station_id in self._ad_hoc:
+            self._ad_hoc.move_to_end(station_id)
+            return True
+
+        if station_id in self.store or self.is_registered(station_id):
+            return True
+
+        if not ad_hoc or self.max_ad_hoc <= 0:
+            self.rejected += 1
+            return False
+
+        self._ad_hoc[station_id] = None
+        self.admitted_ad_hoc += 1
+        self._evict_over_limit()
+        return True
+
+    def adopt(self, station_ids: Iterable[str]):
+        """Track unregistered rows that already exist (e.g. restored from a snapshot)."""
+        for station_id in station_ids:
+            if not self.is_registered(station_id):
+                self._ad_hoc[station_id] = None
+        self._evict_over_limit()
+
+    def _evict_over_limit(self):
+        while len(self._ad_hoc) > self.max_ad_hoc:
+            station_id, _ = self._ad_hoc.popitem(last=False)
+            self.store.remove_station(station_id)
+            self.signals.discard_station(station_id)
+            mark_crowd_dirty(station_id)
+            self.evicted += 1
+
+    def stats(self) -> Dict:
+        return {
+            "ad_hoc_stations": len(self._ad_hoc),
+            "max_ad_hoc": self.max_ad_hoc,
+            "admitted_ad_hoc": self.admitted_ad_hoc,
+            "rejected": self.rejected,
+            "evicted": self.evicted
+        }
@@ -0,0 +1,135 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+RESOLVE_MEMO_SIZE = 4096
+MIN_PREFIX = 3             # shorter prefixes are too ambiguous ("v", "ku")
+MIN_SIMILARITY = 0.4       # trigram Jaccard needed for a fuzzy match
+
+
+def normalize(name: str) -> str:
+    """Case-folded, letters and digits only: 'C.S.T. ' → 'cst'."""
+    return "".join(ch for ch in name.casefold() if ch.isalnum())
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StationResolver:
+    """
+    Maps station names, aliases and legacy codes ("CST", "csmt",
+    "Chhatrapati Shivaji Maharaj Terminus") to one canonical station key.
+
+    Tried in order, cheapest first:
+        exact      dict hit on names and aliases
+        folded     dict hit on normalize(name)
+        prefix     bisect over sorted normalized keys, if unambiguous
+        fuzzy      trigram Jaccard similarity (typos)
+    Results, including misses, are memoized (bounded), so repeated
+    lookups are a single dict hit.
+    """
+
+    def __init__(self, stations: Iterable[str], aliases: Dict[str, str]):
+        stations = list(stations)
+        known = set(stations)
+
+        self._exact: Dict[str, str] = {s: s for s in stations}
+        for alias, code in aliases.items():
+            if code in known:
+                self._exact.setdefault(alias, code)
+
+        # canonical names win normalized collisions over aliases
+        self._folded: Dict[str, str] = {}
+        for name in stations + [a for a in self._exact if a not in known]:
+            key = normalize(name)
+            if key:
+                self._folded.setdefault(key, self._exact[name])
+
+        self._keys: List[str] = sorted(self._folded)
+        self._trigrams: Dict[str, List[str]] = {}
+        self._gram_counts: Dict[str, int] = {}
+        for key in self._keys:
+            grams = trigrams(key)
+            self._gram_counts[key] = len(grams)
+            for gram in grams:
+                self._trigrams.setdefault(gram, []).append(key)
+
+        self._memo: Dict[str, Optional[str]] = {}
+        self.counts = {"exact": 0, "folded": 0, "prefix": 0, "fuzzy": 0, "miss": 0}
+
+    def resolve(self, name: Optional[str]) -> Optional[str]:
+        """Canonical station for `name`, or None if nothing matches."""
+        if not name:
+            return None
+
+        canonical = self._exact.get(name)
+        if canonical is not None:
+            self.counts["exact"] += 1
+            return canonical
+
+        if name in self._memo:
+            return self._memo[name]
+
+        method, canonical = self._lookup(name)
+        self.counts[method] += 1
+
+        if len(self._memo) >= RESOLVE_MEMO_SIZE:
+            self._memo = {}
+        self._memo[name] = canonical
+        return canonical
+
+    def _lookup(self, name: str) -> Tuple[str, Optional[str]]:
+        key = normalize(name)
+        if not key:
+            return "miss", None
+
+        canonical = self._folded.get(key)
+        if canonical is not None:
+            return "folded", canonical
+
+        if len(key) >= MIN_PREFIX:
+            canonical = self._by_prefix(key)
+            if canonical is not None:
+                return "prefix", canonical
+
+            canonical = self._by_trigrams(key)
+            if canonical is not None:
+                return "fuzzy", canonical
+
+        return "miss", None
+
+    def _by_prefix(self, key: str) -> Optional[str]:
+        found = None
+        i = bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i].startswith(key):
+            canonical = self._folded[self._keys[i]]
+            if found is not None and canonical != found:
+                return None  # ambiguous
+            found = canonical
+            i += 1
+        return found
+
+    def _by_trigrams(self, key: str) -> Optional[str]:
+        grams = trigrams(key)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        best, best_score = None, MIN_SIMILARITY
+        for candidate, common in shared.items():
+            # Jaccard: |A ∩ B| / (|A| + |B| - |A ∩ B|)
+            score = common / (len(grams) + self._gram_counts[candidate] - common)
+            if score > best_score or (score == best_score and best is None):
+                best, best_score = candidate, score
+
+        return self._folded[best] if best is not None else None
+
+    def stats(self) -> Dict:
+        return {
+            "names": len(self._exact),
+            "normalized_keys": len(self._keys),
+            "memoized": len(self._memo),
+            **self.counts
+        }
@@ -0,0 +1,225 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.db_models import TrainSchedule
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+
+def parse_minutes(token: str) -> Optional[int]:
+    """
+    Convert 'HH:MM' into minutes since midnight.
+    Returns None for anything that is not a valid clock time.
+    """
+    parts = token.split(":")
+    if len(parts) != 2:
+        return None
+
+    try:
+        hour, minute = int(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return hour * 60 + minute
+
+
+def parse_arrival_minutes(time_raw: Optional[str]) -> Optional[int]:
+    """
+    Extract arrival minute-of-day from raw string like:
+    '08:14 08:20' → 494
+    """
+    if not time_raw:
+        return None
+
+    tokens = time_raw.split()
+    if not tokens:
+        return None
+    return parse_minutes(tokens[0])
+
+
+def parse_time_raw_minutes(
+    time_raw: Optional[str]
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Split raw string into (arrival_min, departure_min):
+    '08:14 08:20' → (494, 500), '08:14' → (494, 494)
+    """
+    arrival = parse_arrival_minutes(time_raw)
+    if arrival is None:
+        return None, None
+
+    tokens = time_raw.split()
+    departure = parse_minutes(tokens[1]) if len(tokens) > 1 else None
+    return arrival, departure if departure is not None else arrival
+
+
+class TimetableIndex:
+    """
+    Pre-parsed, in-memory timetable built once at startup.
+
+    Per station we keep two parallel lists sorted by arrival:
+        arrivals:  [minute_of_day, ...]
+        train_nos: [train_no, ...]
+    Duplicate (train_no, arrival) pairs are dropped at build time, so a
+    window query is just two bisects and a slice.
+
+    Arrival histograms (per 15-minute slot, stations × 96) are built in
+    the same pass, so peak-hour analytics never touch train_schedule.
+    Per train, the stops are kept in arrival order to locate a train's
+    current or next station.
+    """
+
+    def __init__(self):
+        self._stations: Dict[str, Tuple[List[int], List[str]]] = {}
+        self._trains: Dict[str, Tuple[List[int], List[str]]] = {}
+        self._histogram_rows: Dict[str, int] = {}
+        self._histograms = np.zeros((0, SLOTS_PER_DAY), dtype=np.int32)
+        self.total_entries = 0
+        self.loaded_at: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # Build
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def build(cls, db: Session) -> "TimetableIndex":
+        rows = db.query(
+            TrainSchedule.station,
+            TrainSchedule.train_no,
+            TrainSchedule.arrival_min,
+            TrainSchedule.time_raw
+        ).all()
+
+        # arrival_min is backfilled; only parse rows that predate it
+        index = cls()
+        index.load_rows(
+            (
+                station,
+                train_no,
+                arrival if arrival is not None else parse_arrival_minutes(time_raw)
+            )
+            for station, train_no, arrival, time_raw in rows
+        )
+        return index
+
+    def load_rows(self, rows: Iterable[Tuple[str, str, Optional[int]]]):
+        """Load (station, train_no, arrival_min) tuples, replacing any previous data."""
+        grouped: Dict[str, set] = {}
+
+        for station, train_no, arrival in rows:
+            if arrival is None or not station or not train_no:
+                continue
+            grouped.setdefault(station, set()).add((arrival, train_no))
+
+        stations = {}
+        stops: Dict[str, List[Tuple[int, str]]] = {}
+        total = 0
+        for station, entries in grouped.items():
+            ordered = sorted(entries)
+            stations[station] = (
+                [arrival for arrival, _ in ordered],
+                [train_no for _, train_no in ordered]
+            )
+            total += len(ordered)
+            for arrival, train_no in ordered:
+                stops.setdefault(train_no, []).append((arrival, station))
+
+        trains = {}
+        for train_no, entries in stops.items():
+            entries.sort()
+            trains[train_no] = (
+                [arrival for arrival, _ in entries],
+                [station for _, station in entries]
+            )
+
+        self._stations = stations
+        self._trains = trains
+        self._build_histograms()
+        self.total_entries = total
+        self.loaded_at = datetime.utcnow().isoformat()
+
+    def _build_histograms(self):
+        names = list(self._stations)
+        rows = np.repeat(
+            np.arange(len(names)),
+            [len(self._stations[n][0]) for n in names]
+        )
+        arrivals = np.fromiter(
+            (a for n in names for a in self._stations[n][0]),
+            dtype=np.int64,
+            count=len(rows)
+        )
+
+        counts = np.bincount(
+            rows * SLOTS_PER_DAY + arrivals // SLOT_MINUTES,
+            minlength=len(names) * SLOTS_PER_DAY
+        )
+        self._histogram_rows = {n: i for i, n in enumerate(names)}
+        self._histograms = counts.reshape(len(names), SLOTS_PER_DAY).astype(np.int32)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+
+    def has_station(self, station: str) -> bool:
+        return station in self._stations
+
+    def window(
+        self,
+        station: str,
+        start_min: int,
+        end_min: int
+    ) -> List[Tuple[int, str]]:
+        """
+        Return (arrival_min, train_no) pairs with start_min <= arrival <= end_min,
+        ordered by arrival.
+        """
+        entry = self._stations.get(station)
+        if not entry:
+            return []
+
+        arrivals, train_nos = entry
+        lo = bisect_left(arrivals, start_min)
+        hi = bisect_right(arrivals, end_min)
+
+        return list(zip(arrivals[lo:hi], train_nos[lo:hi]))
+
+    def train_position(self, train_no: str, minute: int) -> Optional[Tuple[str, int]]:
+        """
+        (station, arrival_min) of the train's next stop at `minute` (the
+        current one if it arrives this minute); its last stop once the
+        run is over. None for trains not in the timetable.
+        """
+        entry = self._trains.get(train_no)
+        if not entry:
+            return None
+
+        arrivals, stations = entry
+        i = min(bisect_left(arrivals, minute), len(arrivals) - 1)
+        return stations[i], arrivals[i]
+
+    def arrival_histogram(self, stations: Optional[Iterable[str]] = None) -> Optional[np.ndarray]:
+        """
+        Arrivals per 15-minute slot (96 counts) summed over `stations`
+        (every station when None). None if none of them are indexed.
+        """
+        if stations is None:
+            return self._histograms.sum(axis=0)
+
+        rows = [
+            self._histogram_rows[s] for s in stations
+            if s in self._histogram_rows
+        ]
+        if not rows:
+            return None
+        return self._histograms[rows].sum(axis=0)
+
+    def stations(self) -> List[str]:
+        return list(self._stations)
@@ -1,70 +1,391 @@
-# import csv
-# from pathlib import Path
+"""
+Bulk timetable import from the harbour_line CSVs.
 
-# BASE_DIR = Path(__file__).resolve().parent.parent
-# DATA_DIR = BASE_DIR / "data" / "harbour_line"
+Streams station_master.csv, station_alias_map.csv, train_master.csv and
+train_schedule.csv with csv.DictReader, validates each row, resolves
+station names through the alias map, pre-parses arrival/departure
+minutes and COPYs the result into staging tables in chunks. The staging
+tables then replace the live ones in one transaction (drop, rename,
+re-create keys, indexes and the id sequence), so a rerun is idempotent
+and readers see either the old timetable or the new one, never a mix.
 
+train_schedule ids are assigned by the import (row number).
 
-# print("DATA_DIR =", DATA_DIR)
-# print("Exists:", DATA_DIR.exists())
-# print("Files:", list(DATA_DIR.glob("*")))
+Run manually with:
+    python -m services.timetable_loader [--data-dir DIR] [--dry-run]
+"""
 
-# def open_csv(path):
-#     return csv.DictReader(
-#         open(path, "r", encoding="utf-8-sig", newline=""),
-#         delimiter=","
-#     )
+import argparse
+import csv
+import io
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
 
+from app.db_models import Station, StationAlias, Train, TrainSchedule
+from services.timetable_index import parse_time_raw_minutes
 
-# def load_station_master():
-#     stations = {}
-#     reader = open_csv(DATA_DIR / "station_master.csv")
+BASE_DIR = Path(__file__).resolve().parent.parent
+DATA_DIR = BASE_DIR / "data" / "harbour_line"
 
-#     if "station" not in reader.fieldnames:
-#         raise ValueError(f"'station' column not found: {reader.fieldnames}")
+COPY_CHUNK_ROWS = 50_000
 
-#     for row in reader:
-#         stations[row["station"].strip()] = row
+TRAIN_KEYS = ("train_no", "train_id", "train_number")
+TRAIN_NAME_KEYS = ("train_name", "name")
+STATION_KEYS = ("station", "station_name", "station_code")
+TIME_KEYS = ("time_raw", "time", "timing")
 
-#     return stations
+# table → columns written by COPY, in order
+COPY_COLUMNS = {
+    Station.__table__: ("station",),
+    StationAlias.__table__: ("alias", "station_code"),
+    Train.__table__: ("train_no", "train_name"),
+    TrainSchedule.__table__: (
+        "id", "train_no", "station", "time_raw", "arrival_min", "departure_min"
+    ),
+}
 
 
-# def load_station_aliases():
-#     aliases = {}
-#     reader = open_csv(DATA_DIR / "station_alias_map.csv")
+def open_csv(path: Path) -> Tuple[csv.DictReader, io.TextIOWrapper]:
+    f = open(path, "r", encoding="utf-8-sig", newline="")
+    return csv.DictReader(f, delimiter=","), f
 
-#     if "raw" not in reader.fieldnames or "canonical" not in reader.fieldnames:
-#         raise ValueError(f"Expected ['raw','canonical'], found {reader.fieldnames}")
 
-#     for row in reader:
-#         aliases[row["raw"].strip()] = row["canonical"].strip()
+def pick_column(fieldnames: Optional[Sequence[str]], options: Sequence[str]) -> Optional[str]:
+    return next((k for k in options if k in (fieldnames or ())), None)
 
-#     return aliases
 
-    
+def clean(value: Optional[str]) -> str:
+    """Strip and collapse internal whitespace."""
+    return " ".join((value or "").split())
 
-# def load_train_master():
-#     trains = {}
-#     reader = open_csv(DATA_DIR / "train_master.csv")
 
-#     possible_keys = ["train_id", "train_no", "train_number"]
-#     train_key = next((k for k in possible_keys if k in reader.fieldnames), None)
+class ImportReport:
+    """Per-table row counts and timings for one import run."""
 
-#     if not train_key:
-#         raise ValueError(f"No train id column found: {reader.fieldnames}")
+    def __init__(self):
+        self.tables: Dict[str, Dict] = {}
+        self.rejected: Dict[str, int] = {}
+        self.samples: List[str] = []
+        self.unparsed_times = 0
+        self.started = time.perf_counter()
 
-#     for row in reader:
-#         trains[row[train_key]] = row
+    def loaded(self, table: str, rows: int, seconds: float):
+        self.tables[table] = {
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rows / seconds) if seconds else None
+        }
 
-#     return trains
+    def reject(self, reason: str, detail: str):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if len(self.samples) < 10:
+            self.samples.append(f"{reason}: {detail}")
 
+    @property
+    def total_rows(self) -> int:
+        return sum(t["rows"] for t in self.tables.values())
 
-# def load_train_schedule():
-#     schedule = []
-#     reader = open_csv(DATA_DIR / "train_schedule.csv")
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
 
-#     for row in reader:
-#         schedule.append(row)
 
-#     return schedule
+class StationNames:
+    """
+    Canonical station lookup for the import: exact name, alias, then the
+    case-folded form of either. Aliases must point at a known station.
+    """
+
+    def __init__(self, stations: Iterable[str]):
+        self.stations = set(stations)
+        self.aliases: Dict[str, str] = {}
+        self._folded: Dict[str, str] = {s.casefold(): s for s in self.stations}
+
+    def add_alias(self, alias: str, canonical: str) -> bool:
+        canonical = self.resolve(canonical)
+        if canonical is None:
+            return False
+
+        self.aliases[alias] = canonical
+        self._folded.setdefault(alias.casefold(), canonical)
+        return True
+
+    def resolve(self, name: str) -> Optional[str]:
+        if name in self.stations:
+            return name
+        return self.aliases.get(name) or self._folded.get(name.casefold())
+
+
+# =============================================================================
+# CSV READERS (streaming, validated)
+# =============================================================================
+
+def read_stations(data_dir: Path, report: ImportReport) -> List[str]:
+    reader, f = open_csv(data_dir / "station_master.csv")
+    with f:
+        key = pick_column(reader.fieldnames, STATION_KEYS)
+        if not key:
+            raise ValueError(f"No station column in station_master.csv: {reader.fieldnames}")
+
+        stations = {}
+        for row in reader:
+            name = clean(row[key])
+            if not name:
+                report.reject("station_blank", str(row))
+                continue
+            stations.setdefault(name, None)
+
+    return list(stations)
+
+
+def read_aliases(data_dir: Path, names: StationNames, report: ImportReport) -> List[Tuple[str, str]]:
+    path = data_dir / "station_alias_map.csv"
+    if not path.exists():
+        return []
+
+    reader, f = open_csv(path)
+    with f:
+        if "raw" not in (reader.fieldnames or ()) or "canonical" not in reader.fieldnames:
+            raise ValueError(f"Expected ['raw','canonical'], found {reader.fieldnames}")
+
+        for row in reader:
+            alias, canonical = clean(row["raw"]), clean(row["canonical"])
+            if not alias or alias in names.stations:
+                continue
+            if not names.add_alias(alias, canonical):
+                report.reject("alias_unknown_station", f"{alias} → {canonical}")
+
+    return sorted(names.aliases.items())
+
+
+def read_trains(data_dir: Path, report: ImportReport) -> List[Tuple[str, Optional[str]]]:
+    reader, f = open_csv(data_dir / "train_master.csv")
+    with f:
+        key = pick_column(reader.fieldnames, TRAIN_KEYS)
+        if not key:
+            raise ValueError(f"No train id column found: {reader.fieldnames}")
+        name_key = pick_column(reader.fieldnames, TRAIN_NAME_KEYS)
+
+        trains: Dict[str, Optional[str]] = {}
+        for row in reader:
+            train_no = clean(row[key])
+            if not train_no:
+                report.reject("train_blank", str(row))
+                continue
+            if train_no in trains:
+                report.reject("train_duplicate", train_no)
+                continue
+            trains[train_no] = (clean(row[name_key]) or None) if name_key else None
+
+    return list(trains.items())
+
+
+def read_schedule(data_dir: Path, names: StationNames, report: ImportReport) -> Iterator[Tuple]:
+    """Yield COPY-ready (id, train_no, station, time_raw, arrival_min, departure_min)."""
+    reader, f = open_csv(data_dir / "train_schedule.csv")
+    with f:
+        train_key = pick_column(reader.fieldnames, TRAIN_KEYS)
+        station_key = pick_column(reader.fieldnames, STATION_KEYS)
+        time_key = pick_column(reader.fieldnames, TIME_KEYS)
+        split_times = (
+            time_key is None
+            and "arrival" in (reader.fieldnames or ())
+            and "departure" in reader.fieldnames
+        )
+        if not train_key or not station_key or not (time_key or split_times):
+            raise ValueError(f"Unrecognised train_schedule.csv columns: {reader.fieldnames}")
+
+        row_id = 0
+        for row in reader:
+            train_no = clean(row[train_key])
+            raw_station = clean(row[station_key])
+            if not train_no or not raw_station:
+                report.reject("schedule_blank", str(row))
+                continue
+
+            station = names.resolve(raw_station)
+            if station is None:
+                report.reject("schedule_unknown_station", raw_station)
+                continue
+
+            time_raw = (
+                clean(f"{row['arrival'] or ''} {row['departure'] or ''}")
+                if split_times else clean(row[time_key])
+            )
+            arrival, departure = parse_time_raw_minutes(time_raw)
+            if arrival is None:
+                report.unparsed_times += 1
+
+            row_id += 1
+            yield row_id, train_no, station, time_raw or None, arrival, departure
+
+
+# =============================================================================
+# COPY + SWAP
+# =============================================================================
+
+def _chunks(rows: Iterable[Tuple], size: int) -> Iterator[List[Tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def copy_rows(cursor, table: str, columns: Sequence[str], rows: Iterable[Tuple], chunk_rows: int) -> int:
+    """COPY rows into `table` in chunks of chunk_rows. Returns rows copied."""
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    copied = 0
+
+    for chunk in _chunks(rows, chunk_rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)  # None → unquoted empty → NULL
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        copied += len(chunk)
+
+    return copied
+
+
+def swap_in(cursor, engine: Engine, tables: Sequence):
+    """
+    Replace each live table with its staging copy (caller commits).
+
+    Staging tables are plain LIKE copies, so keys, indexes and the serial
+    default are re-created here. The old serial sequence is owned by the
+    dropped table and goes with it; a new one is attached and moved past
+    the imported ids so ORM inserts keep working.
+    """
+    for table in tables:
+        name = table.name
+        cursor.execute(f"DROP TABLE {name}")
+        cursor.execute(f"ALTER TABLE {name}_staging RENAME TO {name}")
+
+        pk = ", ".join(c.name for c in table.primary_key.columns)
+        cursor.execute(f"ALTER TABLE {name} ADD PRIMARY KEY ({pk})")
+        for index in table.indexes:
+            cursor.execute(str(CreateIndex(index).compile(dialect=engine.dialect)))
+
+        serial = table.autoincrement_column
+        if serial is not None:
+            column = serial.name
+            sequence = f"{name}_{column}_seq"
+            cursor.execute(f"CREATE SEQUENCE {sequence} OWNED BY {name}.{column}")
+            cursor.execute(
+                f"ALTER TABLE {name} ALTER COLUMN {column} "
+                f"SET DEFAULT nextval('{sequence}')"
+            )
+            cursor.execute(
+                f"SELECT setval('{sequence}', COALESCE(MAX({column}), 0) + 1, false) "
+                f"FROM {name}"
+            )
+
+
+def import_timetable(
+    engine: Engine,
+    data_dir: Path = DATA_DIR,
+    chunk_rows: int = COPY_CHUNK_ROWS,
+    dry_run: bool = False
+) -> ImportReport:
+    """
+    Validate the CSVs in data_dir and load them into stations,
+    station_aliases, trains and train_schedule. With dry_run, rows are
+    read and validated but nothing is written.
+    """
+    report = ImportReport()
+
+    stations = read_stations(data_dir, report)
+    names = StationNames(stations)
+    aliases = read_aliases(data_dir, names, report)
+    trains = read_trains(data_dir, report)
+
+    sources = {
+        Station.__table__: ((s,) for s in stations),
+        StationAlias.__table__: aliases,
+        Train.__table__: trains,
+        TrainSchedule.__table__: read_schedule(data_dir, names, report),
+    }
+
+    if dry_run:
+        for table, rows in sources.items():
+            start = time.perf_counter()
+            report.loaded(table.name, sum(1 for _ in rows), time.perf_counter() - start)
+        return report
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+
+        for table, rows in sources.items():
+            start = time.perf_counter()
+            cursor.execute(f"DROP TABLE IF EXISTS {table.name}_staging")
+            cursor.execute(f"CREATE TABLE {table.name}_staging (LIKE {table.name})")
+            copied = copy_rows(
+                cursor, f"{table.name}_staging", COPY_COLUMNS[table], rows, chunk_rows
+            )
+            report.loaded(table.name, copied, time.perf_counter() - start)
+        conn.commit()
+
+        # one transaction: readers block briefly on the lock, then see
+        # the complete new timetable
+        start = time.perf_counter()
+        swap_in(cursor, engine, list(sources))
+        conn.commit()
+        swap_seconds = time.perf_counter() - start
+
+        for table in sources:
+            cursor.execute(f"ANALYZE {table.name}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    print(f"🔁 Swapped staging tables in {swap_seconds * 1000:.0f} ms")
+    return report
+
+
+if __name__ == "__main__":
+    from app.database import engine, Base
+    from app import db_models  # noqa: F401 (registers models)
+    from services.schedule_migration import upgrade_train_schedule
+
+    parser = argparse.ArgumentParser(description="Import the timetable CSVs into PostgreSQL")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--chunk-rows", type=int, default=COPY_CHUNK_ROWS)
+    parser.add_argument("--dry-run", action="store_true", help="validate only")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_train_schedule(engine)
+
+    report = import_timetable(engine, args.data_dir, args.chunk_rows, args.dry_run)
+
+    for table, stats in report.tables.items():
+        rate = stats["rows_per_second"]
+        print(
+            f"  {table:<16} {stats['rows']:>9} rows  {stats['seconds']:>7.2f}s"
+            + (f"  ({rate:,} rows/s)" if rate else "")
+        )
+    for reason, count in report.rejected.items():
+        print(f"  ⚠️ rejected {count} rows: {reason}")
+    for sample in report.samples:
+        print(f"     {sample}")
+    if report.unparsed_times:
+        print(f"  ⚠️ {report.unparsed_times} schedule rows have unparseable times (kept, minutes NULL)")
+
+    verb = "Validated" if args.dry_run else "Imported"
+    print(
+        f"✅ {verb} {report.total_rows} rows in {report.elapsed:.1f}s "
+        f"({report.total_rows / report.elapsed:,.0f} rows/s)"
+    )
+    if not args.dry_run:
+        print("ℹ️ POST /api/v1/admin/reference/reload (or restart the API) to serve it")
@@ -0,0 +1,105 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db_models import Train
+
+
+class TrainCache:
+    """
+    Process-wide train metadata cache over the `trains` table.
+
+    Loaded in bulk, refreshed when older than `refresh_interval` seconds
+    (or on demand via refresh()). Train numbers not yet cached are resolved
+    together in a single IN (...) query; numbers the table does not know
+    are remembered until the next refresh so they don't cost a round-trip
+    on every request.
+    """
+
+    def __init__(self, refresh_interval: int = 3600):
+        self.refresh_interval = refresh_interval
+        self._names: Dict[str, Optional[str]] = {}
+        self._unknown: set = set()
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def refresh(self, db: Session):
+        self._load(db.execute(select(Train.train_no, Train.train_name)).all())
+
+    async def refresh_async(self, db: AsyncSession):
+        result = await db.execute(select(Train.train_no, Train.train_name))
+        self._load(result.all())
+
+    def _load(self, rows):
+        with self._lock:
+            self._names = {train_no: train_name for train_no, train_name in rows}
+            self._unknown = set()
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.refresh_interval
+        )
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def resolve(self, db: Session, train_nos: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Map train numbers to names; at most one DB round-trip."""
+        if self.is_stale():
+            self.refresh(db)
+
+        wanted = set(train_nos)
+        missing = self._missing(wanted)
+        if missing:
+            self._remember(missing, db.execute(self._lookup(missing)).all())
+
+        return {n: self._names.get(n) for n in wanted}
+
+    async def resolve_async(
+        self,
+        db: AsyncSession,
+        train_nos: Iterable[str]
+    ) -> Dict[str, Optional[str]]:
+        if self.is_stale():
+            await self.refresh_async(db)
+
+        wanted = set(train_nos)
+        missing = self._missing(wanted)
+        if missing:
+            result = await db.execute(self._lookup(missing))
+            self._remember(missing, result.all())
+
+        return {n: self._names.get(n) for n in wanted}
+
+    def _missing(self, wanted: set) -> List[str]:
+        return [
+            n for n in wanted
+            if n not in self._names and n not in self._unknown
+        ]
+
+    def _lookup(self, missing: List[str]):
+        return (
+            select(Train.train_no, Train.train_name)
+            .where(Train.train_no.in_(missing))
+        )
+
+    def _remember(self, missing: List[str], rows):
+        found = {train_no: train_name for train_no, train_name in rows}
+
+        with self._lock:
+            self._names.update(found)
+            self._unknown.update(n for n in missing if n not in found)
+
+    def __len__(self) -> int:
+        return len(self._names)
@@ -332,22 +332,28 @@
 #             "total_trains_analyzed": sum(hourly.values())
 #         }
 
-from datetime import datetime, time, timedelta
-from typing import Dict, Optional
+from datetime import datetime, time
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.db_models import TrainSchedule, Train
-from services.crowd_service import CrowdService
-
-# from app.state import state   # 👈 IMPORTANT (for crowd_service)
+from app import state
+from app.db_models import TrainSchedule
+from services.train_cache import TrainCache
 
 
 class TrainService:
-    """PostgreSQL-backed train schedule service"""
+    """
+    PostgreSQL-backed train schedule service.
+
+    Long-lived singleton (state.train_service): the DB session is passed
+    per call, crowd data comes from the shared state.crowd_service (which
+    caches train crowd until the underlying coaches change).
+    """
 
-    def __init__(self, db: Session):
-        self.db = db
-        self.crowd_service = CrowdService()
+    def __init__(self):
+        self._peak_hours_source: Optional[Tuple[int, Optional[str]]] = None
 
     # ---------------------------------------------------------------------
     # Helpers
@@ -387,85 +393,163 @@ class TrainService:
 
         return f"In {diff_minutes // 60}h {diff_minutes % 60}m"
 
+    def _window(
+        self,
+        db: Session,
+        station: str,
+        start_min: int,
+        end_min: int
+    ) -> List[Tuple[int, str]]:
+        """
+        (arrival_min, train_no) pairs in the window, ordered by arrival.
+        Served from the shared timetable index; falls back to a range scan
+        on (station, arrival_min) when the index isn't loaded.
+        """
+        if state.timetable_index is not None:
+            return state.timetable_index.window(station, start_min, end_min)
+
+        rows = (
+            db.query(TrainSchedule.arrival_min, TrainSchedule.train_no)
+            .filter(
+                TrainSchedule.station == station,
+                TrainSchedule.arrival_min.between(start_min, end_min)
+            )
+            .distinct()
+            .order_by(TrainSchedule.arrival_min, TrainSchedule.train_no)
+            .all()
+        )
+        return [(arrival, train_no) for arrival, train_no in rows]
+
+    async def _window_async(
+        self,
+        db: AsyncSession,
+        station: str,
+        start_min: int,
+        end_min: int
+    ) -> List[Tuple[int, str]]:
+        if state.timetable_index is not None:
+            return state.timetable_index.window(station, start_min, end_min)
+
+        result = await db.execute(
+            select(TrainSchedule.arrival_min, TrainSchedule.train_no)
+            .where(
+                TrainSchedule.station == station,
+                TrainSchedule.arrival_min.between(start_min, end_min)
+            )
+            .distinct()
+            .order_by(TrainSchedule.arrival_min, TrainSchedule.train_no)
+        )
+        return [(arrival, train_no) for arrival, train_no in result.all()]
+
+    def _train_cache(self) -> TrainCache:
+        """Shared train-name cache (bulk-loaded at startup)."""
+        if state.train_cache is None:
+            state.train_cache = TrainCache(state.TRAIN_CACHE_REFRESH_INTERVAL)
+        return state.train_cache
+
     # ---------------------------------------------------------------------
     # Core APIs
     # ---------------------------------------------------------------------
 
     def get_trains_at_station(
         self,
+        db: Session,
         station: str,
         time: time,
-        window_minutes: int = 30
+        window_minutes: int = 30,
+        detailed_crowd: bool = False
     ) -> Dict:
         """
         Returns trains arriving at a station within a rolling time window.
-        Attaches crowd density per train.
+        Attaches crowd density per train (level + trend, or the full
+        train crowd with coaches when detailed_crowd is set).
         """
+        start_min, end_min = self._window_bounds(time, window_minutes)
 
-        center_dt = datetime.combine(datetime.today(), time)
-        start_dt = center_dt - timedelta(minutes=window_minutes // 2)
-        end_dt = center_dt + timedelta(minutes=window_minutes // 2)
-
-        rows = (
-            self.db.query(TrainSchedule)
-            .filter(TrainSchedule.station == station)
-            .all()
+        window = self._window(db, station, start_min, end_min)
+        train_names = self._train_cache().resolve(
+            db, (train_no for _, train_no in window)
         )
 
-        results = []
-        seen = set()  # dedupe (train_no + arrival_time)
+        return self._trains_response(
+            station, time, window_minutes, window, train_names, detailed_crowd
+        )
 
-        for row in rows:
-            arrival_time = self.parse_time_raw(row.time_raw)
-            if not arrival_time:
-                continue
+    async def get_trains_at_station_async(
+        self,
+        db: AsyncSession,
+        station: str,
+        time: time,
+        window_minutes: int = 30,
+        detailed_crowd: bool = False
+    ) -> Dict:
+        """Same as get_trains_at_station, on an AsyncSession."""
+        start_min, end_min = self._window_bounds(time, window_minutes)
 
-            arrival_dt = datetime.combine(datetime.today(), arrival_time)
+        window = await self._window_async(db, station, start_min, end_min)
+        train_names = await self._train_cache().resolve_async(
+            db, (train_no for _, train_no in window)
+        )
 
-            # ✅ datetime-based window check
-            if not (start_dt <= arrival_dt <= end_dt):
-                continue
+        return self._trains_response(
+            station, time, window_minutes, window, train_names, detailed_crowd
+        )
 
-            diff_minutes = (arrival_dt - center_dt).total_seconds() / 60
+    def _window_bounds(self, time: time, window_minutes: int) -> Tuple[int, int]:
+        """
+        Minute range [center - half, center + half], ignoring trains that
+        passed more than 5 minutes ago (arrivals are whole minutes).
+        """
+        center_sec = time.hour * 3600 + time.minute * 60 + time.second
+        half_sec = (window_minutes // 2) * 60
 
-            # ✅ ignore trains that passed long ago
-            if diff_minutes < -5:
-                continue
+        start_min = -(-max(center_sec - half_sec, center_sec - 300) // 60)
+        end_min = (center_sec + half_sec) // 60
+        return start_min, end_min
 
-            dedupe_key = (row.train_no, arrival_time.strftime("%H:%M"))
-            if dedupe_key in seen:
-                continue
-            seen.add(dedupe_key)
+    def _trains_response(
+        self,
+        station: str,
+        time: time,
+        window_minutes: int,
+        window: List[Tuple[int, str]],
+        train_names: Dict[str, Optional[str]],
+        detailed_crowd: bool
+    ) -> Dict:
+        center_dt = datetime.combine(datetime.today(), time)
+        query_min = time.hour * 60 + time.minute
+        results = []
 
-            train = (
-                self.db.query(Train)
-                .filter(Train.train_no == row.train_no)
-                .first()
+        for arrival_min, train_no in window:
+            arrival_dt = center_dt.replace(
+                hour=arrival_min // 60,
+                minute=arrival_min % 60,
+                second=0,
+                microsecond=0
             )
 
             # 🚨 ATTACH CROWD DATA HERE
-            crowd = self.crowd_service.get_train_crowd(
-                train_no=row.train_no,
-                station=station
+            crowd = state.crowd_service.get_train_crowd(
+                train_no=train_no,
+                station=station,
+                minute=query_min
             )
 
             results.append({
-                "train_no": row.train_no,
-                "train_name": train.train_name if train else None,
-                "arrival_time": arrival_time.strftime("%H:%M"),
+                "train_no": train_no,
+                "train_name": train_names.get(train_no),
+                "arrival_time": f"{arrival_min // 60:02d}:{arrival_min % 60:02d}",
                 "time_to_arrival": self.calculate_time_difference_dt(
                     center_dt,
                     arrival_dt
                 ),
-                "crowd": {
+                "crowd": crowd if detailed_crowd else {
                     "level": crowd["level"].name,
                     "trend": crowd["trend"].value
                 }
             })
 
-        # sort by arrival time
-        results.sort(key=lambda x: x["arrival_time"])
-
+        # index window is already ordered by arrival time
         return {
             "station": station,
             "query_time": time.strftime("%H:%M"),
@@ -478,22 +562,26 @@ class TrainService:
     # Analytics
     # ---------------------------------------------------------------------
 
-    def analyze_peak_hours(self, station: Optional[str] = None) -> Dict:
+    def analyze_peak_hours(self, db: Session, station: Optional[str] = None) -> Dict:
         """
         Analyze peak arrival hours for a station.
+        Served from the timetable index histograms when loaded.
         """
-        query = self.db.query(TrainSchedule)
-        if station:
-            query = query.filter(TrainSchedule.station == station)
+        if state.timetable_index is not None:
+            scope = f"station:{station}" if station else "network"
+            histogram = self.peak_hours(scope, [station] if station else None)
+            return histogram or {"peak_hours": [], "total_trains_analyzed": 0}
 
-        hourly = {}
+        hour = (TrainSchedule.arrival_min // 60).label("hour")
 
-        for row in query.all():
-            arrival = self.parse_time_raw(row.time_raw)
-            if not arrival:
-                continue
+        query = (
+            db.query(hour, func.count())
+            .filter(TrainSchedule.arrival_min.isnot(None))
+        )
+        if station:
+            query = query.filter(TrainSchedule.station == station)
 
-            hourly[arrival.hour] = hourly.get(arrival.hour, 0) + 1
+        hourly = dict(query.group_by(hour).all())
 
         peaks = sorted(hourly.items(), key=lambda x: x[1], reverse=True)[:5]
 
@@ -507,3 +595,64 @@ class TrainService:
             ],
             "total_trains_analyzed": sum(hourly.values())
         }
+
+    def peak_hours(
+        self,
+        scope: str,
+        stations: Optional[List[str]] = None,
+        top: int = 5
+    ) -> Optional[Dict]:
+        """
+        Peak arrival hours and 15-minute slots over `stations` (all when
+        None), from the timetable index histograms. Responses are kept in
+        state.peak_hours_cache under `scope` until the index is reloaded.
+        None when no station is in the timetable.
+        """
+        index = state.timetable_index
+        if index is None:
+            return None
+
+        source = (id(index), index.loaded_at)
+        if self._peak_hours_source != source:
+            state.peak_hours_cache.clear()
+            self._peak_hours_source = source
+
+        cached = state.peak_hours_cache.get(scope)
+        if cached is not None:
+            return cached
+
+        quarter_hourly = index.arrival_histogram(stations)
+        if quarter_hourly is None:
+            return None
+
+        quarter_hourly = quarter_hourly.tolist()
+        hourly = [sum(quarter_hourly[h * 4:h * 4 + 4]) for h in range(24)]
+
+        def top_slots(counts: List[int], minutes: int) -> List[Tuple[int, int]]:
+            ranked = sorted(
+                (i for i, c in enumerate(counts) if c),
+                key=lambda i: counts[i],
+                reverse=True
+            )[:top]
+            return [(i * minutes, counts[i]) for i in ranked]
+
+        def label(start: int, minutes: int) -> str:
+            end = start + minutes - 1
+            return f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+
+        response = {
+            "peak_hours": [
+                {"hour": label(start, 60), "train_count": c}
+                for start, c in top_slots(hourly, 60)
+            ],
+            "peak_slots": [
+                {"slot": label(start, 15), "train_count": c}
+                for start, c in top_slots(quarter_hourly, 15)
+            ],
+            "hourly": hourly,
+            "quarter_hourly": quarter_hourly,
+            "total_trains_analyzed": sum(hourly),
+            "timetable_loaded_at": index.loaded_at
+        }
+        state.peak_hours_cache[scope] = response
+        return response
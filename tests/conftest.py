@@ -0,0 +1,24 @@
+import os
+
+# app.database needs a URL at import time; engines connect lazily and the
+# tests never use them (DB-backed tests bring their own SQLite engine)
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
+
+import pytest
+
+from app import state
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Each test starts from an empty crowd_state and no service singletons."""
+    state.crowd_state.load_columns([], {})
+    state.crowd_dirty.clear()
+    state.crowd_versions.clear()
+    state.user_signals.clear()
+    state.station_registry = None
+    state.reference_cache = None
+    state.crowd_profile = None
+    state.timetable_index = None
+    state.history_writer = None
+    yield
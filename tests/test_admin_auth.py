@@ -0,0 +1,24 @@
+import pytest
+from fastapi import HTTPException
+
+from app import main
+
+
+def test_admin_disabled_without_configured_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    with pytest.raises(HTTPException) as exc:
+        main.require_admin("anything")
+    assert exc.value.status_code == 503
+
+
+@pytest.mark.parametrize("token", [None, "", "wrong", "secret-but-longer"])
+def test_admin_rejects_bad_token(monkeypatch, token):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    with pytest.raises(HTTPException) as exc:
+        main.require_admin(token)
+    assert exc.value.status_code == 403
+
+
+def test_admin_accepts_configured_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    main.require_admin("secret")
@@ -0,0 +1,110 @@
+from app import state
+from app.crowd_store import CrowdStore, DENSITY_CODE, SOURCE_CODE, TREND_CODE
+from app.models import CrowdDensityLevel, CrowdSignalType, DataSource, TrendDirection
+from services.crowd_service import (
+    FUSION_HALF_LIFE,
+    SOURCE_WEIGHTS,
+    CrowdFusionEngine,
+    CrowdService
+)
+
+MEDIUM = DENSITY_CODE[CrowdDensityLevel.MEDIUM]
+VERY_HIGH = DENSITY_CODE[CrowdDensityLevel.VERY_HIGH]
+
+
+def make_store(now=0.0):
+    store = CrowdStore(coach_ids=["C1", "C2"])
+    store.put_station(
+        "CSMT", density=[MEDIUM, MEDIUM], trend=[0, 0], confidence=[0.8, 0.8],
+        overall=MEDIUM, ts=now, prior_weight=SOURCE_WEIGHTS[DataSource.MOCK]
+    )
+    return store
+
+
+def test_observation_outweighs_mock_prior():
+    store = make_store()
+    engine = CrowdFusionEngine(store)
+
+    density, confidence = engine.observe(
+        0, 0, CrowdDensityLevel.VERY_HIGH, DataSource.IMAGE_ANALYSIS, now=0.0
+    )
+
+    assert density == CrowdDensityLevel.VERY_HIGH
+    assert store.source[0, 0] == SOURCE_CODE[DataSource.IMAGE_ANALYSIS]
+    assert confidence > 0.8
+    assert store.density_sum[0] == VERY_HIGH + MEDIUM
+
+
+def test_relax_decays_confidence_between_observations():
+    store = make_store()
+    engine = CrowdFusionEngine(store)
+    _, confidence = engine.observe(
+        0, 0, CrowdDensityLevel.VERY_HIGH, DataSource.IMAGE_ANALYSIS, now=0.0
+    )
+
+    assert engine.relax(now=FUSION_HALF_LIFE) == [("CSMT", "C1")]
+    assert store.confidence[0, 0] < confidence
+    assert store.density[0, 0] == VERY_HIGH
+    assert store.source[0, 0] == SOURCE_CODE[DataSource.IMAGE_ANALYSIS]
+
+    # nothing moved enough since the last tick
+    assert engine.relax(now=FUSION_HALF_LIFE) == []
+
+
+def test_relax_releases_decayed_coach_to_station_baseline():
+    store = make_store()
+    engine = CrowdFusionEngine(store)
+    engine.observe(0, 0, CrowdDensityLevel.VERY_HIGH, DataSource.USER_REPORT, now=0.0)
+    assert store.density[0, 0] > MEDIUM
+
+    release = 20 * FUSION_HALF_LIFE
+    assert engine.relax(now=release) == [("CSMT", "C1")]
+
+    assert store.density[0, 0] == MEDIUM
+    assert store.source[0, 0] == SOURCE_CODE[DataSource.MOCK]
+    assert store.trend[0, 0] == TREND_CODE[TrendDirection.STABLE]
+    assert store.fused_sum[0, 0] == MEDIUM * SOURCE_WEIGHTS[DataSource.MOCK]
+    assert store.density_sum[0] == store.density[0].sum()
+
+
+def test_released_coach_stays_at_baseline_through_evolve():
+    store = make_store()
+    engine = CrowdFusionEngine(store)
+    engine.observe(0, 0, CrowdDensityLevel.VERY_HIGH, DataSource.USER_REPORT, now=0.0)
+
+    now = 20 * FUSION_HALF_LIFE
+    for tick in range(10):
+        engine.relax(now=now + tick)
+        store.evolve(now=now + tick)
+        assert store.density[0, 0] == MEDIUM
+
+    # the next observation blends with a prior that matches the coach
+    density, _ = engine.observe(
+        0, 0, CrowdDensityLevel.MEDIUM, DataSource.USER_REPORT, now=now + 10
+    )
+    assert density == CrowdDensityLevel.MEDIUM
+
+
+def test_mock_coaches_are_not_touched_by_relax():
+    store = make_store()
+    assert CrowdFusionEngine(store).relax(now=1e6) == []
+    assert store.confidence[0, 0] == store.confidence[0, 1]
+
+
+def test_trend_only_signal_keeps_mock_source():
+    service = CrowdService()
+    service.process_user_signals("CSMT", "C1", [CrowdSignalType.CROWD_INCREASING])
+
+    row, col = state.crowd_state.locate("CSMT", "C1")
+    assert state.crowd_state.source[row, col] == SOURCE_CODE[DataSource.MOCK]
+    assert state.crowd_state.trend[row, col] == TREND_CODE[TrendDirection.INCREASING]
+    assert state.crowd_state.reports[row, col] == 1
+
+
+def test_density_signal_is_fused_as_user_report():
+    service = CrowdService()
+    service.process_user_signals("CSMT", "C1", [CrowdSignalType.VERY_CROWDED])
+
+    row, col = state.crowd_state.locate("CSMT", "C1")
+    assert state.crowd_state.source[row, col] == SOURCE_CODE[DataSource.USER_REPORT]
+    assert "CSMT" in state.crowd_dirty
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from app.crowd_store import DENSITY_CODE
+from app.db_models import CrowdObservation
+from app.models import CrowdDensityLevel, CrowdSignalType, DataSource
+from services.crowd_profile import CrowdProfile
+
+
+def observation(kind, observed_at, density=None, signal=None, source=DataSource.USER_REPORT):
+    return {
+        "observed_at": observed_at,
+        "station": "CSMT",
+        "coach_id": "C1",
+        "kind": kind,
+        "density": density,
+        "trend": None,
+        "confidence": None,
+        "source": source.value,
+        "signal": signal.value if signal else None,
+        "user_id": None
+    }
+
+
+def test_build_uses_signals_and_images_not_snapshots():
+    engine = create_engine("sqlite://")
+    CrowdObservation.__table__.create(engine)
+
+    observed_at = datetime.utcnow() - timedelta(hours=1)
+    very_high = DENSITY_CODE[CrowdDensityLevel.VERY_HIGH]
+    rows = (
+        # a frozen coach re-recorded every minute must not dominate
+        [observation("snapshot", observed_at, density=0)] * 50
+        + [observation("signal", observed_at, signal=CrowdSignalType.VERY_CROWDED)] * 4
+        + [observation("signal", observed_at, signal=CrowdSignalType.CROWD_INCREASING)] * 10
+        + [observation("image", observed_at, density=very_high, source=DataSource.IMAGE_ANALYSIS)]
+        + [observation("image", observed_at, density=0, source=DataSource.MOCK)] * 10
+    )
+    with Session(engine) as db:
+        db.execute(insert(CrowdObservation), rows)
+        db.commit()
+        profile = CrowdProfile.build(db, chunk_rows=3)
+
+    mean, samples, scope = profile.expected("CSMT", datetime.now() - timedelta(hours=1))
+    assert scope == "station"
+    assert samples == 5  # 4 VERY_CROWDED signals + 1 image
+    assert mean == very_high
@@ -0,0 +1,68 @@
+import random
+
+from app.crowd_store import DENSITY_LEVELS, CrowdStore, SignalWindows
+from app.models import DataSource
+
+
+def random_station(store, station_id, rng):
+    n = len(store.coach_ids)
+    store.put_station(
+        station_id,
+        density=[rng.randrange(len(DENSITY_LEVELS)) for _ in range(n)],
+        trend=[rng.choice([-1, 0, 1]) for _ in range(n)],
+        confidence=[0.8] * n,
+        overall=2,
+        ts=0.0
+    )
+
+
+def test_density_sum_tracks_every_write():
+    rng = random.Random(7)
+    store = CrowdStore(capacity=2)
+    for i in range(6):  # forces a grow
+        random_station(store, f"S{i}", rng)
+
+    for step in range(200):
+        store.set_density(rng.randrange(len(store)), rng.randrange(12), rng.randrange(5))
+        store.update_coach(
+            f"S{rng.randrange(6)}", "C3",
+            density=rng.choice(DENSITY_LEVELS), source=DataSource.MOCK
+        )
+        store.evolve(now=float(step))
+
+    store.remove_station("S2")
+    ids, columns = store.export_columns()
+    columns.pop("density_sum")  # snapshots from before the column existed
+    store.load_columns(ids, columns)
+
+    n = len(store)
+    assert (store.density_sum[:n] == store.density[:n].sum(axis=1)).all()
+    assert store.mean_density([0]).tolist() == [store.density[0].mean()]
+
+
+def test_remove_station_moves_last_row_into_gap():
+    rng = random.Random(1)
+    store = CrowdStore()
+    for station_id in ("A", "B", "C"):
+        random_station(store, station_id, rng)
+    c_density = store.density[2].copy()
+
+    assert store.remove_station("A")
+    assert store.station_ids == ["C", "B"]
+    assert (store.density[0] == c_density).all()
+    assert not store.remove_station("A")
+
+
+def test_signal_windows_evict_least_recently_written():
+    windows = SignalWindows(window=2, max_keys=2)
+    windows["CSMT:C1"].extend(["a", "b", "c"])
+    windows["CSMT:C2"].append("a")
+    windows["CSMT:C1"].append("d")
+    windows["PNVL:C1"].append("a")
+
+    assert list(windows.get("CSMT:C1")) == ["c", "d"]
+    assert windows.get("CSMT:C2") is None
+    assert windows.evictions == 1
+
+    windows.discard_station("CSMT")
+    assert windows.get("CSMT:C1") is None
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+from services.history_writer import HistoryWriter
+
+
+class FakeSession:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, statement, rows):
+        if self.db.fail_on == self.db.calls:
+            self.db.calls += 1
+            raise ConnectionError("database went away")
+        self.db.calls += 1
+        self.db.rows.extend(rows)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, fail_on=None):
+        self.rows = []
+        self.calls = 0
+        self.fail_on = fail_on
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+def observation(i):
+    return {
+        "observed_at": datetime(2026, 1, 1, 8, i),
+        "station": "CSMT",
+        "coach_id": f"C{i}",
+        "kind": "signal",
+        "density": None,
+        "trend": None,
+        "confidence": None,
+        "source": "user_report",
+        "signal": "VERY_CROWDED",
+        "user_id": None
+    }
+
+
+def make_writer(tmp_path, db, **kwargs):
+    return HistoryWriter(db, spill_path=tmp_path / "spill.jsonl", batch_size=2, **kwargs)
+
+
+def test_failed_flush_spills_and_recovery_replays(tmp_path):
+    db = FakeDatabase(fail_on=0)
+    writer = make_writer(tmp_path, db)
+    for i in range(3):
+        writer.record(observation(i))
+
+    asyncio.run(writer.flush())
+    assert db.rows == [] and writer.spilled == 3
+
+    writer.record(observation(3))
+    asyncio.run(writer.flush())
+
+    assert sorted(r["coach_id"] for r in db.rows) == ["C0", "C1", "C2", "C3"]
+    assert writer.replayed == 3
+    assert not (tmp_path / "spill.replay").exists()
+
+
+def test_interrupted_replay_resumes_without_duplicates(tmp_path):
+    writer = make_writer(tmp_path, FakeDatabase())
+    writer._spill([observation(i) for i in range(5)])
+
+    # the second batch fails: the first one is already committed
+    writer.session_factory = db = FakeDatabase(fail_on=1)
+    try:
+        writer._replay_spill()
+    except ConnectionError:
+        pass
+    assert [r["coach_id"] for r in db.rows] == ["C0", "C1"]
+
+    db.fail_on = None
+    assert writer._replay_spill() == 3
+    assert [r["coach_id"] for r in db.rows] == ["C0", "C1", "C2", "C3", "C4"]
+    assert not (tmp_path / "spill.offset").exists()
+
+
+def test_buffer_drops_when_full(tmp_path):
+    writer = make_writer(tmp_path, FakeDatabase(), max_buffer=2)
+    assert [writer.record(observation(i)) for i in range(3)] == [True, True, False]
+    assert writer.dropped == 1
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from datetime import datetime
+
+from services.prediction_cache import PredictionCache, prediction_key
+
+
+def test_key_buckets_by_five_minutes():
+    assert prediction_key("CSMT", None, datetime(2026, 1, 1, 8, 4, 59)) == (
+        "CSMT", "", "2026-01-01T08:00"
+    )
+    assert prediction_key("CSMT", "95001", datetime(2026, 1, 1, 8, 5)) == (
+        "CSMT", "95001", "2026-01-01T08:05"
+    )
+
+
+def test_concurrent_misses_compute_once():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"density": "HIGH"}
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert results == [{"density": "HIGH"}] * 5
+    assert (cache.misses, cache.coalesced) == (1, 4)
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_sync_compute_runs_inline_on_the_loop():
+    cache = PredictionCache()
+    threads = []
+
+    def compute():
+        threads.append(threading.current_thread())
+        return 42
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)))
+
+    assert asyncio.run(run()) == [42, 42, 42]
+    assert threads == [threading.main_thread()]
+    assert (cache.misses, cache.hits) == (1, 2)
+
+
+def test_cancelled_first_caller_does_not_cancel_waiters():
+    cache = PredictionCache()
+
+    async def compute():
+        await asyncio.sleep(10)
+
+    async def run():
+        first = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        results = await asyncio.gather(first, waiter, return_exceptions=True)
+        return results
+
+    first, waiter = asyncio.run(run())
+    assert isinstance(first, asyncio.CancelledError)
+    assert isinstance(waiter, RuntimeError)
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_failure_reaches_waiters_and_is_not_cached():
+    cache = PredictionCache()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get_or_compute("k", compute) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert cache.get("k") is None
+
+
+def test_entries_expire_after_ttl():
+    cache = PredictionCache(ttl=0)
+    cache.put("k", 1)
+    assert cache.get("k") is None
+    assert cache.expirations == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
@@ -0,0 +1,107 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, state
+from app.models import CrowdSignalType, UserCrowdSignal
+from services.rate_limiter import RecentSet, SignalAdmission, SlidingWindowLimiter
+from services.signal_ingest import SignalIngestPipeline
+
+
+def signal(coach_id="C1", kind=CrowdSignalType.VERY_CROWDED, user_id="u1"):
+    return UserCrowdSignal(station_id="CSMT", coach_id=coach_id, signal=kind, user_id=user_id)
+
+
+def test_limiter_allows_up_to_limit_per_window():
+    limiter = SlidingWindowLimiter(limit=3, window=60)
+    assert [limiter.allow("a", now=t) for t in (0, 1, 2, 3)] == [True, True, True, False]
+    assert limiter.allow("b", now=3)
+
+
+def test_limiter_slides_previous_window_out():
+    limiter = SlidingWindowLimiter(limit=2, window=60)
+    assert limiter.allow("a", now=0) and limiter.allow("a", now=1)
+
+    # early in the next window the previous one still weighs almost 2
+    assert limiter.allow("a", now=61)
+    assert not limiter.allow("a", now=62)
+    # two full windows later nothing is carried over
+    assert limiter.allow("a", now=200) and limiter.allow("a", now=201)
+
+
+def test_limiter_refund_gives_back_a_hit():
+    limiter = SlidingWindowLimiter(limit=1, window=60)
+    assert limiter.allow("a", now=0)
+    limiter.refund("a")
+    assert limiter.allow("a", now=1)
+
+
+def test_limiter_evicts_idle_and_excess_keys():
+    limiter = SlidingWindowLimiter(limit=1, window=10, max_keys=2)
+    for i, key in enumerate("abc"):
+        limiter.allow(key, now=i)
+    assert len(limiter) == 2
+
+    limiter.allow("d", now=100)
+    assert len(limiter) == 1
+
+
+def test_recent_set_expires_after_ttl():
+    recent = RecentSet(ttl=30)
+    assert recent.add("k", now=0)
+    assert not recent.add("k", now=29)
+    assert recent.add("k", now=31)
+
+
+def test_admission_dedups_then_rate_limits():
+    admission = SignalAdmission(limit=2, window=60, dedup_window=30)
+
+    assert admission.check(signal("C1"), None) == "ok"
+    assert admission.check(signal("C1"), None) == "duplicate"
+    assert admission.check(signal("C2"), None) == "ok"
+    assert admission.check(signal("C3"), None) == "rate_limited"
+    # a rate-limited signal is not remembered as seen
+    assert admission.check(signal("C3"), None) == "rate_limited"
+    # senders without a user_id are keyed by IP
+    assert admission.check(signal("C3", user_id=None), "10.0.0.1") == "ok"
+
+
+def test_admission_release_allows_retry():
+    admission = SignalAdmission(limit=1, window=60, dedup_window=30)
+    assert admission.check(signal(), None) == "ok"
+
+    admission.release(signal(), None)
+
+    assert admission.check(signal(), None) == "ok"
+    assert admission.stats()["released"] == 1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(state, "signal_admission", SignalAdmission(limit=10, window=60))
+    monkeypatch.setattr(state, "signal_pipeline", SignalIngestPipeline(None, max_pending=1))
+    return TestClient(main.app)
+
+
+def payload(coach_id):
+    return {"station_id": "CSMT", "coach_id": coach_id, "signal": "VERY_CROWDED", "user_id": "u1"}
+
+
+def test_queue_full_signal_can_be_retried(client):
+    assert client.post("/api/v1/signal/crowd", json=payload("C1")).status_code == 200
+    assert client.post("/api/v1/signal/crowd", json=payload("C2")).status_code == 503
+
+    state.signal_pipeline._pending.clear()
+    response = client.post("/api/v1/signal/crowd", json=payload("C2"))
+    assert response.json()["status"] == "accepted"
+
+
+def test_batch_releases_signals_the_queue_rejected(client):
+    response = client.post(
+        "/api/v1/signal/crowd/batch",
+        json={"signals": [payload("C1"), payload("C2")]}
+    )
+    assert response.json()["rejected"] == 1
+
+    state.signal_pipeline._pending.clear()
+    response = client.post("/api/v1/signal/crowd", json=payload("C2"))
+    assert response.json()["status"] == "accepted"
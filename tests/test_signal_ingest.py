@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+from app import state
+from app.models import CrowdSignalType, UserCrowdSignal
+from services.crowd_service import CrowdService
+from services.signal_ingest import SignalIngestPipeline
+from services.station_registry import StationRegistry
+
+
+class RecordingHistory:
+    def __init__(self):
+        self.rows = []
+
+    def record(self, row):
+        self.rows.append(row)
+        return True
+
+
+def signal(station_id="CSMT", coach_id="C1", timestamp=None):
+    extra = {"timestamp": timestamp} if timestamp else {}
+    return UserCrowdSignal(
+        station_id=station_id, coach_id=coach_id,
+        signal=CrowdSignalType.VERY_CROWDED, **extra
+    )
+
+
+def make_pipeline():
+    state.history_writer = RecordingHistory()
+    state.station_registry = StationRegistry(
+        state.crowd_state, state.user_signals,
+        is_registered=lambda s: s == "CSMT", max_ad_hoc=0
+    )
+    return SignalIngestPipeline(CrowdService())
+
+
+def test_history_uses_server_receive_time_not_client_timestamp():
+    pipeline = make_pipeline()
+    backdated = datetime(2020, 1, 1, 8, 0, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+
+    before = datetime.utcnow()
+    pipeline.submit([signal(timestamp=backdated)])
+    pipeline.flush()
+
+    (row,) = state.history_writer.rows
+    assert row["observed_at"].tzinfo is None
+    assert before <= row["observed_at"] <= datetime.utcnow()
+    assert row["kind"] == "signal" and row["signal"] == "VERY_CROWDED"
+
+
+def test_only_applied_groups_are_recorded():
+    pipeline = make_pipeline()
+
+    pipeline.submit([
+        signal("CSMT", "C1"),
+        signal("NOWHERE", "C1"),   # rejected by the registry (no ad-hoc room)
+        signal("CSMT", "C99"),     # no such coach
+    ])
+    assert pipeline.flush() == 3
+
+    assert [(r["station"], r["coach_id"]) for r in state.history_writer.rows] == [("CSMT", "C1")]
+    assert state.user_signals.get("CSMT:C1") is not None
+    assert state.user_signals.get("CSMT:C99") is None
+    assert "NOWHERE" not in state.crowd_state
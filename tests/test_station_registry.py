@@ -0,0 +1,48 @@
+from app import state
+from services.station_registry import StationRegistry
+
+
+def make_registry(max_ad_hoc):
+    return StationRegistry(
+        state.crowd_state, state.user_signals,
+        is_registered=lambda s: s == "CSMT", max_ad_hoc=max_ad_hoc
+    )
+
+
+def put(station_id):
+    n = len(state.crowd_state.coach_ids)
+    state.crowd_state.put_station(station_id, [2] * n, [0] * n, [0.8] * n, overall=2)
+
+
+def test_registered_stations_always_admitted():
+    registry = make_registry(0)
+    assert registry.admit("CSMT")
+    assert registry.stats()["rejected"] == 0
+
+
+def test_reads_never_admit_unknown_stations():
+    registry = make_registry(4)
+    assert not registry.admit("NOWHERE")
+    assert registry.admit("NOWHERE", ad_hoc=True)
+
+
+def test_no_ad_hoc_room_rejects_writes():
+    registry = make_registry(0)
+    assert not registry.admit("NOWHERE", ad_hoc=True)
+    assert registry.stats()["ad_hoc_stations"] == 0
+
+
+def test_least_recently_written_ad_hoc_station_is_evicted():
+    registry = make_registry(2)
+    for station_id in ("A", "B"):
+        registry.admit(station_id, ad_hoc=True)
+        put(station_id)
+        state.user_signals[f"{station_id}:C1"].append("VERY_CROWDED")
+
+    registry.admit("A", ad_hoc=True)   # A is now the most recent
+    registry.admit("C", ad_hoc=True)
+
+    assert "B" not in state.crowd_state and "A" in state.crowd_state
+    assert state.user_signals.get("B:C1") is None
+    assert "B" in state.crowd_dirty
+    assert registry.stats()["evicted"] == 1
@@ -0,0 +1,76 @@
+from services.station_resolver import RESOLVE_MEMO_SIZE, StationResolver, normalize
+
+STATIONS = ["CSMT", "Panvel", "Vashi", "Vadala Road", "Kurla"]
+ALIASES = {
+    "CST": "CSMT",
+    "Chhatrapati Shivaji Maharaj Terminus": "CSMT",
+    "Wadala": "Vadala Road",
+    "Ghost": "NOT_A_STATION",
+}
+
+
+def make_resolver():
+    return StationResolver(STATIONS, ALIASES)
+
+
+def test_normalize_folds_case_and_punctuation():
+    assert normalize("C.S.T. ") == "cst"
+    assert normalize("Vadala  Road") == "vadalaroad"
+
+
+def test_exact_names_and_aliases():
+    resolver = make_resolver()
+    assert resolver.resolve("Panvel") == "Panvel"
+    assert resolver.resolve("CST") == "CSMT"
+    assert resolver.resolve("Wadala") == "Vadala Road"
+    assert resolver.counts["exact"] == 3
+
+
+def test_aliases_to_unknown_stations_are_ignored():
+    assert make_resolver().resolve("Ghost") is None
+
+
+def test_folded_match():
+    resolver = make_resolver()
+    assert resolver.resolve("c.s.m.t") == "CSMT"
+    assert resolver.resolve("chhatrapati shivaji maharaj terminus") == "CSMT"
+    assert resolver.counts["folded"] == 2
+
+
+def test_unique_prefix_only():
+    resolver = make_resolver()
+    assert resolver.resolve("Panv") == "Panvel"
+    assert resolver.resolve("Va") is None      # too short
+    assert resolver.resolve("Vas") == "Vashi"
+    assert resolver.resolve("Vad") == "Vadala Road"
+
+
+def test_ambiguous_prefix_is_rejected():
+    resolver = StationResolver(["Vashi", "Vasai Road"], {})
+    assert resolver._by_prefix("vas") is None
+    assert resolver.resolve("Vasai") == "Vasai Road"
+
+
+def test_trigram_fuzzy_match_for_typos():
+    resolver = make_resolver()
+    assert resolver.resolve("Panvl") == "Panvel"
+    assert resolver.resolve("Kurlaa") == "Kurla"
+    assert resolver.counts["fuzzy"] == 2
+
+
+def test_unrelated_names_miss():
+    resolver = make_resolver()
+    assert resolver.resolve("Xyzzy") is None
+    assert resolver.resolve("") is None
+    assert resolver.resolve(None) is None
+
+
+def test_memo_caches_misses_and_stays_bounded():
+    resolver = make_resolver()
+    resolver.resolve("Xyzzy")
+    resolver.resolve("Xyzzy")
+    assert resolver.counts["miss"] == 1
+
+    for i in range(RESOLVE_MEMO_SIZE + 10):
+        resolver.resolve(f"unknown-{i}")
+    assert len(resolver._memo) <= RESOLVE_MEMO_SIZE
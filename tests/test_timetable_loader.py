@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from app.db_models import Station, TrainSchedule
+from services.timetable_loader import swap_in
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(" ".join(statement.split()))
+
+
+def test_swap_in_reattaches_serial_default_past_imported_ids():
+    cursor = RecordingCursor()
+    swap_in(cursor, SimpleNamespace(dialect=postgresql.dialect()), [TrainSchedule.__table__])
+
+    statements = cursor.statements
+    assert statements[:3] == [
+        "DROP TABLE train_schedule",
+        "ALTER TABLE train_schedule_staging RENAME TO train_schedule",
+        "ALTER TABLE train_schedule ADD PRIMARY KEY (id)",
+    ]
+    assert statements[-3:] == [
+        "CREATE SEQUENCE train_schedule_id_seq OWNED BY train_schedule.id",
+        "ALTER TABLE train_schedule ALTER COLUMN id SET DEFAULT nextval('train_schedule_id_seq')",
+        "SELECT setval('train_schedule_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM train_schedule",
+    ]
+
+
+def test_swap_in_leaves_natural_keys_alone():
+    cursor = RecordingCursor()
+    swap_in(cursor, SimpleNamespace(dialect=postgresql.dialect()), [Station.__table__])
+
+    assert not any("SEQUENCE" in s or "DEFAULT" in s for s in cursor.statements)
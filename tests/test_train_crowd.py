@@ -0,0 +1,76 @@
+from app import state
+from app.crowd_store import DENSITY_CODE
+from app.models import CrowdDensityLevel, DataSource
+from services import crowd_service
+from services.crowd_service import CrowdService
+from services.station_registry import StationRegistry
+
+
+class FakeTimetable:
+    def __init__(self, positions):
+        self.positions = positions
+
+    def train_position(self, train_no, minute):
+        station_id = self.positions.get(train_no)
+        return (station_id, minute) if station_id else None
+
+
+def test_timetable_position_wins_over_requested_station():
+    state.timetable_index = FakeTimetable({"95001": "PNVL"})
+    service = CrowdService()
+
+    crowd = service.get_train_crowd("95001", station="CSMT")
+    assert (crowd["station"], crowd["position"]) == ("PNVL", "timetable")
+
+    crowd = service.get_train_crowd("95002", station="CSMT")
+    assert (crowd["station"], crowd["position"]) == ("CSMT", "requested_station")
+
+
+def test_position_follows_the_requested_minute():
+    class Route(FakeTimetable):
+        def train_position(self, train_no, minute):
+            return ("CSMT", minute) if minute < 600 else ("PNVL", minute)
+
+    state.timetable_index = Route({})
+    service = CrowdService()
+
+    assert service.get_train_crowd("95001", minute=540)["station"] == "CSMT"
+    assert service.get_train_crowd("95001", minute=660)["station"] == "PNVL"
+    assert list(service._train_crowd_cache) == ["95001"]
+
+
+def test_cached_until_station_changes():
+    service = CrowdService()
+    first = service.get_train_crowd("95001", station="CSMT")
+    assert service.get_train_crowd("95001", station="CSMT") is first
+
+    state.crowd_state.update_coach("CSMT", "C1", density=CrowdDensityLevel.VERY_HIGH)
+    state.mark_crowd_dirty("CSMT", "C1")
+    assert service.get_train_crowd("95001", station="CSMT") is not first
+
+
+def test_cache_is_lru_bounded(monkeypatch):
+    monkeypatch.setattr(crowd_service, "TRAIN_CROWD_CACHE_SIZE", 2)
+    service = CrowdService()
+
+    kept = service.get_train_crowd("1", station="CSMT")
+    service.get_train_crowd("2", station="CSMT")
+    service.get_train_crowd("1", station="CSMT")   # refresh "1"
+    service.get_train_crowd("3", station="CSMT")   # evicts "2", not everything
+
+    assert list(service._train_crowd_cache) == ["1", "3"]
+    assert service.get_train_crowd("1", station="CSMT") is kept
+
+
+def test_fallback_without_live_row_is_deterministic():
+    state.station_registry = StationRegistry(
+        state.crowd_state, state.user_signals, is_registered=lambda s: False
+    )
+    service = CrowdService()
+
+    crowds = [service.get_train_crowd("95001", station="NOWHERE") for _ in range(20)]
+
+    assert {c["level"] for c in crowds} == {crowds[0]["level"]}
+    assert crowds[0]["source"] == DataSource.PREDICTION
+    assert crowds[0]["score"] == DENSITY_CODE[crowds[0]["level"]] + 1
+    assert "NOWHERE" not in state.crowd_state
@@ -0,0 +1,183 @@
+import asyncio
+import json
+
+from app import state
+from app.crowd_store import DENSITY_CODE
+from app.models import CrowdDensityLevel, DataSource
+from app.websocket import ClientConnection, ConnectionManager
+
+MEDIUM = DENSITY_CODE[CrowdDensityLevel.MEDIUM]
+coach_ids = state.crowd_state.coach_ids
+
+
+def put_station(station_id):
+    state.crowd_state.put_station(
+        station_id, density=[MEDIUM] * len(coach_ids), trend=[0] * len(coach_ids),
+        confidence=[0.8] * len(coach_ids), overall=MEDIUM, ts=0.0
+    )
+    state.mark_crowd_dirty(station_id)
+
+
+def change_coach(station_id, coach_id="C1", density=CrowdDensityLevel.VERY_HIGH):
+    state.crowd_state.update_coach(station_id, coach_id, density=density, source=DataSource.USER_REPORT)
+    state.mark_crowd_dirty(station_id, coach_id)
+
+
+def connect(manager, topics=()):
+    """A client that has just been sent its initial snapshot."""
+    websocket = object()
+    client = ClientConnection(websocket, manager)
+    manager.connections[websocket] = client
+    manager.subscribe(websocket, set(topics))
+    manager.snapshot_frame("initial_state", client)
+    client.version = manager.version
+    return client
+
+
+def take_frame(client):
+    """What the sender task would send next (None if nothing)."""
+    frame, client.pending_state = client.pending_state, None
+    return json.loads(frame) if frame else None
+
+
+def broadcast(manager):
+    asyncio.run(manager.broadcast_current_state())
+
+
+def test_initial_load_is_baseline_not_delta():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    client = connect(manager)
+
+    broadcast(manager)
+    assert take_frame(client) is None
+
+
+def test_delta_base_version_is_per_client():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    put_station("PNVL")
+    csmt = connect(manager, {"station:CSMT"})
+    pnvl = connect(manager, {"station:PNVL"})
+    everything = connect(manager)
+    start = manager.version
+
+    change_coach("PNVL")
+    broadcast(manager)
+
+    assert take_frame(csmt) is None
+    frame = take_frame(pnvl)
+    assert (frame["base_version"], frame["version"]) == (start, manager.version)
+    assert list(frame["data"]) == ["PNVL"]
+    assert take_frame(everything)["base_version"] == start
+    after_pnvl = manager.version
+
+    change_coach("CSMT")
+    broadcast(manager)
+
+    # CSMT's subscriber skipped the PNVL tick: no gap from its point of view
+    frame = take_frame(csmt)
+    assert (frame["base_version"], frame["version"]) == (start, manager.version)
+    assert frame["data"]["CSMT"]["coaches"]["C1"]["density"] == "VERY_HIGH"
+    assert take_frame(pnvl) is None
+    assert take_frame(everything)["base_version"] == after_pnvl
+
+
+def handle(manager, client, message):
+    asyncio.run(manager.handle_client_message(client.websocket, json.dumps(message)))
+
+
+def test_subscribe_requests_snapshot_of_subscribed_stations():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    put_station("PNVL")
+    client = connect(manager)
+
+    handle(manager, client, {"type": "subscribe", "stations": ["CSMT"]})
+
+    assert client.needs_snapshot == "crowd_snapshot"
+    assert list(json.loads(manager.snapshot_frame("crowd_snapshot", client))["data"]) == ["CSMT"]
+
+
+def test_unsubscribing_last_topic_requests_full_snapshot():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    put_station("PNVL")
+    client = connect(manager, {"station:CSMT", "station:PNVL"})
+
+    handle(manager, client, {"type": "unsubscribe", "stations": ["PNVL"]})
+    assert client.needs_snapshot is None
+
+    handle(manager, client, {"type": "unsubscribe", "stations": ["CSMT"]})
+    assert client.needs_snapshot == "crowd_snapshot"
+    snapshot = json.loads(manager.snapshot_frame("crowd_snapshot", client))
+    assert sorted(snapshot["data"]) == ["CSMT", "PNVL"]
+
+
+def test_unsent_delta_coalesces_into_snapshot():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    client = connect(manager)
+
+    change_coach("CSMT")
+    broadcast(manager)
+    change_coach("CSMT", "C2")
+    broadcast(manager)
+
+    assert client.pending_state is None
+    assert client.needs_snapshot == "crowd_snapshot"
+
+
+class FakeTimetable:
+    def __init__(self, positions):
+        self.positions = positions
+
+    def train_position(self, train_no, minute):
+        station_id = self.positions.get(train_no)
+        return (station_id, minute) if station_id else None
+
+
+def test_train_topic_receives_crowd_of_its_current_station():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    put_station("PNVL")
+    state.timetable_index = FakeTimetable({"95001": "CSMT"})
+    client = connect(manager, {"train:95001"})
+
+    change_coach("PNVL")
+    change_coach("CSMT")
+    broadcast(manager)
+
+    assert list(take_frame(client)["data"]) == ["CSMT"]
+
+
+def test_train_moving_on_triggers_snapshot_of_new_station():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    put_station("PNVL")
+    timetable = FakeTimetable({"95001": "CSMT"})
+    state.timetable_index = timetable
+    client = connect(manager, {"train:95001"})
+    broadcast(manager)
+
+    timetable.positions["95001"] = "PNVL"
+    broadcast(manager)
+
+    assert client.needs_snapshot == "crowd_snapshot"
+    snapshot = json.loads(manager.snapshot_frame("crowd_snapshot", client))
+    assert list(snapshot["data"]) == ["PNVL"]
+
+
+def test_stations_reappearing_after_empty_view_are_broadcast():
+    manager = ConnectionManager()
+    put_station("CSMT")
+    client = connect(manager)
+
+    state.crowd_state.remove_station("CSMT")
+    state.mark_crowd_dirty("CSMT")
+    broadcast(manager)
+    assert take_frame(client)["data"] == {"CSMT": None}
+
+    put_station("PNVL")
+    broadcast(manager)
+    assert list(take_frame(client)["data"]) == ["PNVL"]